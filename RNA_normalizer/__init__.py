@@ -19,18 +19,40 @@
 #  
 #  core functions for rna structure manipulation and comparison
 
-import copy
+import importlib
+import io
 import math
 import os
+import sys
 
-from Bio.PDB import *
-
+# Bio.PDB (and numpy behind it) is only imported where a structure is
+# parsed, fitted or written, so importing the package stays cheap
 from .msgs import *
+from .fileio import *
 from .mcannotate import *
 #'from .utils import *
-from .extract import *
 
-BIN_DIR=os.getcwd()
+# names resolved on first access: (module, attribute or None for the module)
+_LAZY = {
+	"extract": ("extract", None),
+	"fit": ("fit", None),
+	"utils": ("utils", None),
+	"MySelect": ("extract", "MySelect"),
+	"WritePDB": ("extract", "WritePDB"),
+	"parse_res_list": ("extract", "parse_res_list"),
+	"extract_PDB": ("extract", "extract_PDB"),
+}
+
+def __getattr__(name):
+	entry = _LAZY.get( name, None )
+	if( entry is None ):
+		raise AttributeError( "module '%s' has no attribute '%s'" %(__name__, name) )
+	
+	module = importlib.import_module( ".%s" %entry[0], __name__ )
+	value = module if entry[1] is None else getattr( module, entry[1] )
+	globals()[name] = value
+	return value
+
 # from: http://www.cs.princeton.edu/introcs/21function/ErrorFunction.java.html
 # Implements the Gauss error function.
 #   erf(z) = 2 / sqrt(pi) * integral(exp(-t*t), t = 0..z)
@@ -64,19 +86,22 @@ class PDBNormalizer:
 		self._load_atom_list( fatoms_list )
 		
 	def parse( self, finput, foutput ):
-		# state variables for the parse process
-		self._in_model = False
-		self._in_atom = False
-		
-		self._chain_found = False
-		self._row_count = 0
-		self._ok = True
+		(ok, out_txt) = self.parse_lines( iter_lines( finput ), finput )
 
-		out_txt = ""
-		
-		fi = open( finput )
+		if( ok ):
+			open( foutput, "w" ).write( out_txt )
+
+		return( ok )
+	
+	# normalizes the rows of a PDB held in memory, returns (ok, normalized text)
+	def parse_lines( self, rows, name="" ):
+		self.reset( name )
+
+		out = []
+		# fields of the atoms read since the last TER, written a block at a time
+		atoms = []
 	
-		for row in fi:
+		for row in rows:
 			self._row_count += 1
 			
 			row = row.strip()
@@ -92,22 +117,50 @@ class PDBNormalizer:
 			elif( rec_name[:3] == "TER" ):
 				row = self.parse_ter( row )
 			elif( rec_name in ("ATOM  ", "HETATM") ):
-				row = self.parse_atom( row )
+				atom = self.parse_atom( row )
+				if( atom is not None ):
+					atoms.append( atom )
+				continue
 			else:
 				continue
 			
 			if( row != "" ):
-				out_txt += row + "\n"
-		
-		fi.close()
+				self.write_atoms( atoms, out )
+				atoms = []
+				out.append( row + "\n" )
 		
+		self.write_atoms( atoms, out )
 		if( self._in_atom ):
-			out_txt += "TER\n"
+			out.append( "TER\n" )
 
-		if( self._ok ):
-			open( foutput, "w" ).write( out_txt )
+		self._diag.emit()
 
-		return( self._ok )
+		return( self._ok, "".join( out ) )
+	
+	# the columns of the normalized PDBs (see pdbwriter.py); the tabs before
+	# the element are kept so that the normalized files do not change
+	ATOM_COLUMNS = ("serial", "name", "alt", "res_name", "chain", "res_pos", "icode", "x", "y", "z", "bfactor", "element", "charge")
+	
+	def write_atoms( self, atoms, out ):
+		if( len(atoms) == 0 ):
+			return
+		
+		from .pdbwriter import format_atoms
+		
+		columns = dict( zip( self.ATOM_COLUMNS, zip( *atoms ) ) )
+		columns["occupancy"] = "  1.00"
+		columns["gap"] = "\t\t  "
+		out.append( format_atoms( columns ) )
+	
+	def reset( self, name="" ):
+		# state variables for the parse process
+		self._in_model = False
+		self._in_atom = False
+		
+		self._chain_found = False
+		self._row_count = 0
+		self._ok = True
+		self._diag = Diagnostics( name )
 	
 	def parse_model(self, row ):
 		if( self._in_model ):
@@ -122,11 +175,11 @@ class PDBNormalizer:
 	def parse_endmdl(self, row):
 		
 		if( not self._in_model ):
-			msgs.show( "Warning", "Missing 'MODEL' declaration." )
+			self._diag.add( "Warning", "Missing 'MODEL' declaration." )
 			#~ self.show_err( "Missing 'MODEL' declaration." )
 		
 		if( self._in_atom ):
-			show( "Warning", "Missing 'TER' declaration." )
+			self._diag.add( "Warning", "Missing 'TER' declaration." )
 			#~ self.show_err( "Missing 'TER' declaration." )
 		self._in_model = False
 		self._in_atom = False
@@ -158,25 +211,12 @@ class PDBNormalizer:
 		element = row[76:78]
 		charge = row[78:80]
 
-		# check residue name
-		resName_norm = self._res_list.get( resName, None )
-		if( resName_norm is None ):
-			self.show_err( "Unknown residue name: '%s'." %resName )
-			return ""
-		elif( resName_norm == "-" ):
-			return ""
-
-		resName = resName_norm
-
-		# check atom name
-		name_norm = self._atom_list.get( name, None )
-		if( name_norm is None ):
-			self.show_err( "Unknown atom name: '%s' in residue'%s'" %(name, resName) )
-			return ""
-		elif( name_norm == "-" ):
-			return ""
+		names = self.normalize_names( resName, name )
+		if( names is None ):
+			return None
 		
-		name = name_norm.ljust(3)
+		(resName, name) = names
+		name = name.ljust(3)
 		
 		# check chainID
 		if( chainID == " " ):
@@ -190,8 +230,7 @@ class PDBNormalizer:
 		# check occupancy
 		#if( occupancy == "" ):
 		
-		# This is the only that works with MolProbity
-		occupancy = "  1.00"
+		# This is the only that works with MolProbity (see write_atoms())
 
 		# check tempFactor
 		if( tempFactor == "" ):
@@ -202,15 +241,36 @@ class PDBNormalizer:
 			element = name[0]
 
 		self._in_atom = True
-		return "ATOM  %5s  %3s%s%3s %s%4d%s   %8s%8s%8s%6s%6s		  %2s%2s" %(serial, name, altLoc, resName, chainID, resSeq, iCode, x, y, z, occupancy, tempFactor, element, charge)
+		# fields in ATOM_COLUMNS order
+		return( (serial, " " + name, altLoc, resName, chainID, resSeq, iCode, x, y, z, tempFactor, element, charge) )
 
+	# normalized (residue, atom) names, None when the atom is dropped
+	def normalize_names( self, resName, name ):
+		# check residue name
+		resName_norm = self._res_list.get( resName, None )
+		if( resName_norm is None ):
+			self.show_err( "Unknown residue name: '%s'." %resName )
+			return None
+		elif( resName_norm == "-" ):
+			return None
+
+		# check atom name
+		name_norm = self._atom_list.get( name, None )
+		if( name_norm is None ):
+			self.show_err( "Unknown atom name: '%s' in residue'%s'" %(name, resName_norm) )
+			return None
+		elif( name_norm == "-" ):
+			return None
+		
+		return( resName_norm, name_norm )
+	
 	def show_err( self, msg ):
-		show( "ERROR", "Line %d: %s\n" %(self._row_count, msg) )
+		self._diag.add( "ERROR", msg, "Line %d: %s" %(self._row_count, msg) )
 		self._ok = False
 
 	def _load_res_list(self, fres_list):
 		# read residues list
-		pairs = map( lambda x: x.split(), filter( lambda row: not row.startswith( "#" ), open( fres_list ).read().strip().split( "\n" ) ) )
+		pairs = map( lambda x: x.split(), filter( lambda row: not row.startswith( "#" ), read_text( fres_list ).strip().split( "\n" ) ) )
 
 		self._res_list = {}		 
 		for (name, nt) in pairs:
@@ -218,7 +278,7 @@ class PDBNormalizer:
 
 	def _load_atom_list(self, fatoms_list):
 		# read residues list
-		pairs = map( lambda x: x.split(), filter( lambda row: not row.startswith( "#" ), open( fatoms_list ).read().strip().split( "\n" ) ) )
+		pairs = map( lambda x: x.split(), filter( lambda row: not row.startswith( "#" ), read_text( fatoms_list ).strip().split( "\n" ) ) )
 
 		self._atom_list = {}		 
 		for (name, name_norm) in pairs:
@@ -248,27 +308,175 @@ class PDBStruct(object):
 		self._res_seq = []
 		self._res_index = {}
 		self._interactions = []
+		self._arrays = None
+		self._descriptors = None
+		# the annotations, kept to rank them again (see reindex)
+		self._mca = None
+		# the stages left: the parse (a function opening the structure) and
+		# the annotations (a function returning them, or None for the default
+		# annotator), done on first use
+		self._source = None
+		self._annotated = True
+		self._pending_mca = None
+		self._index_txt = None
+		# what the structure was read from, for content_key()
+		self._content = None
 		#self._brackets = []
 		#self._wcpairs = []
 	
 	def load(self, pdb_file, index_name=None ):
+		from .mmcif import is_cif
+		if( is_cif( pdb_file ) ):
+			return( self.load_cif( pdb_file, index_name ) )
+		
 		self._pdb_file = pdb_file
+		self._arrays = None
+		self._struct = None
 		
-		ok = self._load_struct()
+		# only the residues are read now: the structure is parsed when its
+		# atoms are needed and annotated when its interactions are
+		self._source = lambda: open_input( pdb_file )
+		self._annotated = False
+		self._pending_mca = None
+		self._content = (pdb_file,)
+		ok = self._scan_struct()
 		
 		if( ok and not index_name is None ):
 			ok = self._load_index( index_name )
 		else:
 			ok = self._load_index2()
-			
-		if( ok ):
-			ok = self._load_annotations_3D()
+		
 		#~ print pdb_file,self._interactions,index_name
 		#if( ok and not fbrackets is None ):
 		#	ok = self._load_brackets( fbrackets )
 		
 		return( ok )
 	
+	# same as load() for a structure held in memory, e.g. an archive member;
+	# without 'mcout_txt' MC-Annotate runs on a temporary copy
+	def load_text(self, name, pdb_txt, index_txt=None, mcout_txt=None ):
+		self._pdb_file = name
+		self._arrays = None
+		self._struct = None
+		
+		def annotations():
+			mca = None
+			if( annotator() == "mcannotate" ):
+				mca = MCAnnotate()
+				if( mcout_txt is None ):
+					mca.load_text( pdb_txt )
+				else:
+					mca.parse_lines( io.StringIO( mcout_txt ) )
+			return( mca )
+		
+		self._source = lambda: io.StringIO( pdb_txt )
+		self._annotated = False
+		self._pending_mca = annotations
+		self._content = (None, pdb_txt, mcout_txt)
+		ok = self._scan_struct()
+		
+		if( ok and not index_txt is None ):
+			ok = self._load_index_text( index_txt )
+		else:
+			ok = self._load_index2()
+		
+		return( ok )
+	
+	# same as load() for an mmCIF file: the atom_site loop is streamed into the
+	# arrays, without a Bio.PDB structure (struct is None and so is the 'res'
+	# of the residues). 'normalizer' applies the residues.list/atoms.list rules
+	def load_cif(self, cif_file, index_name=None, normalizer=None ):
+		from .mmcif import read_atom_site
+		
+		self._pdb_file = cif_file
+		self._struct = None
+		self._source = None
+		self._annotated = False
+		self._pending_mca = None
+		self._content = (cif_file, "normalized" if normalizer is not None else None)
+		self._arrays = read_atom_site( cif_file, normalizer )
+		
+		if( self._arrays is None ):
+			return( False )
+		
+		arrays = self._arrays
+		self._res_list = []
+		self._res_seq = []
+		self._res_index = {}
+		for count in range( len(arrays.res_chain) ):
+			new_residue = Residue(str(arrays.res_chain[count]), int(arrays.res_pos[count]), str(arrays.res_name[count]), None)
+			
+			self._res_list.append( new_residue )
+			self._res_seq.append( count )
+			self._res_index[new_residue.key()] = [count, None]
+		
+		if( not index_name is None ):
+			ok = self._load_index( index_name )
+		else:
+			ok = self._load_index2()
+		
+		if( ok ):
+			for (key, (ndx, rank)) in self._res_index.items():
+				if( rank is not None ):
+					arrays.res_rank[ndx] = rank
+			arrays.defer_interactions( self._interaction_rows )
+		
+		return( ok )
+	
+	# ranks the residues with another index ('index_txt', every residue in
+	# order when None), keeping the structure and its annotations
+	def reindex(self, index_txt=None):
+		for entry in self._res_index.values():
+			entry[1] = None
+		
+		if( not index_txt is None ):
+			ok = self._load_index_text( index_txt )
+		else:
+			ok = self._load_index2()
+		
+		if( ok ):
+			if( (self._struct is None) and (self._source is None) ):
+				# mmCIF arrays are not rebuilt from the structure: new ranks only
+				import numpy as np
+				from .arrays import AtomArrays
+				fields = dict( [(name, getattr( self._arrays, name )) for name in AtomArrays.FIELDS if name != "interactions"] )
+				fields["interactions"] = self._arrays._interactions
+				fields["res_rank"] = np.full( len(self._res_list), -1, dtype=np.int32 )
+				for (ndx, rank) in self._res_index.values():
+					if( rank is not None ):
+						fields["res_rank"][ndx] = rank
+				self._arrays = AtomArrays( **fields )
+				if( not self._annotated ):
+					self._arrays.defer_interactions( self._interaction_rows )
+			else:
+				self._arrays = None
+			
+			# not annotated yet: ranked with this index when they are
+			if( self._annotated ):
+				ok = self._load_annotations_3D( self._mca )
+		
+		return( ok )
+	
+	# hash of the inputs of the structure (its file or text, and its index),
+	# the key of its results in a cache.ResultCache
+	def content_key(self):
+		from .cache import content_key, file_bytes
+		
+		if( self._content is None ):
+			return( None )
+		
+		source = file_bytes( self._content[0] ) if self._content[0] is not None else None
+		return( content_key( source, self._index_txt, *self._content[1:] ) )
+	
+	# hash of the .mcout file the interactions are read from (cache.mcout_key),
+	# None for a structure loaded from text (its .mcout is in content_key)
+	def mcout_key(self):
+		from .cache import mcout_key
+		
+		if( (self._content is None) or (self._content[0] is None) ):
+			return( None )
+		return( mcout_key( self._content[0] ) )
+	
 	def raw_sequence(self):
 		seq = ""
 		for ndx in self._res_seq:
@@ -277,6 +485,7 @@ class PDBStruct(object):
 		return seq
 
 	def res_sequence(self):
+		self._parse()
 		result = []
 		for ndx in self._res_seq:
 			result.append( self._res_list[ndx].res )
@@ -284,6 +493,7 @@ class PDBStruct(object):
 		return result
 
 	def get_interactions(self, type="ALL"):
+		self._annotate()
 		if( type == "ALL" ):
 			# "ALL": returns all interactions
 			return self._interactions
@@ -298,6 +508,7 @@ class PDBStruct(object):
 	
 	# --- properties ---
 	def struct_get(self):
+		self._parse()
 		return self._struct
 	
 	def res_seq_get(self):
@@ -309,22 +520,22 @@ class PDBStruct(object):
 	def pdb_file_get(self):
 		return self._pdb_file
 	
+	def arrays_get(self):
+		# numpy columns of the loaded structure, built on first use
+		if( self._arrays is None ):
+			from .arrays import struct_arrays
+			self._arrays = struct_arrays( self )
+		return self._arrays
+	
+	def descriptors_get(self):
+		# Rg, residue maps... of the loaded structure, cached (see descriptors.py)
+		if( (self._descriptors is None) or (self._descriptors.arrays is not self.arrays) ):
+			from .descriptors import Descriptors
+			self._descriptors = Descriptors( self.arrays )
+		return self._descriptors
+	
 	def rad_gir(self):
-		rmean = Vector([0.0, 0.0, 0.0])
-		count = 0
-		for res in self._res_list:
-			for a in res.res:
-				rmean += a.get_vector()
-				count += 1
-		
-		rmean = rmean/float(count)
-
-		rsum = 0.0
-		for res in self._res_list:
-			for a in res.res:
-				rsum += (a.get_vector() - rmean) * (a.get_vector() - rmean)
-		
-		return math.sqrt( rsum / count )
+		return self.descriptors.rg()
 		
 	
 	#def brackets_get(self):
@@ -334,12 +545,103 @@ class PDBStruct(object):
 	res_seq = property( res_seq_get )
 	res_list = property( res_list_get )
 	pdb_file = property( pdb_file_get )
+	arrays = property( arrays_get )
+	descriptors = property( descriptors_get )
 	#brackets = property( brackets_get )
 	# ---
 	
-	def _load_struct(self):
+	#
+	# the residues of the first model, as _load_struct() finds them, from the
+	# ATOM/HETATM records only: enough to check the index and the sequence
+	# before anything is parsed. Parses the structure when a record cannot be
+	# read this way
+	#
+	def _scan_struct(self):
+		chains = {}
+		order = []
+		with self._source() as f:
+			for line in f:
+				record = line[:6]
+				if( record == "ENDMDL" ):
+					break
+				if( (record != "ATOM  ") and (record != "HETATM") ):
+					continue
+				
+				try:
+					resseq = int(line[22:26])
+				except ValueError:
+					self._parse( False )
+					return( True )
+				
+				resname = line[17:20]
+				if( record == "HETATM" ):
+					hetfield = "W" if resname in ("HOH", "WAT") else "H_%s" %resname
+				else:
+					hetfield = " "
+				
+				chain = line[21:22]
+				if( chain not in chains ):
+					chains[chain] = {}
+					order.append( chain )
+				chains[chain].setdefault( (hetfield, resseq, line[26:27].strip()), resname.strip() )
+		
+		self._res_list = []
+		self._res_seq = []
+		self._res_index = {}
+		for chain in order:
+			for ((hetfield, resseq, icode), resname) in chains[chain].items():
+				new_residue = Residue(chain, resseq, resname, None)
+				
+				self._res_list.append( new_residue )
+				self._res_seq.append( len(self._res_list) - 1 )
+				self._res_index[new_residue.key()] = [len(self._res_list) - 1, None]
+		
+		return( True )
+	
+	# the parse stage: the structure replaces the scanned residues, ranked
+	# again with the same index. The index and the sequence were checked on
+	# the scanned residues: a structure parsed otherwise is fatal, as its
+	# ranks may be partly rebuilt ('scanned' False when nothing was scanned)
+	def _parse(self, scanned=True):
+		if( self._source is None ):
+			return
+		
+		(source, self._source) = (self._source, None)
+		residues = [(res.key(), res.nt) for res in self._res_list]
+		self._load_struct( source() )
+		
+		if( not self._index_txt is None ):
+			ok = self._load_index_text( self._index_txt )
+		else:
+			ok = self._load_index2()
+		
+		if( (not ok) or (scanned and (residues != [(res.key(), res.nt) for res in self._res_list])) ):
+			show( "FATAL", "The residues of '%s' do not match those read before parsing it" %self._pdb_file )
+	
+	# the annotation stage
+	def _annotate(self):
+		if( self._annotated ):
+			return
+		
+		self._annotated = True
+		mca = self._pending_mca() if self._pending_mca is not None else None
+		self._pending_mca = None
+		self._load_annotations_3D( mca )
+	
+	def _interaction_rows(self):
+		from . import interactions as inter
+		return( inter.encode( self.get_interactions() ) )
+	
+	def _load_struct(self, f=None):
+		from Bio.PDB import PDBParser
+		
 		parser = PDBParser()
-		self._struct = parser.get_structure( "struct", self._pdb_file )
+		if( f is None ):
+			f = open_input( self._pdb_file )
+		try:
+			self._struct = parser.get_structure( "struct", f )
+		finally:
+			f.close()
 		
 		if( len(self._struct) > 1 ):
 			show( "WARNING", "%d models found. Only the first will be used!" %(len(self._struct)) )
@@ -364,9 +666,13 @@ class PDBStruct(object):
 		return( True )
 			
 	def _load_index(self, index_name):
+		return( self._load_index_text( read_text( index_name ) ) )
+	
+	def _load_index_text(self, index_txt):
+		self._index_txt = index_txt
 		self._res_seq = []
 		entries = []
-		for row in open( index_name ).read().split( "\n" ):
+		for row in index_txt.split( "\n" ):
 			row = row.strip()
 			if( (not row.startswith( "#" )) and (row != "") ):
 				entries.extend( map( lambda row: row.split( ":" ), row.split( "," ) ) )
@@ -402,16 +708,23 @@ class PDBStruct(object):
 		return( True )
 	
 	def _load_index2(self):
+		self._index_txt = None
 		self._res_seq = []
-		for i in xrange( 0, len(self._res_list) ):
+		for i in range( 0, len(self._res_list) ):
 			self._res_seq.append( i )
 			self._res_index[self._res_list[i].key()][1] = (len(self._res_seq) - 1)
 		return True 
 
-	def _load_annotations_3D(self):
+	def _load_annotations_3D(self, mca=None):
 		self._interactions = []
-		mca = MCAnnotate()
-		mca.load( self._pdb_file, os.path.dirname( self._pdb_file ) )
+		if( mca is None and annotator() == "geometric" ):
+			from .annotate import GeometricAnnotator
+			mca = GeometricAnnotator()
+			mca.load_arrays( self.arrays )
+		elif( mca is None ):
+			mca = MCAnnotate()
+			mca.load( self._pdb_file, os.path.dirname( self._pdb_file ) )
+		self._mca = mca
 		#~ print mca.interactions
 		for (type, chain_a, pos_a, nt_a, chain_b, pos_b, nt_b, extra1, extra2, extra3) in mca.interactions:
 			# get the rank of the first position of the pair
@@ -427,10 +740,18 @@ class PDBStruct(object):
 			else:
 				extra = "%s%s" %(extra1, extra2)
 			self._interactions.append( (type, min( rank_a, rank_b ), max( rank_a, rank_b ), extra ))
+		
+		# the arrays may have been built before the annotations
+		if( self._arrays is not None ):
+			from . import interactions as inter
+			self._arrays.interactions = inter.encode( self._interactions )
+		
+		return( True )
 		 
 	def _get_index(self, chain, pos, field):
 		key = "%s:%s" %(chain, pos)
-		data = self._res_index.get( key, None )[field]
+		entry = self._res_index.get( key, None )
+		data = entry[field] if entry is not None else None
 		if data is None and field == 0:
 			sys.stderr.write("ERROR	Bad index key: '%s'\n" %key)
 		
@@ -442,26 +763,69 @@ class PDBComparer:
 	ALL_ATOMS = BACKBONE_ATOMS + HEAVY_ATOMS
 
 	RMSDD_ATOMS =	["C4", "C8", "P", "C1'"]
+	
+	# metrics filled in by score(); each one also computes those it depends on
+	METRICS = ("rmsd", "pvalue", "DI_ALL", "INF_ALL", "INF_WC", "INF_NWC", "INF_STACK", "rg", "residue_rmsd", "subset_rmsd", "local_rmsd", "clashscore")
+	# metrics of score() when none are requested: "clashscore" would replace
+	# the MolProbity value of Eval.clashscore (utils.molprobity_parse) and
+	# "local_rmsd" profiles every residue for every window size, so they are
+	# only computed on request
+	DEFAULT_METRICS = tuple( [metric for metric in METRICS if metric not in ("local_rmsd", "clashscore")] )
+	METRIC_DEPS = { "pvalue": ("rmsd",), "DI_ALL": ("rmsd", "INF_ALL"), "residue_rmsd": ("rmsd",), "subset_rmsd": ("rmsd",), "local_rmsd": ("rmsd",) }
+	INF_TYPES = { "INF_ALL": "ALL", "INF_WC": "PAIR_2D", "INF_NWC": "PAIR_3D", "INF_STACK": "STACK" }
+	# atom subsets of the "subset_rmsd" metric
+	SUBSETS = { "all": ALL_ATOMS, "backbone": BACKBONE_ATOMS, "base": HEAVY_ATOMS, "rmsdd": RMSDD_ATOMS }
+	# window sizes (in residues) of the "local_rmsd" metric
+	LOCAL_WINDOWS = (3, 5, 9)
+	# the Eval attributes each metric fills, and the version of its
+	# implementation: bumping a version invalidates the cached results of the
+	# metric and of the metrics depending on it (see cache.py)
+	METRIC_FIELDS = { "pvalue": ("pvalue", "pvalue_plus", "pvalue_minus") }
+	METRIC_VERSIONS = dict( [(metric, 1) for metric in METRICS] )
+	MCQ_JAR = "mcq.ws.client-0.0.1-SNAPSHOT-jar-with-dependencies.jar"
 
 
 	def __init__(self):
 		pass
 	
 	def mcq(self, f1,f2):
-		cmd='java -cp %s/mcq.ws.client-0.0.1-SNAPSHOT-jar-with-dependencies.jar pl.poznan.put.mcq.ws.client.Global -m %s -t %s >mcq.log'%(BIN_DIR,f1,f2)
+		cmd='%s >mcq.log'%(' '.join(self.mcq_command(f1,f2)))
 		os.system(cmd)
 		try:
-			v=float(open('mcq.log').read().strip())
+			txt=open('mcq.log').read()
 		except Exception:
-			v=0
-		return v
+			txt=''
+		return self.mcq_value(txt)
 	
 	def gdt(self, f1, f2):
-		cmd='java -jar %s/gdt.jar %s %s >gdt.log'%(BIN_DIR,f2,f1)
+		cmd='%s >gdt.log'%(' '.join(self.gdt_command(f1,f2)))
 		#~ print cmd
 		os.system(cmd)
 		try:
-			x=open('gdt.log').read().strip().split('\n')[1].split(',')[-1]
+			txt=open('gdt.log').read()
+		except Exception:
+			txt=''
+		return self.gdt_value(txt)
+	
+	# the command lines of the MCQ and GDT jars, as argument lists, and the
+	# value of their output (0 when there is none); pipeline.py runs them
+	# as subprocesses of its own
+	def mcq_command(self, f1, f2):
+		return ['java', '-cp', '%s/%s'%(bin_dir(),self.MCQ_JAR), 'pl.poznan.put.mcq.ws.client.Global', '-m', f1, '-t', f2]
+	
+	def mcq_value(self, txt):
+		try:
+			v=float(txt.strip())
+		except Exception:
+			v=0
+		return v
+	
+	def gdt_command(self, f1, f2):
+		return ['java', '-jar', '%s/gdt.jar'%bin_dir(), f2, f1]
+	
+	def gdt_value(self, txt):
+		try:
+			x=txt.strip().split('\n')[1].split(',')[-1]
 			if x == 'NaN':return 0
 			v=float(x)
 		except Exception:
@@ -469,32 +833,73 @@ class PDBComparer:
 		return v
 	
 	def rmsd( self, src_struct, trg_struct, fit_pdb=None ):
-		# for each model in the reference
-		src_residues = src_struct.res_sequence()
-		trg_residues = trg_struct.res_sequence()
-		
-		atoms = self._get_atoms_struct( PDBComparer.ALL_ATOMS, src_residues, trg_residues )
+		diag = Diagnostics( trg_struct.pdb_file )
+		fit = self.superimpose_arrays( src_struct.arrays, trg_struct.arrays, diag )
+		diag.emit()
 		
-		if( not atoms is None ):
-			(src_atoms, trg_atoms) = atoms
-		else:
+		if( fit is None ):
 			return None
-
-		# compute the rmsd value and apply it to the target structure			
-		sup = Superimposer()
-		sup.set_atoms( src_atoms, trg_atoms )
 		
-		# we copy the fit_struct to leave the target struct unmodified for posterior processing
-		fit_struct = copy.deepcopy( trg_struct.struct )
-		sup.apply( fit_struct.get_atoms() )
-				
-		# save the fitted structure
+		(rot, tran, rms) = fit
+		
+		# the target is left unmodified: only the coordinates written are fitted
 		if( not fit_pdb is None ):
-			io = PDBIO()
-			io.set_structure( fit_struct )
-			io.save( fit_pdb )
+			import numpy as np
+			from .pdbwriter import write_arrays
+			
+			arrays = trg_struct.arrays
+			write_arrays( arrays, fit_pdb, np.dot( arrays.coords, rot ) + tran )
 
-		return sup.rms
+		return rms
+	
+	# RMSD under the best correspondence of the identical chains of the two
+	# structures (see chains.py): a ChainAssignment with the chain mapping, or
+	# None. chains.permuted_index() gives the model index of the mapping
+	def rmsd_chains( self, src_struct, trg_struct ):
+		from .chains import search_chains
+		return search_chains( src_struct, trg_struct )
+	
+	# global RMSD and residue profiles of the local RMSD over windows of k
+	# consecutive residues of the index, for each k of 'windows' (see local.py):
+	# (rms, {k: profile}), or None
+	def local_rmsd( self, src_struct, trg_struct, windows=None ):
+		from .utils import Eval
+		
+		eval = Eval( original=trg_struct.pdb_file )
+		windows = self.LOCAL_WINDOWS if windows is None else windows
+		self.score( src_struct, trg_struct, eval, ("local_rmsd",), windows=windows )
+		
+		if( not eval.ok ):
+			return None
+		
+		return (eval.rmsd, eval.local_rmsd)
+	
+	# the 'k' structures of 'trg_structs' closest to 'src_struct' by RMSD, as
+	# when scoring every one with rmsd() but superimposing only the ones whose
+	# lower bounds can still reach the top k (see search.py): a NearestModels
+	# with the (rmsd, position in trg_structs) of the hits
+	def nearest( self, src_struct, trg_structs, k ):
+		from .search import nearest_models
+		return nearest_models( src_struct.descriptors, [trg_struct.descriptors for trg_struct in trg_structs], k, self.rmsd_arrays )
+	
+	# same as rmsd() on the AtomArrays of two structures, e.g. attached from shared memory
+	def rmsd_arrays( self, src_arrays, trg_arrays, diag=None ):
+		fit = self.superimpose_arrays( src_arrays, trg_arrays, diag )
+		
+		if( fit is None ):
+			return None
+		
+		return fit[2]
+	
+	def superimpose_arrays( self, src_arrays, trg_arrays, diag=None ):
+		from .arrays import match_atoms, superimpose
+		
+		matched = match_atoms( src_arrays, trg_arrays, diag )
+		if( matched is None ):
+			return None
+		
+		(src_ndx, trg_ndx) = matched
+		return superimpose( src_arrays.coords[src_ndx], trg_arrays.coords[trg_ndx] )
 		
 	
 	# From Hajdin et al., RNA (7) 16, 2010 
@@ -517,46 +922,155 @@ class PDBComparer:
 		return( pv )
 
 	def INF(self, src_struct, trg_struct, type):
-		(P, TP, FP, FN) = (0, 0, 0, 0)
-		
-		for (stype, sb1, sb2, sextra) in src_struct.get_interactions( type ):
-			P += 1
-			found = False
-			for (ttype, tb1, tb2, textra) in trg_struct.get_interactions( type ):
-				if( (stype==ttype) and (sb1==tb1) and (sb2==tb2) and (sextra==textra) ):
-					found = True
-					break
+		return( self.INF_keys( src_struct.arrays.packed_interactions( type ), trg_struct.arrays.packed_interactions( type ) ) )
+	
+	# same as INF() on encoded interaction rows (see interactions.py)
+	def INF_arrays(self, src_rows, trg_rows):
+		from . import interactions as inter
+		return( self.INF_keys( inter.sorted_keys( src_rows ), inter.sorted_keys( trg_rows ) ) )
+	
+	# same as INF() on sorted packed interaction keys (see AtomArrays.packed_interactions)
+	def INF_keys(self, src_keys, trg_keys):
+		from . import interactions as inter
+		return( inter.inf( *inter.confusion( src_keys, trg_keys ) ) )
+	
+	# INF of each of the AtomArrays in 'trg_arrays_list' against 'src_arrays'
+	# (same index), in one pass; returns a numpy array
+	def INF_batch(self, src_arrays, trg_arrays_list, type="ALL"):
+		from . import interactions as inter
+		
+		src_keys = src_arrays.packed_interactions( type )
+		trg_keys = [trg_arrays.packed_interactions( type ) for trg_arrays in trg_arrays_list]
+		return( inter.inf( *inter.batch_confusion( src_keys, trg_keys ) ) )
+	
+	# the requested 'metrics' (DEFAULT_METRICS when None) and the metrics they depend on
+	@classmethod
+	def wanted_metrics( cls, metrics=None ):
+		wanted = set()
+		for metric in (cls.DEFAULT_METRICS if metrics is None else metrics):
+			if( metric not in cls.METRICS ):
+				show( "FATAL", "Unknown metric '%s', expected one of: %s" %(metric, ", ".join( cls.METRICS )) )
+			wanted.add( metric )
+			wanted.update( cls.METRIC_DEPS.get( metric, () ) )
+		return( wanted )
+	
+	# all the requested metrics of 'trg_struct' against 'src_struct' from a
+	# single superposition, filled into 'eval' (a new Eval when None). With a
+	# 'cache' (see cache.ResultCache) only the metrics not found there for
+	# the same inputs are computed, and then stored
+	def score( self, src_struct, trg_struct, eval=None, metrics=None, pvalue_param="-", fit_subset=None, windows=None, cache=None ):
+		from .utils import Eval
+		
+		if( eval is None ):
+			eval = Eval( original=trg_struct.pdb_file )
+		
+		options = (pvalue_param, fit_subset, windows)
+		if( cache is not None ):
+			from .cache import annotations_key
+			keys = (src_struct.content_key(), trg_struct.content_key())
+			annotations = annotations_key( src_struct.mcout_key(), trg_struct.mcout_key() )
+			metrics = cache.fetch( keys[0], keys[1], eval, self.wanted_metrics( metrics ), *options, annotations=annotations )
+			if( len(metrics) == 0 ):
+				eval.ok = True
+				return( eval )
+		
+		diag = Diagnostics( trg_struct.pdb_file )
+		self.score_arrays( src_struct.arrays, trg_struct.arrays, eval, metrics, pvalue_param, diag, fit_subset, windows )
+		diag.emit()
+		
+		if( (cache is not None) and eval.ok ):
+			cache.store( keys[0], keys[1], eval, self.wanted_metrics( metrics ), *options, annotations=annotations )
+		
+		return( eval )
+	
+	# same as score() on the AtomArrays of two structures; 'metrics' defaults
+	# to DEFAULT_METRICS. eval.subset_rmsd holds the RMSD of each of SUBSETS,
+	# fitted on itself or on the subset 'fit_subset' when given;
+	# eval.local_rmsd the local RMSD profile for each window size of 'windows'
+	# (LOCAL_WINDOWS by default). Sets eval.ok when every requested metric
+	# was computed
+	def score_arrays( self, src_arrays, trg_arrays, eval, metrics=None, pvalue_param="-", diag=None, fit_subset=None, windows=None ):
+		import numpy as np
+		
+		wanted = self.wanted_metrics( metrics )
+		
+		if( (fit_subset is not None) and (fit_subset not in self.SUBSETS) ):
+			show( "FATAL", "Unknown atom subset '%s', expected one of: %s" %(fit_subset, ", ".join( self.SUBSETS )) )
+		
+		N = src_arrays.n_ranks()
+		if( src_arrays.raw_sequence() != trg_arrays.raw_sequence() ):
+			show( "ERROR", "Result sequence != Solution sequence for '%s'" %eval.original )
+			return( eval )
+		
+		if( "rg" in wanted ):
+			from .descriptors import radius_of_gyration
+			eval.rg = radius_of_gyration( trg_arrays.coords )
+		
+		if( "clashscore" in wanted ):
+			# in-process, instead of the MolProbity output of utils.molprobity_parse
+			from .clashes import clashscore
+			eval.clashscore = clashscore( trg_arrays )
+		
+		for (metric, type) in self.INF_TYPES.items():
+			if( metric in wanted ):
+				setattr( eval, metric, self.INF_keys( src_arrays.packed_interactions( type ), trg_arrays.packed_interactions( type ) ) )
+		
+		if( "rmsd" in wanted ):
+			from .arrays import match_atoms, subset_mask, subset_rmsds, superimpose
 			
-			if( found ):
-				#print "TP>", (stype, sb1, sb2, sextra)
-				TP += 1
-			else:
-				#print "FN>", (stype, sb1, sb2, sextra)
-				FN += 1
-
-		for (ttype, tb1, tb2, textra) in trg_struct.get_interactions( type ):
-			found = False
-			for (stype, sb1, sb2, sextra) in src_struct.get_interactions( type ):
-				if( (stype==ttype) and (sb1==tb1) and (sb2==tb2) and (sextra==textra) ):
-					found = True
-					break
+			matched = match_atoms( src_arrays, trg_arrays, diag )
+			if( matched is None ):
+				return( eval )
 			
-			if( not found ):
-				FP += 1
-				#print "FP>", (ttype, tb1, tb2, textra)
-		
-		if( TP == 0 and (FP == 0 or FN == 0) ):
-			INF = -1.0
-		else:
-			PPV = float(TP) / (float(TP) + float(FP))
-			STY = float(TP) / (float(TP) + float(FN))
-			INF = (PPV * STY) ** 0.5
+			(src_ndx, trg_ndx) = matched
+			(rot, tran, rms) = superimpose( src_arrays.coords[src_ndx], trg_arrays.coords[trg_ndx] )
+			eval.rmsd = rms
+			
+			if( "pvalue" in wanted ):
+				eval.pvalue_plus = self.pvalue( rms, N, "+" )
+				eval.pvalue_minus = self.pvalue( rms, N, "-" )
+				eval.pvalue = eval.pvalue_plus if pvalue_param == "+" else eval.pvalue_minus
+			
+			if( ("DI_ALL" in wanted) and (eval.INF_ALL != 0) ):
+				eval.DI_ALL = rms / eval.INF_ALL
+			
+			if( "residue_rmsd" in wanted ):
+				# RMSD of the fitted atoms of each ranked residue, nan without atoms
+				diff = np.dot( trg_arrays.coords[trg_ndx], rot ) + tran - src_arrays.coords[src_ndx]
+				ranks = src_arrays.atom_rank()[src_ndx]
+				count = np.bincount( ranks, minlength=N )
+				total = np.bincount( ranks, weights=(diff * diff).sum( axis=1 ), minlength=N )
+				with np.errstate( invalid="ignore", divide="ignore" ):
+					eval.residue_rmsd = np.sqrt( total / count )
+			
+			if( "subset_rmsd" in wanted ):
+				# the subsets are masks over the atoms matched once
+				keys = src_arrays.keys()[src_ndx]
+				masks = dict( [(name, subset_mask( keys, atoms )) for (name, atoms) in self.SUBSETS.items()] )
+				eval.subset_rmsd = subset_rmsds( src_arrays.coords[src_ndx], trg_arrays.coords[trg_ndx], masks, fit_subset )
+			
+			if( "local_rmsd" in wanted ):
+				from .local import local_rmsd_profiles
+				
+				ranks = src_arrays.atom_rank()[src_ndx]
+				eval.local_rmsd = local_rmsd_profiles( src_arrays.coords[src_ndx], trg_arrays.coords[trg_ndx], ranks, N, self.LOCAL_WINDOWS if windows is None else windows )
 		
-		#print "##>", INF, P, TP, FP, FN
+		eval.ok = True
+		return( eval )
+	
+	# deformation matrix of 'trg_struct' against 'src_struct' (see
+	# deformation.py), computed in-process and written to 'dname' as
+	# <model>.matrix; returns the matrix or None. With 'dp_script' the
+	# external DP generator is run instead, configured with 'template_txt',
+	# and writes its own output files to 'dname' (None is returned)
+	def DP(self, src_struct, trg_struct, template_txt=None, dname=".", dp_script=None):
+		if( dp_script is not None ):
+			self._run_dp_script( src_struct, trg_struct, template_txt or "", dname, dp_script )
+			return( None )
 		
-		return( INF )
+		return( self.DP_batch( src_struct, [trg_struct], dname )[0] )
 	
-	def DP(self, src_struct, trg_struct, template_txt, dname, dp_script):
+	def _run_dp_script(self, src_struct, trg_struct, template_txt, dname, dp_script):
 		# prepare the config file
 		txt = ""
 		txt += "matrix=True\n"
@@ -581,6 +1095,18 @@ class PDBComparer:
 		# runs the DP generator
 		os.system( "python %s -c %s > %s" %(dp_script, fname_cfg, fname_log) )
 	
+	# DP() of all the models of 'trg_structs', fitted in a single batch
+	def DP_batch(self, src_struct, trg_structs, dname="."):
+		from .deformation import deformation_matrices, write_matrix
+		
+		matrices = deformation_matrices( src_struct.arrays, [trg_struct.arrays for trg_struct in trg_structs] )
+		
+		for (trg_struct, matrix) in zip( trg_structs, matrices ):
+			if( matrix is not None ):
+				write_matrix( matrix, os.path.join( dname, "%s.matrix" %os.path.basename( trg_struct.pdb_file ) ) )
+		
+		return( matrices )
+	
 	def VARNA(self, src_struct, trg_struct, algorithm="radiate"):
 		edges = {"W":"wc", "S":"s", "H":"h"}
 		
@@ -590,12 +1116,13 @@ class PDBComparer:
 
 		aux_bps = []
 		
-		for (stype, sb1, sb2, sextra) in src_struct.get_interactions( "PAIR" ):
-			color = "#FF0000"
-			for (ttype, tb1, tb2, textra) in trg_struct.get_interactions( "PAIR" ):
-				if( (stype==ttype) and (sb1==tb1) and (sb2==tb2) and (sextra==textra) ):
-					color = "#00FF00"
-					break
+		# the pairs of the model, in the order of the native
+		from . import interactions as inter
+		src_rows = src_struct.arrays.get_interactions( "PAIR" )
+		found = inter.contains( trg_struct.arrays.packed_interactions( "PAIR" ), inter.pack( src_rows ) )
+		
+		for ((stype, sb1, sb2, sextra), ok) in zip( inter.decode( src_rows ), found.tolist() ):
+			color = "#00FF00" if ok else "#FF0000"
 			aux_bps.append( "(%d,%d):color=%s,edge5=%s,edge3=%s,stericity=%s" %(sb1+1, sb2+1, color, edges[sextra[0]], edges[sextra[1]], sextra[2:]) )
 			
 		data["auxBPs"] = ";".join( aux_bps )
@@ -603,77 +1130,15 @@ class PDBComparer:
 		
 		return( data )
 	
-	def _get_atoms_residue( self, atom_list, src_res, trg_res ):
-		src_atom_list = []
-		trg_atom_list = []
-		
-		src_atom_list_tmp = list(filter( lambda a: a.get_name() in atom_list, src_res ))
-		trg_atom_list_tmp = list(filter( lambda a: a.get_name() in atom_list, trg_res ))
-		
-		# for each atom in reference
-		for src_atom in src_atom_list_tmp:
-			found = False
-			src_name = src_atom.get_full_id()[4][0]
-			
-			# search for an atom with the same name in the comparison
-			for trg_atom in trg_atom_list_tmp:
-				trg_name = trg_atom.get_full_id()[4][0]
-	
-				# if the atom was found keep it and jump to the next
-				if( src_name == trg_name ):
-					src_atom_list.append( src_atom )
-					trg_atom_list.append( trg_atom )
-					found = True
-					break
-			
-			if( not found ):
-				show( "WARNING", "Atom %s from residue %s not found in target atom list" %(src_name, src_res.id))
-		return( src_atom_list, trg_atom_list )
-	
-	def _get_atoms_struct( self, atom_list, src_residues, trg_residues ):
-		src_atoms = []
-		trg_atoms = []
-	
-		if( len(src_residues) != len(trg_residues) ):
-			show( "ERROR", "Different number of residues!" )
-			return( None )
-	
-		for (src_res, trg_res) in zip(src_residues, trg_residues):
-			(sa, ta) = self._get_atoms_residue( atom_list, src_res, trg_res )
-			
-			src_atoms.extend( sa )
-			trg_atoms.extend( ta )
-		#'print('%d %d'%(len(src_atoms),len(trg_atoms)))
-		return( src_atoms, trg_atoms )
-	
 	def _build_dp_alignments(self, src_struct, trg_struct):
-		aligns = []
+		from .chains import residue_runs
 		
-		(schain, tchain) = ("", "")
-		(spos, tpos) = (-1, -1)
-		count = 0
-		item = None
+		ranks = list( range( min( len(src_struct.res_seq), len(trg_struct.res_seq) ) ) )
+		aligns = []
 		
-		for (i, j) in zip(src_struct.res_seq, trg_struct.res_seq):
-			(sres, tres) = (src_struct.res_list[i], trg_struct.res_list[j])
-
-			# if the numbering or the chain change			
-			if( (sres.pos != (spos+1)) or (tres.pos != (tpos+1)) or (sres.chain != schain) or (tres.chain != tchain) ):
-				if( count > 0 ):
-					item[4] = count
-					aligns.append( item )
-				
-				(schain, tchain) = (sres.chain, tres.chain)
-				item = [sres.chain, sres.pos, tres.chain, tres.pos, None]
-				count = 1
-			else:
-				count += 1
-			
-			(spos, tpos) = (sres.pos, tres.pos)
-
-		# adds the last alignment
-		if( count > 0 ):			
-			item[4] = count
-			aligns.append( item )
+		# the runs of consecutive residues in both structures
+		for (start, count) in residue_runs( [src_struct, trg_struct], [ranks, ranks] ):
+			(sres, tres) = (src_struct.res_list[src_struct.res_seq[start]], trg_struct.res_list[trg_struct.res_seq[start]])
+			aligns.append( [sres.chain, sres.pos, tres.chain, tres.pos, count] )
 		
 		return( aligns )
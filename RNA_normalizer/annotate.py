@@ -0,0 +1,233 @@
+#  annotate.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  in-process geometric annotation of base pairs (Leontis-Westhof edges and
+#  cis/trans) and stackings, an alternative to MC-Annotate that works on the
+#  AtomArrays of a structure. The interactions have the same tuples as
+#  MCAnnotate.interactions, so PDBStruct uses either one.
+#
+#  Each base gets a frame (ring centroid and normal); the residues whose base
+#  atoms are close (cell grid, see grid.py) are then classified:
+#    - stacking: parallel planes about 3.4A apart, overlapping; the type comes
+#      from the side of each base facing the other one
+#    - pairing: coplanar bases with at least one N/O hydrogen bond; the edge
+#      of each base is the one facing the partner, cis/trans the side of the
+#      glycosidic bonds with respect to the line between the bases
+
+import warnings
+
+import numpy as np
+
+from .grid import neighbor_pairs
+
+PURINE_RING = ("N9", "C8", "N7", "C5", "C6", "N1", "C2", "N3", "C4")
+PYRIMIDINE_RING = ("N1", "C2", "N3", "C4", "C5", "C6")
+
+# base atoms able to donate or accept a hydrogen bond
+POLAR_ATOMS = ("N1", "N2", "N3", "N4", "N6", "N7", "O2", "O4", "O6")
+
+BASE_ATOMS = tuple( sorted( set( PURINE_RING + PYRIMIDINE_RING + POLAR_ATOMS ) ) )
+
+# the atom each edge points to: (purines, pyrimidines)
+EDGE_ATOMS = {
+    "W": ("N1", "N3"),
+    "H": ("N7", "C5"),
+    "S": ("N3", "O2"),
+}
+
+# distances (A) and cosines of the angle between the base normals
+CONTACT_CUTOFF = 4.5
+HBOND_CUTOFF = 3.5
+
+STACK_MAX_DISTANCE = 5.5
+STACK_MIN_COS = 0.8
+STACK_VERTICAL = (2.9, 4.2)
+STACK_MAX_LATERAL = 3.5
+
+PAIR_MIN_COS = 0.6
+PAIR_MAX_VERTICAL = 1.5
+
+# stacking type by the sides (normal . a->b > 0) of the first and second bases
+STACK_TYPES = {
+    (True, True): "upward",
+    (False, False): "downward",
+    (True, False): "inward",
+    (False, True): "outward",
+}
+
+# the same stacking seen from the other base
+STACK_REVERSED = {"upward": "downward", "downward": "upward", "inward": "inward", "outward": "outward"}
+
+def _atom_table( arrays, name ):
+    # coordinates of atom 'name' in each residue, nan when missing
+    table = np.full( (len(arrays.res_name), 3), np.nan )
+    mask = arrays.names == name
+    table[arrays.res_ndx[mask]] = arrays.coords[mask]
+    return( table )
+
+class BaseFrames:
+    def __init__(self, arrays):
+        tables = dict( [(name, _atom_table( arrays, name )) for name in BASE_ATOMS + ("C1'",)] )
+        self.c1 = tables["C1'"]
+
+        self.purine = ~np.isnan( tables["N9"][:, 0] ) & ~np.isnan( tables["C8"][:, 0] )
+
+        # residues without a base get nan frames
+        with np.errstate( invalid="ignore", divide="ignore" ), warnings.catch_warnings():
+            warnings.simplefilter( "ignore", RuntimeWarning )
+            purine_center = np.nanmean( np.stack( [tables[name] for name in PURINE_RING] ), axis=0 )
+            pyrimidine_center = np.nanmean( np.stack( [tables[name] for name in PYRIMIDINE_RING] ), axis=0 )
+            self.center = np.where( self.purine[:, None], purine_center, pyrimidine_center )
+
+            # the 6-membered rings are numbered the other way round in purines
+            normal = np.cross( tables["N3"] - tables["N1"], tables["C5"] - tables["N1"] )
+            normal /= np.linalg.norm( normal, axis=1 )[:, None]
+            normal[self.purine] *= -1
+            self.normal = normal
+
+        self.edges = {}
+        for (edge, (purine_atom, pyrimidine_atom)) in EDGE_ATOMS.items():
+            point = np.where( self.purine[:, None], tables[purine_atom], tables[pyrimidine_atom] )
+            self.edges[edge] = self._in_plane( point - self.center, np.arange( len(point) ) )
+
+        self.valid = ~np.isnan( self.center ).any( axis=1 ) & ~np.isnan( self.normal ).any( axis=1 )
+
+    def _in_plane(self, vectors, res):
+        # unit projections of 'vectors' on the planes of the bases 'res'
+        normal = self.normal[res]
+        vectors = vectors - (vectors * normal).sum( axis=1 )[:, None] * normal
+        with np.errstate( invalid="ignore", divide="ignore" ):
+            return( vectors / np.linalg.norm( vectors, axis=1 )[:, None] )
+
+    def edge(self, res, points):
+        # edge of the bases 'res' facing 'points'
+        direction = self._in_plane( points - self.center[res], res )
+        names = sorted( self.edges )
+        scores = np.stack( [(self.edges[name][res] * direction).sum( axis=1 ) for name in names], axis=1 )
+        return( np.array( names )[np.argmax( np.nan_to_num( scores, nan=-2.0 ), axis=1 )] )
+
+def _residue_pairs( arrays, atoms, cutoff ):
+    # (res_a, res_b) with res_a < res_b of the residues with atoms closer than cutoff, and the atom pairs
+    (i, j, dist) = neighbor_pairs( arrays.coords[atoms], cutoff )
+    (res_i, res_j) = (arrays.res_ndx[atoms[i]], arrays.res_ndx[atoms[j]])
+    keep = res_i != res_j
+    return( atoms[i[keep]], atoms[j[keep]], res_i[keep], res_j[keep] )
+
+#
+# the interactions of the first model in 'arrays' as MCAnnotate.interactions
+# tuples: (type, chain_a, pos_a, nt_a, chain_b, pos_b, nt_b, extra1, extra2, extra3)
+#
+def annotate( arrays ):
+    frames = BaseFrames( arrays )
+    n_res = len(arrays.res_name)
+
+    base = np.flatnonzero( np.isin( arrays.names, BASE_ATOMS ) )
+    (_, _, res_a, res_b) = _residue_pairs( arrays, base, CONTACT_CUTOFF )
+    keys = np.unique( np.minimum( res_a, res_b ).astype( np.int64 ) * n_res + np.maximum( res_a, res_b ) )
+    (res_a, res_b) = np.divmod( keys, n_res )
+
+    valid = frames.valid[res_a] & frames.valid[res_b]
+    (keys, res_a, res_b) = (keys[valid], res_a[valid], res_b[valid])
+
+    # hydrogen bonds of each pair of residues
+    polar = np.flatnonzero( np.isin( arrays.names, POLAR_ATOMS ) )
+    (hb_a, hb_b, hb_res_a, hb_res_b) = _residue_pairs( arrays, polar, HBOND_CUTOFF )
+    swap = hb_res_a > hb_res_b
+    (hb_a, hb_b) = (np.where( swap, hb_b, hb_a ), np.where( swap, hb_a, hb_b ))
+    hb_keys = np.minimum( hb_res_a, hb_res_b ).astype( np.int64 ) * n_res + np.maximum( hb_res_a, hb_res_b )
+
+    d = frames.center[res_b] - frames.center[res_a]
+    dist = np.linalg.norm( d, axis=1 )
+    side_a = (frames.normal[res_a] * d).sum( axis=1 )
+    side_b = (frames.normal[res_b] * d).sum( axis=1 )
+    cos = np.abs( (frames.normal[res_a] * frames.normal[res_b]).sum( axis=1 ) )
+    vertical = (np.abs( side_a ) + np.abs( side_b )) / 2.0
+    lateral = np.sqrt( np.maximum( dist * dist - vertical * vertical, 0.0 ) )
+
+    stack = (dist <= STACK_MAX_DISTANCE) & (cos >= STACK_MIN_COS) & (vertical >= STACK_VERTICAL[0]) & (vertical <= STACK_VERTICAL[1]) & (lateral <= STACK_MAX_LATERAL)
+
+    n_hbonds = np.bincount( np.searchsorted( keys, hb_keys[np.isin( hb_keys, keys )] ), minlength=len(res_a) )
+    pair = (n_hbonds >= 1) & (cos >= PAIR_MIN_COS) & (vertical <= PAIR_MAX_VERTICAL) & ~stack
+
+    interactions = []
+
+    for k in np.flatnonzero( stack ):
+        (a, b) = (int(res_a[k]), int(res_b[k]))
+        interactions.append( _interaction( arrays, "STACK", a, b, STACK_TYPES[(bool(side_a[k] > 0), bool(side_b[k] > 0))], "" ) )
+
+    pair_ndx = np.flatnonzero( pair )
+    if( len(pair_ndx) > 0 ):
+        # the edges face the partner's hydrogen bonding atoms
+        partner_a = np.zeros( (len(pair_ndx), 3) )
+        partner_b = np.zeros( (len(pair_ndx), 3) )
+        pair_keys = keys[pair_ndx]
+        pos = np.searchsorted( pair_keys, hb_keys )
+        found = (pos < len(pair_ndx)) & (pair_keys[np.minimum( pos, len(pair_ndx) - 1 )] == hb_keys)
+        count = np.bincount( pos[found], minlength=len(pair_ndx) )[:, None]
+        np.add.at( partner_a, pos[found], arrays.coords[hb_b[found]] )
+        np.add.at( partner_b, pos[found], arrays.coords[hb_a[found]] )
+        (partner_a, partner_b) = (partner_a / count, partner_b / count)
+
+        (a, b) = (res_a[pair_ndx], res_b[pair_ndx])
+        edge_a = frames.edge( a, partner_a )
+        edge_b = frames.edge( b, partner_b )
+
+        # cis when the glycosidic bonds are on the same side of the line between the bases
+        line = frames.center[b] - frames.center[a]
+        normal = frames.normal[a]
+        side_c1_a = (np.cross( line, frames.c1[a] - frames.center[a] ) * normal).sum( axis=1 )
+        side_c1_b = (np.cross( line, frames.c1[b] - frames.center[a] ) * normal).sum( axis=1 )
+        cis = (side_c1_a * side_c1_b) > 0
+
+        for k in range( len(pair_ndx) ):
+            if( np.isnan( side_c1_a[k] ) or np.isnan( side_c1_b[k] ) ):
+                continue
+            interactions.append( _interaction( arrays, None, int(a[k]), int(b[k]), (edge_a[k], edge_b[k]), "cis" if cis[k] else "trans" ) )
+
+    return( interactions )
+
+def _interaction( arrays, type, a, b, extra1, extra2 ):
+    (chain_a, pos_a, nt_a) = (str(arrays.res_chain[a]), int(arrays.res_pos[a]), str(arrays.res_name[a]))
+    (chain_b, pos_b, nt_b) = (str(arrays.res_chain[b]), int(arrays.res_pos[b]), str(arrays.res_name[b]))
+
+    # the smallest position first, as MCAnnotate.convert_pair
+    first = ((chain_a == chain_b) and (pos_a < pos_b)) or (chain_a < chain_b)
+
+    if( type == "STACK" ):
+        if( not first ):
+            extra1 = STACK_REVERSED[extra1]
+            (chain_a, pos_a, chain_b, pos_b) = (chain_b, pos_b, chain_a, pos_a)
+        return( ("STACK", chain_a, pos_a, "", chain_b, pos_b, "", extra1, "", "") )
+
+    (edge_a, edge_b) = extra1
+    if( not first ):
+        (chain_a, pos_a, nt_a, edge_a, chain_b, pos_b, nt_b, edge_b) = (chain_b, pos_b, nt_b, edge_b, chain_a, pos_a, nt_a, edge_a)
+
+    pair_name = "PAIR_2D" if (extra2 == "cis") and (edge_a == "W") and (edge_b == "W") else "PAIR_3D"
+    return( (pair_name, chain_a, pos_a, nt_a, chain_b, pos_b, nt_b, "%s%s" %(edge_a, edge_b), extra2, "") )
+
+# drop-in for MCAnnotate in PDBStruct._load_annotations_3D
+class GeometricAnnotator:
+    def __init__(self):
+        self.residues = []
+        self.interactions = []
+
+    def load_arrays(self, arrays):
+        self.residues = [(str(chain), str(pos), str(nt)) for (chain, pos, nt) in zip( arrays.res_chain, arrays.res_pos, arrays.res_name )]
+        self.interactions = annotate( arrays )
@@ -0,0 +1,132 @@
+#  archive.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  streams the models of a tar or zip submission archive without extracting
+#  it, pairing every '.pdb' member with its '.index' member (same naming
+#  rules as utils.get_index_file) and its '.mcout' member when present
+
+import os
+import tarfile
+import zipfile
+
+from .fileio import ENCODING, decompress_bytes
+from .msgs import *
+from .utils import index_file_names
+
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".zip")
+
+def is_archive( path ):
+    return( path.endswith( ARCHIVE_SUFFIXES ) )
+
+#
+# yields (name, data) for every regular member, one member in memory at a time
+#
+def iter_members( path ):
+    if( path.endswith( ".zip" ) ):
+        with zipfile.ZipFile( path ) as zf:
+            for info in zf.infolist():
+                if( not info.is_dir() ):
+                    with zf.open( info ) as f:
+                        yield( info.filename, f.read() )
+    else:
+        # 'r|*' reads the tar as a stream, whatever its compression
+        with tarfile.open( path, "r|*" ) as tf:
+            for member in tf:
+                if( member.isfile() ):
+                    f = tf.extractfile( member )
+                    yield( member.name, f.read() )
+                    f.close()
+
+class ArchiveModel:
+    def __init__(self, name, pdb_txt, index_txt=None, mcout_txt=None):
+        self.name = name
+        self.pdb_txt = pdb_txt
+        self.index_txt = index_txt
+        self.mcout_txt = mcout_txt
+
+#
+# yields an ArchiveModel per '.pdb' member; 'native_file' selects the
+# result-specific index '<model>.<native>.index' when the archive has one.
+# A model is yielded once its preferred index has been read, and the next
+# member too, as the '.mcout' usually follows its '.pdb' (an '.mcout' coming
+# later is not used). The others wait for the end of the archive and take
+# the generic index if there is one. The texts are dropped once used.
+#
+def iter_models( path, native_file="" ):
+    native_name = os.path.basename( native_file )
+    pending = {}
+    # index name -> model
+    owners = {}
+    texts = {}
+    done = set()
+    
+    def model( name, index_txt ):
+        mcout_txt = texts.get( "%s.mcout" %name, None )
+        done.add( name )
+        for text_name in index_file_names( name, native_name ) + ["%s.mcout" %name]:
+            texts.pop( text_name, None )
+        return( ArchiveModel( name, pending.pop( name ), index_txt, mcout_txt ) )
+    
+    def release( name ):
+        return( model( name, texts[index_file_names( name, native_name )[0]] ) )
+    
+    # the models whose preferred index has been read, waiting for one more member
+    held = []
+    for (name, data) in iter_members( path ):
+        (name, data) = decompress_bytes( name, data )
+        
+        if( name.endswith( ".pdb" ) ):
+            pending[name] = data.decode( ENCODING, "replace" )
+            for index_name in index_file_names( name, native_name ):
+                owners[index_name] = name
+            ready = [name]
+        elif( name.endswith( (".index", ".mcout") ) ):
+            owner = owners.get( name, name[:-len(".mcout")] if name.endswith( ".mcout" ) else None )
+            if( owner in done ):
+                # used already, or too late
+                continue
+            texts[name] = data.decode( ENCODING, "replace" )
+            ready = [owner]
+        else:
+            ready = []
+        
+        for model_name in held:
+            yield( release( model_name ) )
+        held = []
+        
+        for model_name in ready:
+            if( (model_name in pending) and (index_file_names( model_name, native_name )[0] in texts) ):
+                if( "%s.mcout" %model_name in texts ):
+                    yield( release( model_name ) )
+                else:
+                    held.append( model_name )
+    
+    for model_name in held:
+        yield( release( model_name ) )
+    
+    for name in sorted( pending.keys() ):
+        index_txt = None
+        for index_name in index_file_names( name, native_name ):
+            if( index_name in texts ):
+                index_txt = texts[index_name]
+                break
+        
+        if( index_txt is None ):
+            show( "INFO", "INDEX SKIPPED! no index for '%s' in '%s'." %(name, path) )
+        yield( model( name, index_txt ) )
@@ -0,0 +1,245 @@
+#  arrays.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  flat numpy view of a PDBStruct: per-atom and per-residue columns, the
+#  residue ranks of the index and the encoded interactions
+
+import numpy as np
+
+from . import PDBComparer
+from . import interactions as inter
+from .msgs import *
+
+# atoms taking part in the comparisons, in PDBComparer.ALL_ATOMS order
+ATOM_NAMES = tuple( PDBComparer.ALL_ATOMS )
+ATOM_CODES = dict( [(name, i) for (i, name) in enumerate( ATOM_NAMES )] )
+
+class AtomArrays:
+    # every array of the structure, in a fixed order (see sharedmem.py)
+    FIELDS = ("coords", "res_ndx", "names", "elements", "bfactors",
+              "occupancies", "res_chain", "res_pos", "res_icode", "res_name",
+              "res_hetero", "res_rank", "interactions")
+    
+    def __init__(self, **fields):
+        self._interactions = None
+        self._annotate = None
+        for name in AtomArrays.FIELDS:
+            setattr( self, name, fields[name] )
+        
+        self._codes = None
+        self._keys = None
+        self._packed = {}
+        self._packed_rows = None
+    
+    # the interactions column, from 'annotate' (which returns the encoded rows)
+    # on first use when the structure is not annotated yet
+    def defer_interactions(self, annotate):
+        self._interactions = None
+        self._annotate = annotate
+    
+    def interactions_get(self):
+        if( (self._interactions is None) and (self._annotate is not None) ):
+            (annotate, self._annotate) = (self._annotate, None)
+            self._interactions = annotate()
+        return( self._interactions )
+    
+    def interactions_set(self, rows):
+        self._annotate = None
+        self._interactions = rows
+    
+    interactions = property( interactions_get, interactions_set )
+    
+    def n_atoms(self):
+        return( len(self.coords) )
+    
+    def n_ranks(self):
+        # number of residues in the index
+        return( int((self.res_rank >= 0).sum()) )
+    
+    def raw_sequence(self):
+        ranked = np.flatnonzero( self.res_rank >= 0 )
+        ranked = ranked[np.argsort( self.res_rank[ranked] )]
+        return( "".join( self.res_name[ranked] ) )
+    
+    def atom_rank(self):
+        return( self.res_rank[self.res_ndx] )
+    
+    def codes(self):
+        # position of each atom name in ATOM_NAMES, -1 for the other atoms
+        if( self._codes is None ):
+            self._codes = np.array( [ATOM_CODES.get( name, -1 ) for name in self.names], dtype=np.int16 )
+        return( self._codes )
+    
+    def keys(self):
+        # rank * len(ATOM_NAMES) + code for the compared atoms of the indexed residues, -1 otherwise
+        if( self._keys is None ):
+            rank = self.atom_rank().astype( np.int64 )
+            codes = self.codes()
+            self._keys = np.where( (rank >= 0) & (codes >= 0), rank * len(ATOM_NAMES) + codes, -1 )
+        return( self._keys )
+    
+    def get_interactions(self, type="ALL"):
+        return( inter.select( self.interactions, type ) )
+    
+    def packed_interactions(self, type="ALL"):
+        # sorted int64 keys of the interactions (see interactions.pack), until
+        # the interactions are replaced
+        if( self._packed_rows is not self.interactions ):
+            self._packed = {}
+            self._packed_rows = self.interactions
+        if( type not in self._packed ):
+            self._packed[type] = inter.sorted_keys( self.interactions, type )
+        return( self._packed[type] )
+
+#
+# builds the arrays from the first model of a loaded PDBStruct, parsing it
+# first when it was only scanned
+#
+def struct_arrays( struct ):
+    struct._parse()
+    
+    coords = []
+    res_ndx = []
+    names = []
+    elements = []
+    bfactors = []
+    occupancies = []
+    
+    res_list = struct.res_list
+    res_rank = np.full( len(res_list), -1, dtype=np.int32 )
+    
+    for (i, res) in enumerate( res_list ):
+        rank = struct._res_index[res.key()][1]
+        if( rank is not None ):
+            res_rank[i] = rank
+        
+        for atom in res.res:
+            coords.append( atom.get_coord() )
+            res_ndx.append( i )
+            names.append( atom.get_id() )
+            elements.append( atom.element )
+            bfactors.append( atom.get_bfactor() )
+            occupancies.append( atom.get_occupancy() or 0.0 )
+    
+    arrays = AtomArrays(
+        coords = np.array( coords, dtype=np.float64 ).reshape( (-1, 3) ),
+        res_ndx = np.array( res_ndx, dtype=np.int32 ),
+        names = np.array( names, dtype="U4" ),
+        elements = np.array( elements, dtype="U2" ),
+        bfactors = np.array( bfactors, dtype=np.float32 ),
+        occupancies = np.array( occupancies, dtype=np.float32 ),
+        res_chain = np.array( [res.chain for res in res_list], dtype="U4" ),
+        res_pos = np.array( [res.pos for res in res_list], dtype=np.int32 ),
+        res_icode = np.array( [res.res.id[2] for res in res_list], dtype="U1" ),
+        res_name = np.array( [res.nt for res in res_list], dtype="U3" ),
+        # HETATM residues
+        res_hetero = np.array( [res.res.id[0] != " " for res in res_list], dtype=bool ),
+        res_rank = res_rank,
+        interactions = None,
+    )
+    
+    # annotated on first use (see PDBStruct.get_interactions)
+    arrays.defer_interactions( lambda: inter.encode( struct.get_interactions() ) )
+    return( arrays )
+
+#
+# pairs the atoms with the same name in residues of the same rank; returns
+# the (src, trg) atom positions or None when the indexes do not match
+#
+def match_atoms( src, trg, diag=None ):
+    if( src.n_ranks() != trg.n_ranks() ):
+        show( "ERROR", "Different number of residues!" )
+        return( None )
+    
+    src_keys = src.keys()
+    trg_keys = trg.keys()
+    
+    src_valid = np.flatnonzero( src_keys >= 0 )
+    trg_valid = np.flatnonzero( trg_keys >= 0 )
+    
+    (common, src_pos, trg_pos) = np.intersect1d( src_keys[src_valid], trg_keys[trg_valid], assume_unique=False, return_indices=True )
+    
+    if( (diag is not None) and (len(common) < len(src_valid)) ):
+        missing = np.setdiff1d( src_keys[src_valid], common )
+        for key in missing:
+            (rank, code) = divmod( int(key), len(ATOM_NAMES) )
+            name = ATOM_NAMES[code]
+            res = np.flatnonzero( src.res_rank == rank )[0]
+            diag.add( "WARNING", "Atom %s not found in target atom list" %name, "Atom %s from residue %s:%d not found in target atom list" %(name, src.res_chain[res], src.res_pos[res]) )
+    
+    return( (src_valid[src_pos], trg_valid[trg_pos]) )
+
+# True for the matched atoms (by their keys, see AtomArrays.keys) named in 'atoms'
+def subset_mask( keys, atoms ):
+    table = np.zeros( len(ATOM_NAMES), dtype=bool )
+    table[[ATOM_CODES[name] for name in atoms]] = True
+    return( table[keys % len(ATOM_NAMES)] )
+
+#
+# RMSD of several subsets of the matched atoms ('masks': boolean arrays by
+# subset name) from the same coordinates: each subset is fitted on itself or,
+# with 'fit', every subset is measured after a single fit on the subset 'fit'.
+# nan for the subsets without atoms
+#
+def subset_rmsds( fixed, moving, masks, fit=None ):
+    sq = None
+    if( fit is not None ):
+        mask = masks[fit]
+        if( mask.any() ):
+            (rot, tran, rms) = superimpose( fixed[mask], moving[mask] )
+            diff = np.dot( moving, rot ) + tran - fixed
+            sq = (diff * diff).sum( axis=1 )
+    
+    result = {}
+    for (name, mask) in masks.items():
+        n = int(mask.sum())
+        if( (n == 0) or ((fit is not None) and (sq is None)) ):
+            result[name] = float("nan")
+        elif( fit is None ):
+            result[name] = float(superimpose( fixed[mask], moving[mask] )[2])
+        else:
+            result[name] = float(np.sqrt( sq[mask].sum() / n ))
+    
+    return( result )
+
+#
+# least-squares fit of 'moving' onto 'fixed' (Kabsch); the fitted coordinates
+# are dot(moving, rot) + tran, as with Bio.PDB.Superimposer
+#
+def superimpose( fixed, moving ):
+    fixed_mean = fixed.mean( axis=0 )
+    moving_mean = moving.mean( axis=0 )
+    
+    a = fixed - fixed_mean
+    b = moving - moving_mean
+    
+    (u, d, vt) = np.linalg.svd( np.dot( b.T, a ) )
+    rot = np.dot( u, vt )
+    
+    # avoid reflections
+    if( np.linalg.det( rot ) < 0 ):
+        vt[2] = -vt[2]
+        rot = np.dot( u, vt )
+    
+    tran = fixed_mean - np.dot( moving_mean, rot )
+    
+    diff = np.dot( b, rot ) - a
+    rms = np.sqrt( (diff * diff).sum() / len(fixed) )
+    
+    return( rot, tran, rms )
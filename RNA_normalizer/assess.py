@@ -0,0 +1,173 @@
+#  assess.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  evaluation of one model against one native structure, filling an Eval
+
+import os
+
+from . import PDBStruct, PDBComparer
+from .fileio import read_text, strip_compression
+from .msgs import *
+from .utils import Eval
+
+#
+# splits a model file name '<problem>_<lab>_<result>.pdb' into (lab, result)
+#
+def model_name_fields( model_file ):
+    name = strip_compression( os.path.basename( model_file ) )
+    if( name.endswith( ".pdb" ) ):
+        name = name[:-4]
+    
+    data = name.split( "_" )
+    if( (len(data) >= 3) and data[-1].isdigit() ):
+        return( "_".join( data[1:-1] ), int(data[-1]) )
+    
+    return( name, 0 )
+
+def load_struct( pdb_file, index_file=None ):
+    struct = PDBStruct()
+    if( not struct.load( pdb_file, index_file ) ):
+        show( "ERROR", "Structure '%s' could not be loaded" %pdb_file )
+        return( None )
+    
+    return( struct )
+
+#
+# compares the arrays of a native (possibly attached from shared memory)
+# against an already loaded model
+#
+def evaluate_arrays( eval, native, model, pvalue_param="-", metrics=None, fit_subset=None ):
+    # a mismatched submission is rejected before the model is parsed or annotated
+    if( native.raw_sequence() != model.raw_sequence() ):
+        show( "ERROR", "Result sequence != Solution sequence for '%s'" %eval.original )
+        return( eval )
+    
+    comparer = PDBComparer()
+    
+    diag = Diagnostics( model.pdb_file )
+    comparer.score_arrays( native, model.arrays, eval, metrics, pvalue_param, diag, fit_subset )
+    diag.emit()
+    
+    return( eval )
+
+#
+# compares a loaded model against the arrays of every alternative native
+# solution of its problem; 'model_indexes' holds the index text of the model
+# for each native (None for every residue), or is None to keep its ranks.
+# The best solution, by RMSD, fills 'eval' and its best_sol_ndx
+#
+def evaluate_solutions( eval, natives, model, pvalue_param="-", metrics=None, fit_subset=None, model_indexes=None ):
+    best = None
+    # the index applied to the model, never a list
+    current = []
+    
+    for (ndx, native) in enumerate( natives ):
+        if( (model_indexes is not None) and (model_indexes[ndx] != current) ):
+            # the structure and its annotations are kept, only the ranks change
+            current = model_indexes[ndx]
+            if( not model.reindex( current ) ):
+                show( "ERROR", "Bad index of '%s' for solution %d" %(model.pdb_file, ndx) )
+                continue
+        
+        candidate = Eval( eval.problem, eval.original, eval.lab, eval.result )
+        evaluate_arrays( candidate, native, model, pvalue_param, metrics, fit_subset )
+        
+        if( candidate.ok and ((best is None) or (candidate.rmsd < best[1].rmsd)) ):
+            best = (ndx, candidate)
+    
+    if( best is not None ):
+        eval.__dict__.update( best[1].__dict__ )
+        eval.best_sol_ndx = best[0]
+    
+    return( eval )
+
+def evaluate_structs( eval, native, model, pvalue_param="-" ):
+    return( evaluate_arrays( eval, native.arrays, model, pvalue_param ) )
+
+def evaluate( problem, native_file, native_index, model_file, model_index, pvalue_param="-" ):
+    (lab, result) = model_name_fields( model_file )
+    eval = Eval( problem, model_file, lab, result )
+    
+    native = load_struct( native_file, native_index )
+    if( native is None ):
+        return( eval )
+    
+    model = load_struct( model_file, model_index )
+    if( model is None ):
+        return( eval )
+    
+    return( evaluate_structs( eval, native, model, pvalue_param ) )
+
+def evaluate_model( problem, native, model_file, model_index, pvalue_param="-", fit_subset=None, metrics=None ):
+    (lab, result) = model_name_fields( model_file )
+    eval = Eval( problem, model_file, lab, result )
+    
+    model = load_struct( model_file, model_index )
+    if( model is None ):
+        return( eval )
+    
+    return( evaluate_arrays( eval, native, model, pvalue_param, metrics, fit_subset ) )
+
+# same as evaluate_model() against several native solutions (see
+# evaluate_solutions); the model is loaded and annotated once
+def evaluate_model_solutions( problem, natives, model_file, model_indexes, pvalue_param="-", fit_subset=None, metrics=None ):
+    (lab, result) = model_name_fields( model_file )
+    eval = Eval( problem, model_file, lab, result )
+    
+    model = load_struct( model_file, model_indexes[0] )
+    if( model is None ):
+        return( eval )
+    
+    indexes = [read_text( index ) if index is not None else None for index in model_indexes]
+    if( len(set( indexes )) == 1 ):
+        # the same ranks for every solution
+        indexes = None
+    
+    return( evaluate_solutions( eval, natives, model, pvalue_param, metrics, fit_subset, indexes ) )
+
+def load_text_struct( model_name, pdb_txt, index_txt=None, mcout_txt=None ):
+    model = PDBStruct()
+    if( not model.load_text( model_name, pdb_txt, index_txt, mcout_txt ) ):
+        show( "ERROR", "Structure '%s' could not be loaded" %model_name )
+        return( None )
+    
+    return( model )
+
+# same as evaluate_model() for a model held in memory
+def evaluate_model_text( problem, native, model_name, pdb_txt, index_txt=None, mcout_txt=None, pvalue_param="-", fit_subset=None, metrics=None ):
+    (lab, result) = model_name_fields( model_name )
+    eval = Eval( problem, model_name, lab, result )
+    
+    model = load_text_struct( model_name, pdb_txt, index_txt, mcout_txt )
+    if( model is None ):
+        return( eval )
+    
+    return( evaluate_arrays( eval, native, model, pvalue_param, metrics, fit_subset ) )
+
+# same as evaluate_model_text() against several native solutions, with the
+# same model index for all
+def evaluate_model_text_solutions( problem, natives, model_name, pdb_txt, index_txt=None, mcout_txt=None, pvalue_param="-", fit_subset=None, metrics=None ):
+    (lab, result) = model_name_fields( model_name )
+    eval = Eval( problem, model_name, lab, result )
+    
+    model = load_text_struct( model_name, pdb_txt, index_txt, mcout_txt )
+    if( model is None ):
+        return( eval )
+    
+    return( evaluate_solutions( eval, natives, model, pvalue_param, metrics, fit_subset ) )
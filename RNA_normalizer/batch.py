@@ -0,0 +1,578 @@
+#  batch.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  rna-assess: resumable batch evaluation of a manifest of models
+#
+#  The manifest has one job per row (blank rows and '#' comments skipped):
+#      <problem> <native> <native index> <model> <model index>
+#  where '-' stands for a missing index. Relative paths are taken from the
+#  manifest directory. Each finished job is appended to the output file as an
+#  Eval row; jobs already in the output are skipped when the run is restarted.
+#  When the model is a tar or zip archive, its members are normalized and
+#  evaluated in memory (see archive.py), each checkpointed as
+#  '<archive>:<member>'.
+#  A problem with alternative native solutions lists them comma-separated in
+#  the native and native index columns (and, when they differ, the model
+#  indexes too): the model is loaded once, scored against every solution and
+#  the best one is written, with its position in best_sol_ndx.
+#  With --subset-rmsd, the RMSD of the atom subsets of PDBComparer.SUBSETS
+#  are also appended to a second file, one row per evaluation.
+#  With --clashscore, the clash score of clashes.py is computed for every
+#  model; otherwise the field keeps its default, as for MolProbity results.
+#  With --cache, the metric results are kept in an SQLite file across runs
+#  (see cache.py): a job whose inputs, options and metric versions did not
+#  change is written from the cache, and otherwise only the metrics missing
+#  there are computed. Jobs with alternative native solutions are always
+#  computed.
+#  With --pipeline, the evaluations are split into stages scheduled by
+#  pipeline.py, so that MC-Annotate (and the MCQ and GDT jars, with --mcq and
+#  --gdt) run while the workers score other models.
+
+import argparse
+import io
+import os
+import sys
+
+from .fileio import read_text
+from .msgs import *
+
+# the external tools of the pipeline (see pipeline.py), run at most the
+# number of workers at a time by default, and those run on every model on
+# request
+TOOLS = ("mcannotate", "mcq", "gdt")
+EXTERNAL = ("mcq", "gdt")
+
+#
+# {tool: runs} of the "TOOL=N" options, None when one is not valid
+#
+def parse_tool_jobs( values ):
+    jobs = {}
+    for value in values:
+        (tool, sep, count) = value.partition( "=" )
+        if( (tool not in TOOLS) or (not count.isdigit()) or (int(count) < 1) ):
+            show( "ERROR", "Bad tool limit '%s', expected TOOL=N with TOOL one of: %s" %(value, ", ".join( TOOLS )) )
+            return( None )
+        jobs[tool] = int(count)
+    return( jobs )
+
+class Job:
+    # 'native', 'native_index' and 'model_index' may be lists, one entry per
+    # alternative native solution
+    def __init__(self, problem, native, native_index, model, model_index, name=None):
+        natives = native if isinstance( native, list ) else [native]
+        native_indexes = native_index if isinstance( native_index, list ) else [native_index]
+        model_indexes = model_index if isinstance( model_index, list ) else [model_index] * len(natives)
+        
+        self.problem = problem
+        self.name = name if name is not None else model
+        self.natives = list( zip( natives, native_indexes ) )
+        self.native = natives[0]
+        self.native_index = native_indexes[0]
+        self.model = model
+        self.model_index = model_indexes[0]
+        self.model_indexes = model_indexes
+    
+    def key(self):
+        return( (self.problem, self.name) )
+    
+    def native_key(self):
+        return( self.natives[0] )
+    
+    def native_keys(self):
+        return( self.natives )
+
+def _manifest_path( base_dir, path ):
+    if( path == "-" ):
+        return( None )
+    
+    if( os.path.isabs( path ) ):
+        return( path )
+    
+    return( os.path.normpath( os.path.join( base_dir, path ) ) )
+
+def read_manifest( fname ):
+    base_dir = os.path.dirname( os.path.abspath( fname ) )
+    jobs = []
+    keys = set()
+    
+    for (i, row) in enumerate( read_text( fname ).split( "\n" ) ):
+        row = row.strip()
+        if( row.startswith( "#" ) or (row == "") ):
+            continue
+        
+        data = row.split()
+        if( (len(data) != 5) or (not data[0].isdigit()) ):
+            show( "ERROR", "Bad manifest row %d in '%s': '%s'" %(i + 1, fname, row) )
+            return( None )
+        
+        # alternative native solutions, comma-separated
+        (natives, native_indexes, model_indexes) = [[_manifest_path( base_dir, path ) for path in data[k].split( "," )] for k in (1, 2, 4)]
+        if( (len(native_indexes) != len(natives)) or (len(model_indexes) not in (1, len(natives))) ):
+            show( "ERROR", "Different number of natives and indexes in manifest row %d in '%s': '%s'" %(i + 1, fname, row) )
+            return( None )
+        
+        jobs.append( Job( int(data[0]), natives, native_indexes, _manifest_path( base_dir, data[3] ),
+                          model_indexes if len(model_indexes) > 1 else model_indexes[0], data[3] ) )
+        
+        # the (problem, model) pair identifies the job in the checkpoint
+        if( jobs[-1].key() in keys ):
+            show( "ERROR", "Model '%s' listed twice for problem %d in '%s'" %(data[3], jobs[-1].problem, fname) )
+            return( None )
+        keys.add( jobs[-1].key() )
+    
+    return( jobs )
+
+#
+# reads the evals already written to the checkpoint file and drops a trailing
+# row left incomplete by a crash
+#
+def read_checkpoint( fname ):
+    from .utils import Eval
+    
+    done = set()
+    if( not os.path.isfile( fname ) ):
+        return( done )
+    
+    data = open( fname, "rb" ).read()
+    complete = data[:data.rfind( b"\n" ) + 1]
+    
+    if( len(complete) != len(data) ):
+        show( "WARNING", "Dropping incomplete row at the end of '%s'" %fname )
+        fo = open( fname, "r+b" )
+        fo.truncate( len(complete) )
+        fo.close()
+    
+    for row in complete.decode().split( "\n" ):
+        eval = Eval()
+        if( eval.parse( row ) ):
+            done.add( (eval.problem, eval.original) )
+    
+    return( done )
+
+# problem, name and the RMSD of each subset of PDBComparer.SUBSETS
+def subset_row( eval ):
+    from . import PDBComparer
+    
+    values = eval.subset_rmsd or {}
+    return( " ".join( [str(eval.problem), str(eval.original)] + ["%7.3f" %values.get( name, float("nan") ) for name in PDBComparer.SUBSETS] ) )
+
+class Checkpoint:
+    def __init__(self, fname, format=str):
+        self.fo = open( fname, "a" )
+        self.format = format
+    
+    def write(self, eval):
+        self.fo.write( "%s\n" %self.format( eval ) )
+        self.fo.flush()
+        os.fsync( self.fo.fileno() )
+    
+    def close(self):
+        self.fo.close()
+
+# --- worker side ---
+# native arrays by Job.native_key(), attached from shared memory in the workers
+_natives = {}
+# normalizer for the archive members
+_normalizer = None
+
+def _init_worker( handles, lists=None ):
+    global _natives
+    from .sharedmem import attach_all
+    
+    _natives = attach_all( handles )
+    _init_normalizer( lists )
+
+def _init_normalizer( lists ):
+    global _normalizer
+    from . import PDBNormalizer
+    
+    _normalizer = PDBNormalizer( lists[0], lists[1] ) if lists is not None else None
+
+def _job_natives( job ):
+    natives = [_natives.get( key, None ) for key in job.native_keys()]
+    
+    for ((native, native_index), arrays) in zip( job.native_keys(), natives ):
+        if( arrays is None ):
+            show( "ERROR", "Native '%s' not loaded" %native )
+            return( None )
+    
+    return( natives )
+
+def run_job( job, pvalue_param="-", fit_subset=None, metrics=None ):
+    from .assess import evaluate_model, evaluate_model_solutions
+    from .utils import Eval
+    
+    natives = _job_natives( job )
+    
+    try:
+        if( natives is None ):
+            eval = Eval( job.problem )
+        elif( len(natives) > 1 ):
+            eval = evaluate_model_solutions( job.problem, natives, job.model, job.model_indexes, pvalue_param, fit_subset, metrics )
+        else:
+            eval = evaluate_model( job.problem, natives[0], job.model, job.model_index, pvalue_param, fit_subset, metrics )
+    except Exception as e:
+        # a broken input must not take the whole run down
+        show( "ERROR", "%s: %s" %(job.name, e) )
+        eval = Eval( job.problem )
+    
+    eval.original = job.name
+    return( eval )
+
+#
+# normalizes and evaluates a model read from a submission archive
+#
+def run_member( job, member, pvalue_param="-", fit_subset=None, metrics=None ):
+    pdb_txt = normalize_member( job, member )
+    return( evaluate_member( job, member, pdb_txt, pvalue_param, fit_subset, metrics ) )
+
+# the normalized text of an archive member, None when it cannot be normalized
+def normalize_member( job, member ):
+    name = member_name( job, member )
+    
+    try:
+        (ok, pdb_txt) = _normalizer.parse_lines( io.StringIO( member.pdb_txt ), name )
+    except Exception as e:
+        show( "ERROR", "%s: %s" %(name, e) )
+        return( None )
+    
+    if( not ok ):
+        show( "ERROR", "Structure '%s' not normalized" %name )
+        return( None )
+    
+    return( pdb_txt )
+
+# evaluates the normalized text of an archive member (None when it was not)
+def evaluate_member( job, member, pdb_txt, pvalue_param="-", fit_subset=None, metrics=None ):
+    from .assess import evaluate_model_text, evaluate_model_text_solutions
+    from .utils import Eval
+    
+    name = member_name( job, member )
+    natives = _job_natives( job )
+    eval = Eval( job.problem )
+    
+    try:
+        if( (natives is not None) and (pdb_txt is not None) ):
+            if( len(natives) > 1 ):
+                # the member index selected for the first native serves them all
+                eval = evaluate_model_text_solutions( job.problem, natives, member.name, pdb_txt, member.index_txt, member.mcout_txt, pvalue_param, fit_subset, metrics )
+            else:
+                eval = evaluate_model_text( job.problem, natives[0], member.name, pdb_txt, member.index_txt, member.mcout_txt, pvalue_param, fit_subset, metrics )
+    except Exception as e:
+        show( "ERROR", "%s: %s" %(name, e) )
+    
+    eval.original = name
+    return( eval )
+# ---
+
+def member_name( job, member ):
+    return( "%s:%s" %(job.name, member.name) )
+
+#
+# yields (function, arguments) for every evaluation still to be done; the
+# archive rows are expanded into one evaluation per model member
+#
+def iter_tasks( jobs, done, pvalue_param="-", fit_subset=None ):
+    from .archive import is_archive, iter_models
+    
+    for job in jobs:
+        if( is_archive( job.model ) ):
+            for member in iter_models( job.model, job.native ):
+                if( (job.problem, member_name( job, member )) not in done ):
+                    yield( run_member, (job, member, pvalue_param, fit_subset) )
+        elif( job.key() not in done ):
+            yield( run_job, (job, pvalue_param, fit_subset) )
+
+#
+# the ResultCache of a run, read and written by the main process only: the
+# tasks are sent to the workers with the metrics still to compute
+#
+class TaskCache:
+    def __init__(self, fname, pvalue_param="-", fit_subset=None, lists=None, metrics=None):
+        from . import PDBComparer
+        from .cache import ResultCache, content_key, file_bytes
+        
+        self.cache = ResultCache( fname )
+        self.options = (pvalue_param, fit_subset)
+        self.metrics = PDBComparer.wanted_metrics( metrics )
+        # the archive members are normalized with the lists
+        self.lists_key = content_key( *[file_bytes( path ) for path in lists] ) if lists is not None else None
+        self._keys = {}
+        self._mcout_keys = {}
+    
+    def _mcout_key(self, path):
+        from .cache import mcout_key
+        
+        # the natives are annotated before the run, the models while it runs
+        if( path not in self._mcout_keys ):
+            self._mcout_keys[path] = mcout_key( path )
+        return( self._mcout_keys[path] )
+    
+    def _file_key(self, path, index):
+        from .cache import file_key
+        
+        if( (path, index) not in self._keys ):
+            self._keys[(path, index)] = file_key( path, index )
+        return( self._keys[(path, index)] )
+    
+    # (native, model, annotations) keys of a single-native task (see
+    # ResultCache.fetch), None for the others
+    def keys(self, function, args):
+        from .cache import annotations_key, content_key, mcout_key
+        
+        job = args[0]
+        if( len(job.natives) > 1 ):
+            return( None )
+        
+        (native_file, native_index) = job.native_key()
+        native = self._file_key( native_file, native_index )
+        if( function is run_member ):
+            member = args[1]
+            # the .mcout of a member is in its key
+            model = content_key( member.pdb_txt, member.index_txt, member.mcout_txt, self.lists_key )
+            return( (native, model, annotations_key( self._mcout_key( native_file ), None )) )
+        
+        model = self._file_key( job.model, job.model_index )
+        return( (native, model, annotations_key( self._mcout_key( native_file ), mcout_key( job.model ) )) )
+    
+    # a new Eval of a task, as run_job/run_member make it
+    def new_eval(self, function, args):
+        from .assess import model_name_fields
+        from .utils import Eval
+        
+        job = args[0]
+        if( function is run_member ):
+            (name, original) = (args[1].name, member_name( job, args[1] ))
+        else:
+            (name, original) = (job.model, job.name)
+        
+        (lab, result) = model_name_fields( name )
+        eval = Eval( job.problem, name, lab, result )
+        eval.original = original
+        return( eval )
+    
+    #
+    # the cached results of a task: (eval, keys, metrics to compute), with
+    # no metric left when every one was found
+    #
+    def fetch(self, function, args):
+        keys = self.keys( function, args )
+        eval = self.new_eval( function, args )
+        if( keys is None ):
+            return( (eval, None, None) )
+        
+        missing = self.cache.fetch( keys[0], keys[1], eval, self.metrics, *self.options, annotations=keys[2] )
+        return( (eval, keys, missing) )
+    
+    # completes the 'computed' eval of a task with its 'cached' results and stores the new ones
+    def store(self, computed, cached, keys, metrics):
+        from . import PDBComparer
+        from .cache import metric_fields
+        
+        if( (keys is None) or (not computed.ok) ):
+            return
+        
+        metrics = PDBComparer.wanted_metrics( metrics )
+        for metric in self.metrics - metrics:
+            for name in metric_fields( metric ):
+                setattr( computed, name, getattr( cached, name ) )
+        
+        self.cache.store( keys[0], keys[1], computed, metrics, *self.options, annotations=keys[2] )
+    
+    def close(self):
+        show( "INFO", "Result cache: %d metrics found, %d computed" %(self.cache.hits, self.cache.misses) )
+        self.cache.close()
+
+#
+# parses and annotates every native once for the whole run
+#
+def load_natives( jobs ):
+    from .assess import load_struct
+    
+    natives = {}
+    for job in jobs:
+        for key in job.native_keys():
+            if( key not in natives ):
+                struct = load_struct( key[0], key[1] )
+                natives[key] = struct.arrays if struct is not None else None
+    
+    return( dict( [(key, arrays) for (key, arrays) in natives.items() if arrays is not None] ) )
+
+#
+# 'metrics': those computed for every model (PDBComparer.DEFAULT_METRICS when
+# None); "subset_rmsd" is left out unless 'subsets_output' or 'fit_subset'
+# asks for it
+#
+def run_batch( jobs, output, processes=1, pvalue_param="-", lists=None, fit_subset=None, subsets_output=None, cache=None, pipeline=None, metrics=None ):
+    global _natives
+    from . import PDBComparer
+    from .archive import is_archive
+    
+    if( metrics is None ):
+        metrics = PDBComparer.DEFAULT_METRICS
+    if( (subsets_output is None) and (fit_subset is None) ):
+        metrics = tuple( [metric for metric in metrics if metric != "subset_rmsd"] )
+    
+    done = read_checkpoint( output )
+    pending = [job for job in jobs if is_archive( job.model ) or (job.key() not in done)]
+    
+    if( (lists is None) and any( [is_archive( job.model ) for job in pending] ) ):
+        show( "ERROR", "Archives need the residues and atoms lists for the normalization" )
+        return( 1 )
+    
+    show( "INFO", "%d manifest rows, %d to run (%d evaluations already done)" %(len(jobs), len(pending), len(done)) )
+    
+    checkpoint = Checkpoint( output )
+    subsets = Checkpoint( subsets_output, subset_row ) if subsets_output is not None else None
+    results = TaskCache( cache, pvalue_param, fit_subset, lists, metrics ) if cache is not None else None
+    counts = [0, 0]
+    
+    def finished( eval ):
+        if( eval.ok ):
+            checkpoint.write( eval )
+            if( subsets is not None ):
+                subsets.write( eval )
+            counts[0] += 1
+        else:
+            show( "ERROR", "Evaluation failed for '%s'" %eval.original )
+            counts[1] += 1
+    
+    def cached_tasks( tasks ):
+        # (function, arguments, cached results) of the tasks left to compute
+        for (function, args) in tasks:
+            if( results is None ):
+                yield( function, args + (metrics,), None )
+                continue
+            
+            (eval, keys, missing) = results.fetch( function, args )
+            if( keys is None ):
+                yield( function, args + (metrics,), (eval, keys, missing) )
+            # the external tools of a pipeline still run on the cached models
+            elif( (len(missing) == 0) and ((pipeline is None) or (len(pipeline.external) == 0)) ):
+                eval.ok = True
+                finished( eval )
+            else:
+                yield( function, args + (missing,), (eval, keys, missing) )
+    
+    def completed( eval, cached ):
+        if( cached is not None ):
+            results.store( eval, *cached )
+        finished( eval )
+    
+    try:
+        natives = load_natives( pending )
+        tasks = cached_tasks( iter_tasks( pending, done, pvalue_param, fit_subset ) )
+        
+        if( pipeline is not None ):
+            pipeline.run( tasks, natives, processes, lists, completed )
+        elif( processes <= 1 ):
+            _natives = natives
+            _init_normalizer( lists )
+            for (function, args, cached) in tasks:
+                completed( function( *args ), cached )
+        else:
+            from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+            from .sharedmem import SharedNatives
+            
+            # the workers attach to the natives instead of loading them again
+            with SharedNatives() as shared:
+                for (key, arrays) in natives.items():
+                    shared.publish( key, arrays )
+                
+                with ProcessPoolExecutor( max_workers=processes, initializer=_init_worker, initargs=(shared.handles, lists) ) as pool:
+                    # archive members are held in memory: only a few tasks wait in the queue
+                    running = {}
+                    for (function, args, cached) in tasks:
+                        running[pool.submit( function, *args )] = cached
+                        
+                        if( len(running) >= 2 * processes ):
+                            complete = wait( running, return_when=FIRST_COMPLETED )[0]
+                            for future in complete:
+                                completed( future.result(), running.pop( future ) )
+                    
+                    for future in wait( running )[0]:
+                        completed( future.result(), running[future] )
+    finally:
+        _natives = {}
+        checkpoint.close()
+        if( results is not None ):
+            results.close()
+        if( subsets is not None ):
+            subsets.close()
+    
+    show( "INFO", "%d evaluations done, %d failed" %(counts[0], counts[1]) )
+    return( counts[1] )
+
+def main( argv=None ):
+    from . import PDBComparer
+    
+    parser = argparse.ArgumentParser( prog="rna-assess", description="Evaluates a manifest of models against their native structures." )
+    parser.add_argument( "manifest", help="rows of: problem native native_index model model_index ('-' for no index); the model may be a tar or zip archive of models" )
+    parser.add_argument( "output", help="Eval rows are appended here; finished jobs are skipped on restart" )
+    parser.add_argument( "-j", "--jobs", type=int, default=1, help="number of worker processes (default: 1)" )
+    parser.add_argument( "--pvalue", choices=["+", "-"], default="-", help="p-value parameter set (Hajdin et al., 2010)" )
+    parser.add_argument( "--residues-list", default="data/residues.list", help="residue names used to normalize archive members" )
+    parser.add_argument( "--atoms-list", default="data/atoms.list", help="atom names used to normalize archive members" )
+    parser.add_argument( "--annotator", choices=["mcannotate", "geometric"], default=None, help="base-pair and stacking annotator (default: $RNA_ASSESSMENT_ANNOTATOR or mcannotate)" )
+    parser.add_argument( "--subset-rmsd", default=None, metavar="FILE", help="append the RMSD of each atom subset (%s) here" %", ".join( PDBComparer.SUBSETS ) )
+    parser.add_argument( "--fit-subset", choices=list( PDBComparer.SUBSETS ), default=None, help="fit every subset on this one instead of on itself" )
+    parser.add_argument( "--clashscore", action="store_true", help="compute the clash score in-process, in place of the MolProbity value" )
+    parser.add_argument( "--cache", default=None, metavar="FILE", help="SQLite cache of the metric results: unchanged inputs and metrics are not computed again" )
+    parser.add_argument( "--pipeline", action="store_true", help="run MC-Annotate and the jars as asynchronous subprocesses overlapped with the scoring (see pipeline.py)" )
+    parser.add_argument( "--tool-jobs", action="append", default=[], metavar="TOOL=N", help="concurrent runs of an external tool (%s) in the pipeline (default: -j)" %", ".join( TOOLS ) )
+    parser.add_argument( "--mcq", action="store_true", help="also run the MCQ jar on every model (implies --pipeline)" )
+    parser.add_argument( "--gdt", action="store_true", help="also run the GDT jar on every model (implies --pipeline)" )
+    parser.add_argument( "-v", "--verbose", action="store_true", help="show every diagnostic event" )
+    args = parser.parse_args( argv )
+    
+    # through the environment, so the worker processes use it too
+    if( args.annotator is not None ):
+        os.environ["RNA_ASSESSMENT_ANNOTATOR"] = args.annotator
+    
+    if( args.verbose ):
+        set_level( LEVEL_VERBOSE )
+    
+    jobs = read_manifest( args.manifest )
+    if( jobs is None ):
+        return( 2 )
+    
+    tool_jobs = parse_tool_jobs( args.tool_jobs )
+    if( tool_jobs is None ):
+        return( 2 )
+    
+    pipeline = None
+    external = [tool for tool in EXTERNAL if getattr( args, tool )]
+    if( args.pipeline or (len(external) > 0) ):
+        # asyncio is only loaded for the pipeline
+        from .pipeline import Pipeline
+        pipeline = Pipeline( tool_jobs, external )
+    
+    lists = None
+    if( os.path.isfile( args.residues_list ) and os.path.isfile( args.atoms_list ) ):
+        lists = (os.path.abspath( args.residues_list ), os.path.abspath( args.atoms_list ))
+    
+    metrics = None
+    if( args.clashscore ):
+        metrics = PDBComparer.DEFAULT_METRICS + ("clashscore",)
+    
+    failed = run_batch( jobs, args.output, args.jobs, args.pvalue, lists, args.fit_subset, args.subset_rmsd, args.cache, pipeline, metrics )
+    return( 1 if failed else 0 )
+
+if __name__ == '__main__':
+    sys.exit( main() )
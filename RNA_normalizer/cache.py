@@ -0,0 +1,175 @@
+#  cache.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  persistent cache of the metric results (SQLite), one row per (native,
+#  model, metric): the native and the model are keyed by the hash of their
+#  inputs (structure and index contents, see content_key), the metric by its
+#  version and that of the metrics it depends on (PDBComparer.METRIC_VERSIONS)
+#  and by the options it uses, which for the interaction metrics include the
+#  hash of the MC-Annotate outputs read (see mcout_key). A changed input, option or metric version
+#  misses the cache, so only the results it affects are computed again.
+
+import hashlib
+import json
+import sqlite3
+
+import numpy as np
+
+from .fileio import open_binary
+from .mcannotate import annotator, mcout_file
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS results (
+    native TEXT, model TEXT, metric TEXT, version TEXT, options TEXT, value TEXT,
+    PRIMARY KEY (native, model, metric, version, options) )"""
+
+def file_bytes( path ):
+    f = open_binary( path )
+    try:
+        return( f.read() )
+    finally:
+        f.close()
+
+# hash of some inputs (bytes, text or None), in order
+def content_key( *parts ):
+    digest = hashlib.sha1()
+    for part in parts:
+        if( part is None ):
+            digest.update( b"\x00-" )
+            continue
+        data = part if isinstance( part, bytes ) else part.encode( "utf-8" )
+        digest.update( b"\x00%d:" %len(data) )
+        digest.update( data )
+    return( digest.hexdigest() )
+
+# hash of a structure file and its index file (or None)
+def file_key( pdb_file, index_file=None ):
+    from .fileio import read_text
+    return( content_key( file_bytes( pdb_file ), read_text( index_file ) if index_file is not None else None ) )
+
+#
+# hash of the MC-Annotate output of a structure file, as MCAnnotate.load finds
+# it next to the file; None without one (MC-Annotate is run on the structure)
+# or when the interactions come from another annotator
+#
+def mcout_key( pdb_file ):
+    import os
+    from .fileio import find_input, read_text
+
+    if( annotator() != "mcannotate" ):
+        return( None )
+
+    mc_file = find_input( mcout_file( pdb_file, os.path.dirname( pdb_file ) ) )
+    return( content_key( read_text( mc_file ) ) if mc_file is not None else None )
+
+#
+# version of 'metric': its own and those of the metrics it depends on
+#
+def metric_version( metric ):
+    from . import PDBComparer
+
+    metrics = sorted( PDBComparer.wanted_metrics( (metric,) ) )
+    return( ",".join( ["%s:%d" %(name, PDBComparer.METRIC_VERSIONS[name]) for name in metrics] ) )
+
+# the options 'metric' depends on, as text
+def metric_options( metric, pvalue_param="-", fit_subset=None, windows=None, annotations=None ):
+    from . import PDBComparer
+
+    options = {}
+    if( metric == "pvalue" ):
+        options["pvalue"] = pvalue_param
+    if( (metric in PDBComparer.INF_TYPES) or (metric == "DI_ALL") ):
+        options["annotator"] = annotator()
+        if( annotations is not None ):
+            options["annotations"] = annotations
+    if( metric == "subset_rmsd" ):
+        options["fit"] = fit_subset
+    if( metric == "local_rmsd" ):
+        options["windows"] = list( PDBComparer.LOCAL_WINDOWS if windows is None else windows )
+    return( json.dumps( options, sort_keys=True ) )
+
+# the Eval attributes 'metric' fills
+def metric_fields( metric ):
+    from . import PDBComparer
+    return( PDBComparer.METRIC_FIELDS.get( metric, (metric,) ) )
+
+# the Eval attributes as JSON: numpy values as lists, dicts as (key, value) pairs
+def _encode( value ):
+    if( isinstance( value, np.ndarray ) ):
+        return( {"array": value.tolist()} )
+    if( isinstance( value, dict ) ):
+        return( {"items": [[key, _encode( item )] for (key, item) in value.items()]} )
+    if( isinstance( value, np.generic ) ):
+        return( value.item() )
+    return( value )
+
+def _decode( value ):
+    if( isinstance( value, dict ) and ("array" in value) ):
+        return( np.array( value["array"], dtype=np.float64 ) )
+    if( isinstance( value, dict ) and ("items" in value) ):
+        return( dict( [(key, _decode( item )) for (key, item) in value["items"]] ) )
+    return( value )
+
+# key of the MC-Annotate outputs of a native and a model (mcout_key), None
+# when neither has one
+def annotations_key( native, model ):
+    if( (native is None) and (model is None) ):
+        return( None )
+    return( content_key( native, model ) )
+
+class ResultCache:
+    def __init__(self, fname):
+        self.db = sqlite3.connect( fname, timeout=60 )
+        self.db.execute( SCHEMA )
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    #
+    # fills 'eval' with the cached results of the 'metrics' of the native and
+    # model keys ('annotations': the key of their MC-Annotate outputs, see
+    # annotations_key); returns the metrics not found
+    #
+    def fetch(self, native, model, eval, metrics, pvalue_param="-", fit_subset=None, windows=None, annotations=None):
+        missing = []
+        for metric in sorted( metrics ):
+            row = self.db.execute( "SELECT value FROM results WHERE native=? AND model=? AND metric=? AND version=? AND options=?",
+                                   (native, model, metric, metric_version( metric ), metric_options( metric, pvalue_param, fit_subset, windows, annotations )) ).fetchone()
+            if( row is None ):
+                missing.append( metric )
+                continue
+
+            for (name, value) in json.loads( row[0] ).items():
+                setattr( eval, name, _decode( value ) )
+
+        self.hits += len(metrics) - len(missing)
+        self.misses += len(missing)
+        return( missing )
+
+    # stores the results of the 'metrics' in 'eval'
+    def store(self, native, model, eval, metrics, pvalue_param="-", fit_subset=None, windows=None, annotations=None):
+        rows = []
+        for metric in sorted( metrics ):
+            value = json.dumps( dict( [(name, _encode( getattr( eval, name ) )) for name in metric_fields( metric )] ) )
+            rows.append( (native, model, metric, metric_version( metric ), metric_options( metric, pvalue_param, fit_subset, windows, annotations ), value) )
+
+        self.db.executemany( "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
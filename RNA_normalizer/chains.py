@@ -0,0 +1,246 @@
+#  chains.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  chain correspondence search for multi-chain targets with identical chains:
+#  the chains of the model are permuted among the native chains with the same
+#  sequence, as indexed. The atoms of every (native chain, model chain) pair
+#  are matched once; a permutation is scored with a full superposition only
+#  when its lower bound (from the per-chain centroids and radii of gyration
+#  of the matched atoms) is below the best RMSD found so far.
+#
+#  For any superposition, the squared deviations of the n matched atoms of a
+#  chain pair are at least n * (|c_native - c_model'|^2 + (rg_native - rg_model)^2)
+#  (c the centroids, c_model' once superimposed). The second term does not
+#  depend on the superposition. For the first, the distances between the
+#  centroids of two chains are kept by the superposition, so the two
+#  centroid offsets of chains a and b add up to at least the difference
+#  delta_ab of these distances between native and model, and
+#  n_a * e_a^2 + n_b * e_b^2 >= delta_ab^2 * n_a * n_b / (n_a + n_b).
+
+import math
+
+import numpy as np
+
+from .arrays import ATOM_NAMES, superimpose
+from .msgs import *
+
+#
+# ranks of the indexed residues of each chain of a loaded PDBStruct, in rank
+# order: a list of (chain, ranks)
+#
+def chain_ranks( struct ):
+    chains = []
+    ranks = {}
+    for (rank, ndx) in enumerate( struct.res_seq ):
+        chain = struct.res_list[ndx].chain
+        if( chain not in ranks ):
+            chains.append( chain )
+            ranks[chain] = []
+        ranks[chain].append( rank )
+
+    return( [(chain, np.array( ranks[chain], dtype=np.int64 )) for chain in chains] )
+
+#
+# runs of consecutive residues in parallel rank lists, one per loaded
+# PDBStruct of 'structs' (the same length each): a run goes on while, in
+# every structure, the next rank is the next residue of the file, in the same
+# chain and numbered one more. Returns the (start, length) of each run
+#
+def residue_runs( structs, ranks ):
+    def follows( struct, a, b ):
+        (ndx_a, ndx_b) = (struct.res_seq[a], struct.res_seq[b])
+        (res_a, res_b) = (struct.res_list[ndx_a], struct.res_list[ndx_b])
+        return( (ndx_b == ndx_a + 1) and (res_b.chain == res_a.chain) and (res_b.pos == res_a.pos + 1) )
+
+    length = min( [len(struct_ranks) for struct_ranks in ranks] )
+    runs = []
+    start = 0
+    for k in range( 1, length + 1 ):
+        if( (k == length) or (not all( [follows( struct, struct_ranks[k - 1], struct_ranks[k] ) for (struct, struct_ranks) in zip( structs, ranks )] )) ):
+            runs.append( (start, k - start) )
+            start = k
+
+    return( runs )
+
+def _chain_keys( arrays, ranks ):
+    # position in the chain * len(ATOM_NAMES) + code of the compared atoms of
+    # the chain, and their atom positions
+    position = np.full( max( arrays.n_ranks(), 1 ), -1, dtype=np.int64 )
+    position[ranks] = np.arange( len(ranks) )
+
+    atom_rank = arrays.atom_rank()
+    codes = arrays.codes()
+    atoms = np.flatnonzero( (atom_rank >= 0) & (codes >= 0) )
+    atoms = atoms[position[atom_rank[atoms]] >= 0]
+
+    return( position[atom_rank[atoms]] * len(ATOM_NAMES) + codes[atoms], atoms )
+
+class ChainPair:
+    # the matched atoms of a native chain and a model chain, position by position
+    def __init__(self, src_arrays, trg_arrays, src_ranks, trg_ranks):
+        (src_keys, src_atoms) = _chain_keys( src_arrays, src_ranks )
+        (trg_keys, trg_atoms) = _chain_keys( trg_arrays, trg_ranks )
+
+        (common, src_pos, trg_pos) = np.intersect1d( src_keys, trg_keys, return_indices=True )
+        self.src_ndx = src_atoms[src_pos]
+        self.trg_ndx = trg_atoms[trg_pos]
+        self.n = len(common)
+
+        src = src_arrays.coords[self.src_ndx]
+        trg = trg_arrays.coords[self.trg_ndx]
+        if( self.n > 0 ):
+            self.src_center = src.mean( axis=0 )
+            self.trg_center = trg.mean( axis=0 )
+            self.src_rg = np.sqrt( ((src - self.src_center) ** 2).sum() / self.n )
+            self.trg_rg = np.sqrt( ((trg - self.trg_center) ** 2).sum() / self.n )
+
+        # the part of the bound that does not depend on the other chains
+        self.rg_term = self.n * (self.src_rg - self.trg_rg) ** 2 if self.n > 0 else 0.0
+
+    def centroid_term(self, other):
+        # bound on the centroid offsets of this pair and 'other' (see above)
+        if( (self.n == 0) or (other.n == 0) ):
+            return( 0.0 )
+
+        delta = abs( np.linalg.norm( self.src_center - other.src_center ) - np.linalg.norm( self.trg_center - other.trg_center ) )
+        return( delta * delta * self.n * other.n / float(self.n + other.n) )
+
+class ChainAssignment:
+    def __init__(self, mapping, rmsd, scored, pruned, total):
+        # native chain -> model chain
+        self.mapping = mapping
+        self.rmsd = rmsd
+        # permutations superimposed, partial assignments left out by their
+        # bound, and permutations allowed
+        self.scored = scored
+        self.pruned = pruned
+        self.total = total
+
+    def __str__(self):
+        return( "%s %.3f" %(",".join( ["%s:%s" %(a, b) for (a, b) in self.mapping.items()] ), self.rmsd) )
+
+#
+# best chain correspondence between two loaded PDBStructs (indexed as for
+# PDBComparer.rmsd); the model chains are only permuted among the native
+# chains with the same indexed sequence. Returns a ChainAssignment or None
+#
+def search_chains( src_struct, trg_struct ):
+    (src_arrays, trg_arrays) = (src_struct.arrays, trg_struct.arrays)
+    src_chains = chain_ranks( src_struct )
+    trg_chains = chain_ranks( trg_struct )
+
+    def sequence( arrays, ranks ):
+        ranked = np.flatnonzero( arrays.res_rank >= 0 )
+        names = np.empty( arrays.n_ranks(), dtype=arrays.res_name.dtype )
+        names[arrays.res_rank[ranked]] = arrays.res_name[ranked]
+        return( "".join( names[ranks] ) )
+
+    src_seqs = [sequence( src_arrays, ranks ) for (chain, ranks) in src_chains]
+    trg_seqs = [sequence( trg_arrays, ranks ) for (chain, ranks) in trg_chains]
+
+    if( sorted( src_seqs ) != sorted( trg_seqs ) ):
+        show( "ERROR", "The chains of '%s' do not match the native chains" %trg_struct.pdb_file )
+        return( None )
+
+    # the model chains each native chain may take
+    options = [[j for j in range( len(trg_chains) ) if trg_seqs[j] == src_seqs[i]] for i in range( len(src_chains) )]
+    pairs = {}
+    for (i, js) in enumerate( options ):
+        for j in js:
+            pairs[(i, j)] = ChainPair( src_arrays, trg_arrays, src_chains[i][1], trg_chains[j][1] )
+
+    # the largest number of atoms a full assignment can match
+    n_max = sum( [max( [pairs[(i, j)].n for j in js] ) for (i, js) in enumerate( options )] )
+    if( n_max == 0 ):
+        show( "ERROR", "No atoms matched between '%s' and its native" %trg_struct.pdb_file )
+        return( None )
+
+    best = [None, float("inf")]
+    counts = [0, 0]
+
+    def score( assignment ):
+        chosen = [pairs[(i, j)] for (i, j) in enumerate( assignment )]
+        src_ndx = np.concatenate( [pair.src_ndx for pair in chosen] )
+        trg_ndx = np.concatenate( [pair.trg_ndx for pair in chosen] )
+        counts[0] += 1
+        if( len(src_ndx) == 0 ):
+            return( float("inf") )
+        return( superimpose( src_arrays.coords[src_ndx], trg_arrays.coords[trg_ndx] )[2] )
+
+    def search( assignment, used, bound ):
+        i = len(assignment)
+        if( i == len(src_chains) ):
+            if( assignment == best[0] ):
+                return
+            rms = score( assignment )
+            if( rms < best[1] ):
+                best[0] = list( assignment )
+                best[1] = rms
+            return
+
+        # the chains closest in size and shape first
+        for j in sorted( options[i], key=lambda j: pairs[(i, j)].rg_term ):
+            if( j in used ):
+                continue
+
+            pair = pairs[(i, j)]
+            new_bound = (bound[0] + pair.rg_term, max( [bound[1]] + [pair.centroid_term( pairs[(k, jk)] ) for (k, jk) in enumerate( assignment )] ))
+            if( np.sqrt( (new_bound[0] + new_bound[1]) / n_max ) >= best[1] ):
+                # every completion of this assignment is bounded too
+                counts[1] += 1
+                continue
+
+            search( assignment + [j], used | set( [j] ), new_bound )
+
+    # the indexed correspondence first, when it is allowed: a good first bound
+    identity = list( range( len(src_chains) ) )
+    if( all( [i in options[i] for i in identity] ) ):
+        best = [identity, score( identity )]
+
+    search( [], set(), (0.0, 0.0) )
+
+    if( best[0] is None ):
+        return( None )
+
+    mapping = dict( [(src_chains[i][0], trg_chains[j][0]) for (i, j) in enumerate( best[0] )] )
+    return( ChainAssignment( mapping, best[1], counts[0], counts[1], permutations( src_seqs ) ) )
+
+# number of chain permutations between chains with the same sequences
+def permutations( seqs ):
+    total = 1
+    for seq in set( seqs ):
+        total *= math.factorial( seqs.count( seq ) )
+    return( total )
+
+#
+# index text of the model residues under a chain 'mapping' (native chain ->
+# model chain), in the order of the native chains: once loaded with
+# PDBStruct._load_index_text the ranks of the model follow the mapping
+#
+def permuted_index( src_struct, trg_struct, mapping ):
+    trg_ranks = dict( chain_ranks( trg_struct ) )
+
+    entries = []
+    for (chain, ranks) in chain_ranks( src_struct ):
+        ranks = trg_ranks[mapping[chain]]
+        for (start, count) in residue_runs( [trg_struct], [ranks] ):
+            residue = trg_struct.res_list[trg_struct.res_seq[ranks[start]]]
+            entries.append( "%s:%d:%d" %(residue.chain, residue.pos, count) )
+
+    return( ",".join( entries ) )
@@ -0,0 +1,127 @@
+#  clashes.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  steric clash score of a structure, in the spirit of the MolProbity
+#  clashscore: the number of serious clashes (van der Waals overlap of at
+#  least CLASH_OVERLAP) per 1000 atoms. Only the heavy atoms are used, as the
+#  structures are not protonated: pairs of polar atoms (possible hydrogen
+#  bonds) may overlap HBOND_ALLOWANCE more, and the atoms of a residue, or
+#  within three bonds of the O3'-P link of two consecutive residues, are
+#  never in clash. The close pairs come from the cell grid of grid.py.
+
+import numpy as np
+
+from .grid import neighbor_pairs
+
+# Bondi van der Waals radii, DEFAULT_RADIUS for the other elements
+VDW_RADII = { "C": 1.70, "N": 1.55, "O": 1.52, "P": 1.80, "S": 1.80 }
+DEFAULT_RADIUS = 1.80
+POLAR = ("N", "O")
+
+CLASH_OVERLAP = 0.4
+HBOND_ALLOWANCE = 0.6
+
+# atoms within three bonds of the O3'(i)-P(i+1) link
+LINK_PREV = ("C2'", "C3'", "C4'", "O3'")
+LINK_NEXT = ("P", "OP1", "OP2", "O5'", "C5'")
+
+def _heavy_atoms( arrays ):
+    # the element of each atom (from its name when missing) and the positions of the heavy atoms
+    elements = np.char.upper( np.char.strip( arrays.elements ) )
+    missing = elements == ""
+    if( missing.any() ):
+        elements[missing] = np.array( [name.strip()[:1] for name in arrays.names[missing]] )
+    return( elements, np.flatnonzero( (elements != "H") & (elements != "D") ) )
+
+def _cutoff():
+    radius = max( list( VDW_RADII.values() ) + [DEFAULT_RADIUS] )
+    return( 2 * radius - CLASH_OVERLAP )
+
+#
+# (i, j, overlap) of the clashing heavy atoms of 'arrays', i < j
+#
+def clash_pairs( arrays ):
+    (elements, heavy) = _heavy_atoms( arrays )
+    return( _clash_pairs( arrays, elements, heavy, neighbor_pairs( arrays.coords[heavy], _cutoff() ) ) )
+
+# the clashes among the close 'pairs' (i, j, distance) of the 'heavy' atoms
+def _clash_pairs( arrays, elements, heavy, pairs ):
+    (i, j, dist) = pairs
+    (i, j) = (heavy[i], heavy[j])
+
+    radius = np.array( [VDW_RADII.get( element, DEFAULT_RADIUS ) for element in elements] )
+    polar = np.isin( elements, POLAR )
+    overlap = radius[i] + radius[j] - dist
+    threshold = np.where( polar[i] & polar[j], CLASH_OVERLAP + HBOND_ALLOWANCE, CLASH_OVERLAP )
+
+    # the bonded atoms: same residue, or the link of consecutive residues
+    (res_i, res_j) = (arrays.res_ndx[i], arrays.res_ndx[j])
+    (first, second) = (np.minimum( res_i, res_j ), np.maximum( res_i, res_j ))
+    link = (second - first == 1) & (arrays.res_chain[first] == arrays.res_chain[second])
+    name_first = np.where( res_i <= res_j, arrays.names[i], arrays.names[j] )
+    name_second = np.where( res_i <= res_j, arrays.names[j], arrays.names[i] )
+    link &= np.isin( name_first, LINK_PREV ) & np.isin( name_second, LINK_NEXT )
+
+    keep = (overlap >= threshold) & (res_i != res_j) & ~link
+    return( i[keep], j[keep], overlap[keep] )
+
+def _score( clashes, n ):
+    return( 1000.0 * clashes / n if n > 0 else 0.0 )
+
+# serious clashes per 1000 heavy atoms
+def clashscore( arrays ):
+    (elements, heavy) = _heavy_atoms( arrays )
+    (i, j, overlap) = _clash_pairs( arrays, elements, heavy, neighbor_pairs( arrays.coords[heavy], _cutoff() ) )
+    return( _score( len(i), len(heavy) ) )
+
+#
+# clashscore() of each of the AtomArrays of 'arrays_list' (e.g. the models of
+# a puzzle) with a single cell grid: the models are laid side by side, far
+# enough apart to never be neighbors
+#
+def batch_clashscores( arrays_list ):
+    cutoff = _cutoff()
+
+    heavy_list = []
+    shifted = []
+    shift = 0.0
+    for arrays in arrays_list:
+        (elements, heavy) = _heavy_atoms( arrays )
+        coords = arrays.coords[heavy]
+        if( len(coords) > 0 ):
+            coords = coords - coords.min( axis=0 ) + np.array( [shift, 0.0, 0.0] )
+            shift = coords[:, 0].max() + 2 * cutoff
+        heavy_list.append( (elements, heavy) )
+        shifted.append( coords )
+
+    sizes = np.array( [len(coords) for coords in shifted], dtype=np.int64 )
+    starts = np.cumsum( sizes ) - sizes
+    (i, j, dist) = neighbor_pairs( np.concatenate( shifted ) if len(shifted) > 0 else np.zeros( (0, 3) ), cutoff )
+
+    # the pairs of each model, sorted by i
+    bounds = np.searchsorted( i, np.append( starts, sizes.sum() ) )
+    scores = []
+    for (k, arrays) in enumerate( arrays_list ):
+        part = slice( bounds[k], bounds[k + 1] )
+        (elements, heavy) = heavy_list[k]
+        pairs = (i[part] - starts[k], j[part] - starts[k], dist[part])
+        clashes = _clash_pairs( arrays, elements, heavy, pairs )
+        scores.append( _score( len(clashes[0]), len(heavy) ) )
+
+    return( np.array( scores ) )
@@ -0,0 +1,126 @@
+#  consensus.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  interaction frequencies over an ensemble of models of the same puzzle: how
+#  many models have each interaction, counted in one pass over the packed
+#  interaction keys of all the models (see interactions.py) and kept sparse,
+#  as the sorted keys found and their counts
+
+import numpy as np
+
+from . import interactions as inter
+from .msgs import *
+
+VARNA_EDGES = {"W":"wc", "S":"s", "H":"h"}
+
+# VARNA color of a frequency, from red (no model) to green (every model)
+def frequency_color( frequency ):
+    return( "#%02X%02X00" %(int(round( 255 * (1.0 - frequency) )), int(round( 255 * frequency ))) )
+
+class InteractionFrequencies:
+    #
+    # 'keys_list' holds the sorted packed keys of each model (see
+    # AtomArrays.packed_interactions); an interaction repeated in a model
+    # counts once for it
+    #
+    def __init__(self, keys_list):
+        self.n_models = len(keys_list)
+
+        (keys, model, first) = inter.concat_keys( keys_list )
+        (self.keys, self.counts) = np.unique( keys[first], return_counts=True )
+
+    @classmethod
+    def from_arrays(cls, arrays_list):
+        return( cls( [arrays.packed_interactions() for arrays in arrays_list] ) )
+
+    def __len__(self):
+        return( len(self.keys) )
+
+    # the interactions of 'type' (see interactions.SELECTIONS), as a new
+    # InteractionFrequencies over the same models
+    def select(self, type="ALL"):
+        result = InteractionFrequencies( [] )
+        result.n_models = self.n_models
+
+        keep = inter.key_mask( self.keys, type )
+        (result.keys, result.counts) = (self.keys[keep], self.counts[keep])
+        return( result )
+
+    # number of models with each of the packed 'keys', 0 for the keys never seen
+    def count(self, keys):
+        keys = np.asarray( keys, dtype=np.int64 )
+        if( len(self.keys) == 0 ):
+            return( np.zeros( len(keys), dtype=np.int64 ) )
+
+        pos = np.minimum( np.searchsorted( self.keys, keys ), len(self.keys) - 1 )
+        return( np.where( self.keys[pos] == keys, self.counts[pos], 0 ) )
+
+    def frequency(self, keys=None):
+        counts = self.counts if keys is None else self.count( keys )
+        return( counts / float(max( self.n_models, 1 )) )
+
+    # (type, rank_a, rank_b, extra) rows of the interactions, as interactions.encode
+    def rows(self):
+        return( inter.unpack( self.keys ) )
+
+    # the (type, rank_a, rank_b, extra) tuples and their counts, most frequent first
+    def most_common(self, n=None):
+        order = np.argsort( -self.counts, kind="stable" )[:n]
+        return( list( zip( inter.decode( inter.unpack( self.keys[order] ) ), self.counts[order].tolist() ) ) )
+
+    # the interactions of the native keys found in no model
+    def missed(self, native_keys):
+        native_keys = np.unique( native_keys )
+        return( inter.decode( inter.unpack( native_keys[self.count( native_keys ) == 0] ) ) )
+
+    #
+    # (n_ranks, n_ranks) frequencies of the residue pairs: the frequency of the
+    # most common interaction between two residues, in both halves
+    #
+    def matrix(self, n_ranks):
+        rows = self.rows()
+        freq = np.zeros( (n_ranks, n_ranks) )
+        if( len(rows) > 0 and rows[:, 1:3].max() >= n_ranks ):
+            show( "FATAL", "Interaction rank beyond the %d residues of the matrix" %n_ranks )
+
+        np.maximum.at( freq, (rows[:, 1], rows[:, 2]), self.frequency() )
+        return( np.maximum( freq, freq.T ) )
+
+    #
+    # VARNA data of the base pairs, as PDBComparer.VARNA: the pairs of the
+    # native (its sorted packed keys) colored by the share of the models that
+    # have them, or all the pairs of the models when there is no native
+    #
+    def VARNA(self, sequence, native_keys=None, algorithm="radiate"):
+        if( native_keys is None ):
+            pairs = self.select( "PAIR" ).keys
+        else:
+            pairs = np.unique( inter.select_keys( np.asarray( native_keys, dtype=np.int64 ), "PAIR" ) )
+
+        aux_bps = []
+        for ((stype, sb1, sb2, sextra), freq) in zip( inter.decode( inter.unpack( pairs ) ), self.frequency( pairs ).tolist() ):
+            aux_bps.append( "(%d,%d):color=%s,edge5=%s,edge3=%s,stericity=%s" %(sb1+1, sb2+1, frequency_color( freq ), VARNA_EDGES[sextra[0]], VARNA_EDGES[sextra[1]], sextra[2:]) )
+
+        data = {}
+        data["sequenceDBN"] = sequence
+        data["structureDBN"] = "." * len(sequence)
+        data["auxBPs"] = ";".join( aux_bps )
+        data["algorithm"] = algorithm
+
+        return( data )
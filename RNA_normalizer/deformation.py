@@ -0,0 +1,106 @@
+#  deformation.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  deformation profile (Parisien et al., RNA 15, 2009) of a model against its
+#  native, on the AtomArrays already loaded: the model is fitted on each
+#  residue i of the native in turn (its matched atoms), and the cell (i, j) of
+#  the matrix is the distance between the centroids of the matched atoms of
+#  residue j in the native and in the fitted model. The fits of all the
+#  residues, and of all the models of a batch, come from the per-residue
+#  moments of local.py in one batch of 3x3 SVDs.
+
+import numpy as np
+
+from .arrays import match_atoms
+from .local import MIN_ATOMS, moment_fits, rank_sums
+from .msgs import *
+
+# rows of the matrix computed at once, to bound the (rows, n_ranks, 3) deviations
+BLOCK_CELLS = 1 << 20
+
+def _matrix( rot, mean_a, mean_b, n ):
+    size = len(n)
+    matrix = np.full( (size, size), np.nan )
+    fitted = np.flatnonzero( n >= MIN_ATOMS )
+    present = n > 0
+
+    block = max( BLOCK_CELLS // max( size, 1 ), 1 )
+    for start in range( 0, len(fitted), block ):
+        rows = fitted[start:start + block]
+        # dot(mean_b[j] - mean_b[i], rot[i]) + mean_a[i] - mean_a[j]
+        diff = np.einsum( "jk,ikl->ijl", mean_b, rot[rows] ) - np.einsum( "ik,ikl->il", mean_b[rows], rot[rows] )[:, None, :]
+        diff += mean_a[rows][:, None, :] - mean_a[None, :, :]
+        matrix[rows] = np.sqrt( (diff * diff).sum( axis=2 ) )
+
+    matrix[:, ~present] = np.nan
+    return( matrix )
+
+def _sums( src_arrays, trg_arrays, diag=None ):
+    matched = match_atoms( src_arrays, trg_arrays, diag )
+    if( matched is None ):
+        return( None )
+
+    (src_ndx, trg_ndx) = matched
+    return( rank_sums( src_arrays.coords[src_ndx], trg_arrays.coords[trg_ndx], src_arrays.atom_rank()[src_ndx], src_arrays.n_ranks() ) )
+
+#
+# (n_ranks, n_ranks) deformation matrix of 'trg_arrays' against 'src_arrays',
+# indexed by residue rank; nan for the rows of the residues with fewer than
+# MIN_ATOMS matched atoms and for the columns of the residues without any.
+# None when the indexes do not match
+#
+def deformation_matrix( src_arrays, trg_arrays, diag=None ):
+    return( deformation_matrices( src_arrays, [trg_arrays], diag )[0] )
+
+#
+# deformation_matrix() of each of the AtomArrays of 'trg_arrays_list' (with
+# the index of the native), the fits of all the models in a single batch
+#
+def deformation_matrices( src_arrays, trg_arrays_list, diag=None ):
+    sums = [_sums( src_arrays, trg_arrays, diag ) for trg_arrays in trg_arrays_list]
+    valid = [value for value in sums if value is not None]
+    if( len(valid) == 0 ):
+        return( [None] * len(sums) )
+
+    size = src_arrays.n_ranks()
+    (rot, mean_a, mean_b, n) = moment_fits( np.concatenate( valid ) )
+
+    matrices = []
+    k = 0
+    for value in sums:
+        if( value is None ):
+            matrices.append( None )
+            continue
+
+        part = slice( k * size, (k + 1) * size )
+        matrices.append( _matrix( rot[part], mean_a[part], mean_b[part], n[part] ) )
+        k += 1
+
+    return( matrices )
+
+# mean deviation of each residue over the fits of the other residues
+def deformation_profile( matrix ):
+    off = matrix.copy()
+    np.fill_diagonal( off, np.nan )
+    count = (~np.isnan( off )).sum( axis=0 )
+    with np.errstate( invalid="ignore", divide="ignore" ):
+        return( np.where( count > 0, np.nansum( off, axis=0 ) / count, np.nan ) )
+
+def write_matrix( matrix, fname ):
+    np.savetxt( fname, matrix, fmt="%.3f" )
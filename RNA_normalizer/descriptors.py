@@ -0,0 +1,137 @@
+#  descriptors.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  structural descriptors computed on the AtomArrays of a structure: centroid,
+#  radius of gyration, residue distance and contact maps. The residue maps
+#  are indexed by the rank of the residues in the index, so the maps of a
+#  model and of its native line up
+
+import numpy as np
+
+from .grid import neighbor_pairs
+
+# atom standing for its residue in the distance maps
+RESIDUE_ATOM = "C1'"
+
+# two residues are in contact when two of their atoms are closer than this
+CONTACT_CUTOFF = 4.0
+
+def centroid( coords ):
+    return( coords.mean( axis=0 ) )
+
+def radius_of_gyration( coords ):
+    diff = coords - centroid( coords )
+    return( float( np.sqrt( (diff * diff).sum() / len(coords) ) ) )
+
+def distance_matrix( points ):
+    # nan for the missing points
+    diff = points[..., :, None, :] - points[..., None, :, :]
+    return( np.sqrt( (diff * diff).sum( axis=-1 ) ) )
+
+#
+# descriptors of one structure, each computed once (see PDBStruct.descriptors)
+#
+class Descriptors:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        if( key not in self._cache ):
+            self._cache[key] = compute()
+        return( self._cache[key] )
+
+    def centroid(self):
+        return( self._cached( ("centroid",), lambda: centroid( self.arrays.coords ) ) )
+
+    def rg(self):
+        return( self._cached( ("rg",), lambda: radius_of_gyration( self.arrays.coords ) ) )
+
+    def residue_coords(self, atom=RESIDUE_ATOM):
+        # (residues in the index, 3), nan for the residues without 'atom'
+        def compute():
+            arrays = self.arrays
+            rank = arrays.atom_rank()
+            points = np.full( (arrays.n_ranks(), 3), np.nan )
+
+            mask = (rank >= 0) & (arrays.names == atom)
+            points[rank[mask]] = arrays.coords[mask]
+            return( points )
+
+        return( self._cached( ("residue_coords", atom), compute ) )
+
+    def distance_map(self, atom=RESIDUE_ATOM):
+        return( self._cached( ("distance_map", atom), lambda: distance_matrix( self.residue_coords( atom ) ) ) )
+
+    def contacts(self, cutoff=CONTACT_CUTOFF):
+        # (rank_a, rank_b) of the residues in contact, rank_a < rank_b, sorted
+        def compute():
+            arrays = self.arrays
+            rank = arrays.atom_rank()
+            atoms = np.flatnonzero( rank >= 0 )
+
+            (i, j, dist) = neighbor_pairs( arrays.coords[atoms], cutoff )
+            (rank_a, rank_b) = (rank[atoms[i]], rank[atoms[j]])
+
+            keys = np.unique( np.minimum( rank_a, rank_b ).astype( np.int64 ) * arrays.n_ranks() + np.maximum( rank_a, rank_b ) )
+            (rank_a, rank_b) = np.divmod( keys, arrays.n_ranks() )
+            keep = rank_a != rank_b
+            return( (rank_a[keep], rank_b[keep]) )
+
+        return( self._cached( ("contacts", cutoff), compute ) )
+
+    def contact_map(self, cutoff=CONTACT_CUTOFF):
+        def compute():
+            n = self.arrays.n_ranks()
+            (rank_a, rank_b) = self.contacts( cutoff )
+
+            cmap = np.zeros( (n, n), dtype=bool )
+            cmap[rank_a, rank_b] = True
+            cmap[rank_b, rank_a] = True
+            return( cmap )
+
+        return( self._cached( ("contact_map", cutoff), compute ) )
+
+#
+# batches over the Descriptors of the models of a puzzle; the results are
+# also kept in the cache of each model
+#
+def batch_rg( descriptors ):
+    # one pass over the concatenated coordinates of all the models
+    sizes = np.array( [len(desc.arrays.coords) for desc in descriptors] )
+    coords = np.concatenate( [desc.arrays.coords for desc in descriptors] )
+    starts = np.cumsum( sizes ) - sizes
+
+    means = np.add.reduceat( coords, starts, axis=0 ) / sizes[:, None]
+    diff = coords - np.repeat( means, sizes, axis=0 )
+    rg = np.sqrt( np.add.reduceat( (diff * diff).sum( axis=1 ), starts ) / sizes )
+
+    for (desc, mean, value) in zip( descriptors, means, rg ):
+        desc._cache.setdefault( ("centroid",), mean )
+        desc._cache.setdefault( ("rg",), float(value) )
+    return( rg )
+
+def batch_distance_maps( descriptors, atom=RESIDUE_ATOM ):
+    # (models, residues, residues); the models must have the same residues in their index
+    points = np.stack( [desc.residue_coords( atom ) for desc in descriptors] )
+    maps = distance_matrix( points )
+
+    for (desc, dmap) in zip( descriptors, maps ):
+        desc._cache.setdefault( ("distance_map", atom), dmap )
+    return( maps )
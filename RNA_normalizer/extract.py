@@ -3,7 +3,9 @@
 #
 import sys
 
-from Bio.PDB import *
+from Bio.PDB import PDBIO, PDBParser, Select
+
+from .fileio import open_input
 
 class MySelect(Select):
     def config( self, res_list ):
@@ -14,7 +16,7 @@ class MySelect(Select):
             res_id = int(res_data[1])
             count = int(res_data[2])
 
-            for i in xrange( 0, count ):
+            for i in range( 0, count ):
                 self.res_list.append( "%s|%s" %(chain, str(res_id+i)) )
 
     def accept_residue(self, residue):
@@ -53,7 +55,8 @@ def extract_PDB(p1,p2,p3):
 	
 	parser = PDBParser()
 	# Open and parse the structure (the first parameter is arbitrary)
-	sinput = parser.get_structure( "SI", p1 )
+	with open_input( p1 ) as f:
+		sinput = parser.get_structure( "SI", f )
 
 	# prepares the select class
 	select_class =  MySelect()
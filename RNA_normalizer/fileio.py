@@ -0,0 +1,115 @@
+#  fileio.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  input layer shared by all the readers: .gz/.bz2/.xz (and .zst when the
+#  'zstandard' package is installed) are decompressed as streams
+
+import io
+import os
+
+from .msgs import *
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+ENCODING = "utf-8"
+
+def compression( path ):
+    for suffix in COMPRESSED_SUFFIXES:
+        if( path.endswith( suffix ) ):
+            return( suffix )
+    return( None )
+
+def strip_compression( path ):
+    suffix = compression( path )
+    return( path[:-len(suffix)] if suffix is not None else path )
+
+#
+# returns 'path' or the first of its compressed variants that exists, None
+# if there is none
+#
+def find_input( path ):
+    for candidate in [path] + [path + suffix for suffix in COMPRESSED_SUFFIXES]:
+        if( os.path.isfile( candidate ) ):
+            return( candidate )
+    return( None )
+
+def open_binary( path ):
+    suffix = compression( path )
+    
+    if( suffix is None ):
+        return( open( path, "rb" ) )
+    elif( suffix == ".gz" ):
+        import gzip
+        return( gzip.open( path, "rb" ) )
+    elif( suffix == ".bz2" ):
+        import bz2
+        return( bz2.open( path, "rb" ) )
+    elif( suffix == ".xz" ):
+        import lzma
+        return( lzma.open( path, "rb" ) )
+    
+    try:
+        import zstandard
+    except ImportError:
+        show( "FATAL", "Reading '%s' requires the 'zstandard' package" %path )
+    
+    return( zstandard.ZstdDecompressor().stream_reader( open( path, "rb" ), closefd=True ) )
+
+# decompresses a member read from an archive, returns (name, data)
+def decompress_bytes( name, data ):
+    suffix = compression( name )
+    
+    if( suffix is None ):
+        return( name, data )
+    elif( suffix == ".gz" ):
+        import gzip
+        data = gzip.decompress( data )
+    elif( suffix == ".bz2" ):
+        import bz2
+        data = bz2.decompress( data )
+    elif( suffix == ".xz" ):
+        import lzma
+        data = lzma.decompress( data )
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            show( "FATAL", "Reading '%s' requires the 'zstandard' package" %name )
+        data = zstandard.ZstdDecompressor().decompressobj().decompress( data )
+    
+    return( name[:-len(suffix)], data )
+
+def open_input( path ):
+    # text stream with universal newlines, whatever the compression
+    return( io.TextIOWrapper( open_binary( path ), encoding=ENCODING, errors="replace" ) )
+
+def read_text( path ):
+    f = open_input( path )
+    try:
+        return( f.read() )
+    finally:
+        f.close()
+
+def iter_lines( path ):
+    f = open_input( path )
+    try:
+        for line in f:
+            yield line
+    finally:
+        f.close()
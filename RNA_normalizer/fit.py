@@ -2,9 +2,12 @@
 # Fits two or more molecules
 #
 import os
+import sys
 
-from Bio.Clustalw import *
-from Bio.PDB import *
+from Bio.PDB import PDBParser, Superimposer
+
+from .fileio import open_input
+from .pdbwriter import write_struct
 
 BACKBONE = ["C1'", "C1*", "C2'", "C2*", "C3'", "C3*", "C4'", "C4*", "C5'", "C5*", "O2'", "O2*", "O3'", "O3*", "O4'", "O4*", "O5'", "O5*", "P"]
 FULL_ATOMS = ["C1'", "C1*", "C2'", "C2", "C2*", "C3'", "C3*", "C4'", "C4", "C4*", "C5'", "C5", "C5*", "C6", "C8", "N1", "N2", "N3", "N7", "N9", "O2'", "O2*", "O3'", "O3*", "O4'", "O4*", "O5'", "O5*", "O6", "P"]
@@ -13,9 +16,7 @@ FULL_ATOMS = ["C1'", "C1*", "C2'", "C2", "C2*", "C3'", "C3*", "C4'", "C4", "C4*"
 ATOM_LIST = FULL_ATOMS
 
 def WritePDB( struct, file ):
-    io = PDBIO()
-    io.set_structure( struct )
-    io.save( file )
+    write_struct( struct, file )
 
 def ResiduesFromModel( model, res_list ):
     residues = []
@@ -89,7 +90,7 @@ def GetAtomsFromResidues( ref_residues, cmp_residues ):
     if( len(ref_residues) != len(cmp_residues) ):
         print("!! Different number of residues!")
 
-    for i in xrange( 0, min(len(ref_residues), len(cmp_residues)) ):
+    for i in range( 0, min(len(ref_residues), len(cmp_residues)) ):
         rr = ref_residues[i]
         cr = cmp_residues[i]
         
@@ -142,8 +143,10 @@ def go_fit( pdb_ref, pdb_cmp, res_ref, res_cmp ):
     # Open and parse the structure (the first parameter is arbitrary)
     parser = PDBParser()
     
-    s1 = parser.get_structure( "S1", pdb_ref )
-    s2 = parser.get_structure( "S2", pdb_cmp )
+    with open_input( pdb_ref ) as f:
+        s1 = parser.get_structure( "S1", f )
+    with open_input( pdb_cmp ) as f:
+        s2 = parser.get_structure( "S2", f )
     res_list_1 = parse_res_list( res_ref )
     res_list_2 = parse_res_list( res_cmp )
     
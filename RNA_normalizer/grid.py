@@ -0,0 +1,131 @@
+#  grid.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  uniform cell grid (cell list) for the neighbor searches: points are
+#  bucketed in cubic cells as large as the search distance, so only the
+#  points of adjacent cells are compared and a search is near-linear in the
+#  number of points
+
+import numpy as np
+
+from .msgs import *
+
+# the cell itself and half of its 26 neighbors: every pair of adjacent cells
+# is visited once
+HALF_OFFSETS = np.array( [(0, 0, 0)] + [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                                         if (dx, dy, dz) > (0, 0, 0)], dtype=np.int64 )
+
+class CellGrid:
+    def __init__(self, coords, cell):
+        self.coords = np.asarray( coords, dtype=np.float64 ).reshape( (-1, 3) )
+        self.cell = float(cell)
+
+        n = len(self.coords)
+        if( n == 0 ):
+            self.order = np.zeros( 0, dtype=np.int64 )
+            self.keys = np.zeros( 0, dtype=np.int64 )
+            self.start = np.zeros( 0, dtype=np.int64 )
+            self.count = np.zeros( 0, dtype=np.int64 )
+            self._shape = np.ones( 3, dtype=np.int64 )
+            return
+
+        # cell of each point, shifted by one so that neighbors never go negative
+        cells = np.floor( (self.coords - self.coords.min( axis=0 )) / self.cell ).astype( np.int64 ) + 1
+        self._shape = cells.max( axis=0 ) + 2
+
+        keys = self._key( cells )
+        self.order = np.argsort( keys, kind="stable" )
+        (self.keys, self.start, self.count) = np.unique( keys[self.order], return_index=True, return_counts=True )
+
+    def _key( self, cells ):
+        return( (cells[..., 0] * self._shape[1] + cells[..., 1]) * self._shape[2] + cells[..., 2] )
+
+    def _cells( self, keys ):
+        (rest, z) = np.divmod( keys, self._shape[2] )
+        (x, y) = np.divmod( rest, self._shape[1] )
+        return( np.stack( (x, y, z), axis=-1 ) )
+
+    #
+    # (i, j, distance) of the pairs of points closer than 'cutoff' (at most
+    # the cell size), with i < j
+    #
+    def pairs( self, cutoff=None ):
+        if( cutoff is None ):
+            cutoff = self.cell
+        elif( cutoff > self.cell ):
+            show( "FATAL", "Cutoff %g larger than the cell size %g" %(cutoff, self.cell) )
+
+        empty = np.zeros( 0, dtype=np.int64 )
+        if( len(self.keys) == 0 ):
+            return( empty, empty, np.zeros( 0 ) )
+
+        cells = self._cells( self.keys )
+
+        all_i = []
+        all_j = []
+        for offset in HALF_OFFSETS:
+            # the occupied cells next to each occupied cell
+            nkeys = self._key( cells + offset )
+            pos = np.minimum( np.searchsorted( self.keys, nkeys ), len(self.keys) - 1 )
+            found = np.flatnonzero( self.keys[pos] == nkeys )
+            if( len(found) == 0 ):
+                continue
+
+            (i, j) = self._block_pairs( found, pos[found] )
+
+            if( not offset.any() ):
+                # the pairs inside a cell, once
+                keep = i < j
+                (i, j) = (i[keep], j[keep])
+
+            all_i.append( i )
+            all_j.append( j )
+
+        if( len(all_i) == 0 ):
+            return( empty, empty, np.zeros( 0 ) )
+
+        i = self.order[np.concatenate( all_i )]
+        j = self.order[np.concatenate( all_j )]
+
+        diff = self.coords[i] - self.coords[j]
+        dist = np.sqrt( (diff * diff).sum( axis=1 ) )
+
+        keep = dist < cutoff
+        (i, j, dist) = (i[keep], j[keep], dist[keep])
+
+        # i < j, sorted
+        (i, j) = (np.minimum( i, j ), np.maximum( i, j ))
+        order = np.lexsort( (j, i) )
+        return( i[order], j[order], dist[order] )
+
+    # every (sorted position) pair between the points of the cells a and b
+    def _block_pairs( self, a, b ):
+        (count_a, count_b) = (self.count[a], self.count[b])
+        sizes = count_a * count_b
+
+        block = np.repeat( np.arange( len(a) ), sizes )
+        local = np.arange( sizes.sum() ) - np.repeat( np.cumsum( sizes ) - sizes, sizes )
+
+        i = self.start[a][block] + local // count_b[block]
+        j = self.start[b][block] + local % count_b[block]
+        return( i, j )
+
+# pairs of 'coords' closer than 'cutoff', see CellGrid.pairs()
+def neighbor_pairs( coords, cutoff ):
+    return( CellGrid( coords, cutoff ).pairs( cutoff ) )
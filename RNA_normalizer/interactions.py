@@ -0,0 +1,181 @@
+#  interactions.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  integer encoding of the (type, rank_a, rank_b, extra) interaction tuples
+#  built by PDBStruct._load_annotations_3D, and their packing into single
+#  int64 keys: sorted key arrays compare as sets with searchsorted, for one
+#  model or for a whole ensemble at once
+
+import numpy as np
+
+from .msgs import *
+
+TYPES = ("PAIR_2D", "PAIR_3D", "STACK")
+
+EDGES = ("W", "H", "S")
+ORIENTATIONS = ("cis", "trans")
+STACKINGS = ("inward", "upward", "downward", "outward")
+
+# pair extras are '<edge a><edge b><orientation>', stack extras the stacking type
+EXTRAS = tuple( ["%s%s%s" %(a, b, o) for a in EDGES for b in EDGES for o in ORIENTATIONS] ) + STACKINGS
+
+TYPE_CODES = dict( [(t, i) for (i, t) in enumerate( TYPES )] )
+EXTRA_CODES = dict( [(e, i) for (i, e) in enumerate( EXTRAS )] )
+
+# the interaction types accepted by PDBStruct.get_interactions
+SELECTIONS = {
+    "ALL": TYPES,
+    "PAIR": ("PAIR_2D", "PAIR_3D"),
+    "PAIR_2D": ("PAIR_2D",),
+    "PAIR_3D": ("PAIR_3D",),
+    "STACK": ("STACK",),
+}
+
+#
+# returns an (M, 4) int32 array with one (type, rank_a, rank_b, extra) row
+# per interaction
+#
+def encode( interactions ):
+    rows = np.zeros( (len(interactions), 4), dtype=np.int32 )
+    
+    for (i, (type, rank_a, rank_b, extra)) in enumerate( interactions ):
+        code = EXTRA_CODES.get( extra, None )
+        if( code is None ):
+            show( "FATAL", "Unknown interaction extra '%s' in %s" %(extra, type) )
+        
+        rows[i] = (TYPE_CODES[type], rank_a, rank_b, code)
+    
+    return( rows )
+
+def decode( rows ):
+    return( [(TYPES[t], int(a), int(b), EXTRAS[e]) for (t, a, b, e) in rows] )
+
+def select( rows, type="ALL" ):
+    types = SELECTIONS.get( type, None )
+    if( types is None ):
+        show( "FATAL", "Wrong interaction type '%s' expected: 'ALL', 'PAIR', 'PAIR_2D', 'PAIR_3D' or 'STACK'" %type )
+    
+    if( type == "ALL" ):
+        return( rows )
+    
+    return( rows[np.isin( rows[:, 0], [TYPE_CODES[t] for t in types] )] )
+
+#
+# packed keys: rank_a, rank_b, then the type and extra codes, so that the keys
+# sort as the interactions by residue
+#
+RANK_BITS = 27
+CODE_BITS = 8
+EXTRA_BITS = 5
+
+MAX_RANK = (1 << RANK_BITS) - 1
+CODE_MASK = (1 << CODE_BITS) - 1
+
+def pack( rows ):
+    rows = np.asarray( rows, dtype=np.int64 ).reshape( (-1, 4) )
+    if( (len(rows) > 0) and (rows[:, 1:3].max() > MAX_RANK) ):
+        show( "FATAL", "Residue rank larger than %d in the interactions" %MAX_RANK )
+    
+    codes = (rows[:, 0] << EXTRA_BITS) | rows[:, 3]
+    return( (rows[:, 1] << (RANK_BITS + CODE_BITS)) | (rows[:, 2] << CODE_BITS) | codes )
+
+def unpack( keys ):
+    keys = np.asarray( keys, dtype=np.int64 )
+    codes = keys & CODE_MASK
+    
+    rows = np.stack( (codes >> EXTRA_BITS, keys >> (RANK_BITS + CODE_BITS), (keys >> CODE_BITS) & MAX_RANK, codes & ((1 << EXTRA_BITS) - 1)), axis=1 )
+    return( rows.astype( np.int32 ) )
+
+# True for the packed keys of the interactions of 'type' (see select)
+def key_mask( keys, type="ALL" ):
+    types = SELECTIONS.get( type, None )
+    if( types is None ):
+        show( "FATAL", "Wrong interaction type '%s' expected: 'ALL', 'PAIR', 'PAIR_2D', 'PAIR_3D' or 'STACK'" %type )
+    
+    return( np.isin( (keys & CODE_MASK) >> EXTRA_BITS, [TYPE_CODES[t] for t in types] ) )
+
+def select_keys( keys, type="ALL" ):
+    if( type == "ALL" ):
+        return( keys )
+    
+    return( keys[key_mask( keys, type )] )
+
+# sorted packed keys of the interactions of 'type' (see select) in 'rows'
+def sorted_keys( rows, type="ALL" ):
+    return( np.sort( pack( select( rows, type ) ) ) )
+
+def contains( keys, values ):
+    # True for the 'values' found in the sorted 'keys'
+    if( len(keys) == 0 ):
+        return( np.zeros( len(values), dtype=bool ) )
+    
+    pos = np.minimum( np.searchsorted( keys, values ), len(keys) - 1 )
+    return( keys[pos] == values )
+
+#
+# (TP, FP, FN) of the sorted keys of a model against the sorted keys of the
+# native; as with lists, repeated interactions count each time
+#
+def confusion( src_keys, trg_keys ):
+    TP = int(contains( trg_keys, src_keys ).sum())
+    FP = int((~contains( src_keys, trg_keys )).sum())
+    return( TP, FP, len(src_keys) - TP )
+
+#
+# the sorted keys of several models in one array: returns the keys, the
+# model of each key and True for the first occurrence of a key in its model
+#
+def concat_keys( keys_list ):
+    sizes = np.array( [len(keys) for keys in keys_list], dtype=np.int64 )
+    model = np.repeat( np.arange( len(keys_list) ), sizes )
+    keys = np.concatenate( list( keys_list ) + [np.zeros( 0, dtype=np.int64 )] )
+    
+    first = np.ones( len(keys), dtype=bool )
+    first[1:] = (keys[1:] != keys[:-1]) | (model[1:] != model[:-1])
+    return( keys, model, first )
+
+#
+# same as confusion() for several models at once: returns the TP, FP and FN
+# arrays, one value per model in 'trg_keys_list'
+#
+def batch_confusion( src_keys, trg_keys_list ):
+    n = len(trg_keys_list)
+    (keys, model, first) = concat_keys( trg_keys_list )
+    
+    found = contains( src_keys, keys )
+    FP = np.bincount( model[~found], minlength=n )
+    
+    # each native interaction found in a model counts as many times as it is
+    # in the native: first occurrences in the models, weighted by the native
+    # multiplicities
+    (unique, counts) = np.unique( src_keys, return_counts=True )
+    hit = first & found
+    TP = np.bincount( model[hit], weights=counts[np.searchsorted( unique, keys[hit] )], minlength=n ).astype( np.int64 )
+    
+    return( TP, FP, len(src_keys) - TP )
+
+# INF from the confusion counts, -1 when undefined; works on arrays too
+def inf( TP, FP, FN ):
+    (TP, FP, FN) = (np.asarray( TP, dtype=np.float64 ), np.asarray( FP, dtype=np.float64 ), np.asarray( FN, dtype=np.float64 ))
+    
+    with np.errstate( divide="ignore", invalid="ignore" ):
+        value = np.sqrt( (TP / (TP + FP)) * (TP / (TP + FN)) )
+    value = np.where( (TP == 0) & ((FP == 0) | (FN == 0)), -1.0, value )
+    
+    return( float(value) if value.ndim == 0 else value )
@@ -0,0 +1,148 @@
+#  local.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  local RMSD: the RMSD of the matched atoms of every window of k consecutive
+#  residues of the index, each window with its own superposition. The moments
+#  a superposition needs (atom count, coordinate sums, sum of squares and the
+#  3x3 sums of products) are summed per residue and accumulated once, so the
+#  moments of any window are the difference of two prefix sums; the RMSDs of
+#  all the windows then come from one batch of 3x3 SVDs, whatever k.
+#
+#  With a and b the centered coordinates of the window and H = sum(b a^T),
+#  the fitted squared deviations sum to sum(|a|^2 + |b|^2) - 2 (s1 + s2 + d s3)
+#  (s the singular values of H, d the sign of det(H), as the fit of
+#  arrays.superimpose avoids reflections).
+
+import numpy as np
+
+from .msgs import *
+
+# columns of the moments: count, sum(a), sum(b), sum(|a|^2 + |b|^2), sum(b a^T)
+N_MOMENTS = 17
+
+# fewer matched atoms than this do not define a window superposition
+MIN_ATOMS = 3
+
+#
+# moments of the matched atoms ('ranks': the rank of each one) summed by
+# residue rank: (n_ranks, N_MOMENTS). The coordinates are centered on the
+# whole structures, for the precision of the sums; the fits of the moments
+# are the same
+#
+def rank_sums( fixed, moving, ranks, n_ranks ):
+    a = fixed - fixed.mean( axis=0 )
+    b = moving - moving.mean( axis=0 )
+
+    values = np.empty( (len(a), N_MOMENTS) )
+    values[:, 0] = 1.0
+    values[:, 1:4] = a
+    values[:, 4:7] = b
+    values[:, 7] = (a * a).sum( axis=1 ) + (b * b).sum( axis=1 )
+    values[:, 8:17] = (b[:, :, None] * a[:, None, :]).reshape( -1, 9 )
+
+    sums = np.empty( (n_ranks, N_MOMENTS) )
+    for column in range( N_MOMENTS ):
+        sums[:, column] = np.bincount( ranks, weights=values[:, column], minlength=n_ranks )
+    return( sums )
+
+#
+# prefix sums of rank_sums(): (n_ranks + 1, N_MOMENTS), the moments of the
+# ranks [i, j) being prefix[j] - prefix[i]
+#
+def rank_moments( fixed, moving, ranks, n_ranks ):
+    prefix = np.zeros( (n_ranks + 1, N_MOMENTS) )
+    np.cumsum( rank_sums( fixed, moving, ranks, n_ranks ), axis=0, out=prefix[1:] )
+    return( prefix )
+
+#
+# the atom counts, centroids, centered sums of squares and centered H of
+# (m, N_MOMENTS) moments
+#
+def centered( moments ):
+    n = np.rint( moments[:, 0] )
+    count = np.maximum( n, 1.0 )
+
+    mean_a = moments[:, 1:4] / count[:, None]
+    mean_b = moments[:, 4:7] / count[:, None]
+    sq = moments[:, 7] - n * ((mean_a * mean_a).sum( axis=1 ) + (mean_b * mean_b).sum( axis=1 ))
+    h = moments[:, 8:17].reshape( -1, 3, 3 ) - n[:, None, None] * mean_b[:, :, None] * mean_a[:, None, :]
+    return( n, mean_a, mean_b, sq, h )
+
+#
+# rotations of the fits of (m, N_MOMENTS) moments, in one batch: the fitted
+# coordinates of a moving point x are dot(x - mean_b, rot) + mean_a, as with
+# arrays.superimpose. Returns (rot, mean_a, mean_b, n)
+#
+def moment_fits( moments ):
+    (n, mean_a, mean_b, sq, h) = centered( moments )
+
+    (u, s, vt) = np.linalg.svd( h )
+    # avoid reflections
+    flip = np.linalg.det( u ) * np.linalg.det( vt ) < 0
+    vt[flip, 2] = -vt[flip, 2]
+    return( np.matmul( u, vt ), mean_a, mean_b, n )
+
+#
+# RMSD of every window of 'k' consecutive ranks, from the prefix sums of
+# rank_moments(): (n_ranks - k + 1,), the window i covering the ranks
+# [i, i + k); nan for the windows with fewer than MIN_ATOMS atoms
+#
+def window_rmsds( prefix, k ):
+    if( k < 1 ):
+        show( "FATAL", "Invalid local RMSD window size %s, expected at least 1 residue" %k )
+
+    if( k > len(prefix) - 1 ):
+        return( np.zeros( 0 ) )
+
+    (n, mean_a, mean_b, sq, h) = centered( prefix[k:] - prefix[:-k] )
+    count = np.maximum( n, 1.0 )
+
+    s = np.linalg.svd( h, compute_uv=False )
+    sign = np.where( np.linalg.det( h ) < 0, -1.0, 1.0 )
+
+    msd = np.maximum( sq - 2.0 * (s[:, 0] + s[:, 1] + sign * s[:, 2]), 0.0 ) / count
+    return( np.where( n >= MIN_ATOMS, np.sqrt( msd ), np.nan ) )
+
+#
+# residue profile of the window RMSDs of size 'k': for each of the 'n_ranks'
+# residues the mean RMSD of the windows covering it, nan when none has one
+#
+def window_profile( rmsds, k, n_ranks ):
+    valid = ~np.isnan( rmsds )
+
+    def covering( values ):
+        # sum over the windows [r - k + 1, r] of each rank r
+        prefix = np.concatenate( ([0.0], np.cumsum( values )) )
+        ends = np.minimum( np.arange( n_ranks ) + 1, len(values) )
+        starts = np.clip( np.arange( n_ranks ) - k + 1, 0, len(values) )
+        return( prefix[ends] - prefix[np.minimum( starts, ends )] )
+
+    total = covering( np.where( valid, rmsds, 0.0 ) )
+    count = covering( valid.astype( float ) )
+    with np.errstate( invalid="ignore", divide="ignore" ):
+        return( np.where( count > 0, total / count, np.nan ) )
+
+#
+# residue profiles of the local RMSD for each window size of 'windows', from
+# the matched atoms of a native ('fixed') and a model ('moving'): a dict
+# k -> (n_ranks,) profile
+#
+def local_rmsd_profiles( fixed, moving, ranks, n_ranks, windows ):
+    prefix = rank_moments( fixed, moving, ranks, n_ranks )
+    return( dict( [(k, window_profile( window_rmsds( prefix, k ), k, n_ranks )) for k in windows] ) )
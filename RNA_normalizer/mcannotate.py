@@ -19,12 +19,41 @@
 #  
 #  This script calls MC-Annotate to calculate RNA 3D interactions from RNA structure. 
 #  With the results of MC-Annotate, Interaction network fidelity can be measured. 
-import re
 import os
 
+from .fileio import *
+
 # !!! IMPORTANT, please set the directory of MC-Annotate before using this script.
-BIN_DIR=os.getcwd()
-MCAnnotate_bin='%s/MC-Annotate'%BIN_DIR
+# Both are resolved when a tool is run, not at import time: when left to None
+# the directory comes from $RNA_ASSESSMENT_BIN_DIR or the current directory.
+BIN_DIR=None
+MCAnnotate_bin=None
+
+def bin_dir():
+    if( BIN_DIR is not None ):
+        return BIN_DIR
+    return os.environ.get( "RNA_ASSESSMENT_BIN_DIR", os.getcwd() )
+
+# annotator of the structures: "mcannotate" (MC-Annotate, reusing the .mcout
+# files) or "geometric" (in-process, see annotate.py); when left to None it
+# comes from $RNA_ASSESSMENT_ANNOTATOR, MC-Annotate by default
+ANNOTATOR=None
+ANNOTATORS=("mcannotate", "geometric")
+
+def annotator():
+    name = ANNOTATOR if ANNOTATOR is not None else os.environ.get( "RNA_ASSESSMENT_ANNOTATOR", "mcannotate" )
+    if( name not in ANNOTATORS ):
+        show( "FATAL", "Unknown annotator '%s', expected one of: %s" %(name, ", ".join( ANNOTATORS )) )
+    return name
+
+def mcannotate_bin():
+    if( MCAnnotate_bin is not None ):
+        return MCAnnotate_bin
+    return '%s/MC-Annotate' %bin_dir()
+
+# the annotation file of 'pdb_file' in 'mc_dir' ('x.pdb.gz' is annotated as 'x.pdb.mcout')
+def mcout_file( pdb_file, mc_dir ):
+    return( "%s/%s.mcout" %(mc_dir, strip_compression( os.path.basename(pdb_file) )) )
 
 class MCAnnotate:
     def __init__(self):
@@ -34,127 +63,202 @@ class MCAnnotate:
     
     def load(self, pdb_file, mc_dir):
         # defines the annotation file
-        self.mc_file = "%s/%s.mcout" %(mc_dir, os.path.basename(pdb_file))
+        mc_file = mcout_file( pdb_file, mc_dir )
+        
+        # check if the annotation file exists, possibly compressed
+        self.mc_file = find_input( mc_file )
         
-        # check if the annotation file exists
-        if not os.path.isfile( self.mc_file ):
+        if self.mc_file is None:
             # create a new annotation file
-            cmd = "%s %s > %s" %(MCAnnotate_bin, pdb_file, self.mc_file)
-            os.system( cmd )
+            self.mc_file = mc_file
+            self.run( pdb_file, mc_file )
         
         # parse the annotation file
         self.parse()
     
-    def parse(self):
-        STATE_OUT = 0
-        STATE_RESIDUE = 1
-        STATE_PAIR = 2
-        STATE_STACK = 3
-        
-        pattern_pair = "^([A-Z]|\'[0-9]\'|)(\d+)-([A-Z]|\'[0-9]\'|)(\d+) : (\w+)-(\w+) ([\w\']+)/([\w\']+)(?:.*)pairing( (parallel|antiparallel) (cis|trans))"
-        pattern_stack = "^([A-Z]|\'[0-9]\'|)(\d+)-([A-Z]|\'[0-9]\'|)(\d+) :.*(inward|upward|downward|outward).*"
-              
-        # opens and parses the annotation file
-        f = open( self.mc_file, "r" )
+    def run(self, pdb_file, mc_file):
+        tmp_file = None
+        
+        # MC-Annotate only reads uncompressed files
+        if( compression( pdb_file ) is not None ):
+            import shutil
+            import tempfile
             
-        model_count = 0
-        state = STATE_OUT 
-        for line in f:
-            line = line.strip()
-    
-            # for now we only care about the first model
-            if( line.startswith( "Residue conformations" ) ):
-                if( model_count == 0 ):
-                    state = STATE_RESIDUE
-                    model_count += 1
-                    continue
-                else:
-                    break
+            (fd, tmp_file) = tempfile.mkstemp( suffix=".pdb" )
+            src = open_binary( pdb_file )
+            with os.fdopen( fd, "wb" ) as dst:
+                shutil.copyfileobj( src, dst )
+            src.close()
+            pdb_file = tmp_file
+        
+        try:
+            cmd = "%s %s > %s" %(mcannotate_bin(), pdb_file, mc_file)
+            os.system( cmd )
+        finally:
+            if( tmp_file is not None ):
+                os.remove( tmp_file )
+    
+    # annotates a PDB held in memory through a temporary directory
+    def load_text(self, pdb_txt):
+        import shutil
+        import tempfile
+        
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            pdb_file = os.path.join( tmp_dir, "model.pdb" )
+            open( pdb_file, "w" ).write( pdb_txt )
             
-            if( line.startswith( "Base-pairs" ) ):
-                state = STATE_PAIR
-                continue
+            self.mc_file = "%s.mcout" %pdb_file
+            self.run( pdb_file, self.mc_file )
+            self.parse()
+        finally:
+            shutil.rmtree( tmp_dir )
     
-            if( line.startswith( "Adjacent stackings" ) or line.startswith( "Non-Adjacent stackings" ) ):
-                state = STATE_STACK
-                continue
+    def parse(self):
+        # opens and parses the annotation file
+        lines = iter_lines( self.mc_file )
+        try:
+            self.parse_lines( lines )
+        finally:
+            lines.close()
     
-            if( line.endswith( "----------" ) ):
-                state = STATE_OUT
-                continue
-            
-            interaction = None
-            
-            if( state == STATE_RESIDUE ):
-                data = line.split()
-                
-                if( len(data) == 5 ):
-                    self.residues.append( (data[0][0], data[0][1:], data[2]) )
-            
-            if( state == STATE_PAIR ):
-                match = re.match( pattern_pair, line )
-                
-                if( match != None ):
-                    g = match.groups()
-                    interaction = self.convert_pair( g )
-            
-            if( state == STATE_STACK ):
-                match = re.match( pattern_stack, line )
-                
-                if( match != None ):
-                    g = match.groups()
-                    interaction = self.convert_stack( g )
-    
-            if( interaction != None ):
-                self.interactions.append( interaction )
-            
-        f.close()
+    def parse_lines(self, lines):
+        # for now we only care about the first model
+        model = next( iter_annotations( lines ), None )
+        if( model is not None ):
+            self.residues.extend( model[0] )
+            self.interactions.extend( model[1] )
     
     def convert_pair( self, match ):
-        int_a = match[6][0].upper()
-        int_b = match[7][0].upper()
+        return( convert_pair( match ) )
+    
+    def convert_stack( self, match ):
+        return( convert_stack( match ) )
+
+#
+# parsing of the MC-Annotate output: the text is cut into sections at the
+# header lines (a title and a dashed rule) and the pairs and stacks of a
+# section are found by one scan of its compiled pattern (MULTILINE: the
+# pattern is still matched at the start of each line, and '.' stops at its
+# end). The rules are searched first, as literals, then their titles. The
+# patterns are compiled on the first parse, not when the package is imported
+#
+PATTERN_RULE = r"----------[^\S\n]*$"
+PATTERN_PAIR = r"^[^\S\n]*([A-Z]|\'[0-9]\'|)(\d+)-([A-Z]|\'[0-9]\'|)(\d+) : (\w+)-(\w+) ([\w\']+)/([\w\']+)(?:.*)pairing( (parallel|antiparallel) (cis|trans))"
+PATTERN_STACK = r"^[^\S\n]*([A-Z]|\'[0-9]\'|)(\d+)-([A-Z]|\'[0-9]\'|)(\d+) :.*(inward|upward|downward|outward)"
+_patterns = None
+
+# the compiled (rule, pair, stack) patterns
+def patterns():
+    global _patterns
+    import re
+    
+    if( _patterns is None ):
+        _patterns = tuple( [re.compile( pattern, re.M ) for pattern in (PATTERN_RULE, PATTERN_PAIR, PATTERN_STACK)] )
+    return( _patterns )
+
+SECTION_OUT = 0
+SECTION_RESIDUE = 1
+SECTION_PAIR = 2
+SECTION_STACK = 3
+
+SECTIONS = (
+    ("Residue conformations", SECTION_RESIDUE),
+    ("Base-pairs", SECTION_PAIR),
+    ("Adjacent stackings", SECTION_STACK),
+    ("Non-Adjacent stackings", SECTION_STACK),
+)
+
+def section_type( title ):
+    for (prefix, section) in SECTIONS:
+        if( title.startswith( prefix ) ):
+            return( section )
+    return( SECTION_OUT )
+
+#
+# yields the (residues, interactions) of each model of an MC-Annotate output;
+# a model starts at its "Residue conformations" section
+#
+def iter_annotations( lines ):
+    (pattern_rule, pattern_pair, pattern_stack) = patterns()
+    text = "".join( lines )
+    rules = list( pattern_rule.finditer( text ) )
+    # start of each header line, the end of the section before it
+    starts = [text.rfind( "\n", 0, rule.start() ) + 1 for rule in rules] + [len(text)]
+    
+    residues = []
+    interactions = []
+    started = False
+    
+    for (k, rule) in enumerate( rules ):
+        section = section_type( text[starts[k]:rule.start()].strip() )
+        block = text[rule.end():starts[k + 1]]
         
-        result = None
+        if( section == SECTION_RESIDUE ):
+            if( started ):
+                yield( (residues, interactions) )
+                residues = []
+                interactions = []
+            started = True
+            residues.extend( [(data[0][0], data[0][1:], data[2]) for data in map( str.split, block.split( "\n" ) ) if len(data) == 5] )
         
-        if( (int_a in ["W", "H", "S"]) and (int_b in ["W", "H", "S"]) ):
-            chain_a = match[0].replace( "'", "" )
-            pos_a = int(match[1])
-            nt_a = match[4]
-            
-            chain_b = match[2].replace( "'", "" )
-            pos_b = int(match[3])
-            nt_b = match[5]
-            
-            int_type = "%s%s" %(int_a, int_b)
-            int_orientation = match[10].lower()
-            
-            # define the type of pair
-            pair_name_aux = "%s%s%s" %(int_orientation, int_a, int_b)
-            
-            if( pair_name_aux == "cisWW" ):
-                pair_name = "PAIR_2D"
-            else:
-                pair_name = "PAIR_3D"
-            
-            
-            # check if the smallest 'pos' is always the first 
-            if( ((chain_a == chain_b) and (pos_a < pos_b)) or (chain_a < chain_b) ):
-                result = (pair_name, chain_a, pos_a, nt_a, chain_b, pos_b, nt_b, int_type, int_orientation, "")
-            else:
-                result = (pair_name, chain_b, pos_b, nt_b, chain_a, pos_a, nt_a, int_type, int_orientation, "")
+        elif( section == SECTION_PAIR ):
+            for groups in pattern_pair.findall( block ):
+                interaction = convert_pair( groups )
+                if( interaction is not None ):
+                    interactions.append( interaction )
         
-        return( result )
+        elif( section == SECTION_STACK ):
+            interactions.extend( [convert_stack( groups ) for groups in pattern_stack.findall( block )] )
     
-    def convert_stack( self, match ):
+    if( started or (len(interactions) > 0) ):
+        yield( (residues, interactions) )
+
+def convert_pair( match ):
+    int_a = match[6][0].upper()
+    int_b = match[7][0].upper()
+    
+    result = None
+    
+    if( (int_a in ["W", "H", "S"]) and (int_b in ["W", "H", "S"]) ):
         chain_a = match[0].replace( "'", "" )
         pos_a = int(match[1])
-
+        nt_a = match[4]
+        
         chain_b = match[2].replace( "'", "" )
         pos_b = int(match[3])
+        nt_b = match[5]
         
-        int_type = match[4]
-            
-        return( "STACK", chain_a, pos_a, "", chain_b, pos_b, "", int_type, "", "" )
+        int_type = "%s%s" %(int_a, int_b)
+        int_orientation = match[10].lower()
+        
+        # define the type of pair
+        pair_name_aux = "%s%s%s" %(int_orientation, int_a, int_b)
+        
+        if( pair_name_aux == "cisWW" ):
+            pair_name = "PAIR_2D"
+        else:
+            pair_name = "PAIR_3D"
+        
+        
+        # check if the smallest 'pos' is always the first 
+        if( ((chain_a == chain_b) and (pos_a < pos_b)) or (chain_a < chain_b) ):
+            result = (pair_name, chain_a, pos_a, nt_a, chain_b, pos_b, nt_b, int_type, int_orientation, "")
+        else:
+            result = (pair_name, chain_b, pos_b, nt_b, chain_a, pos_a, nt_a, int_type, int_orientation, "")
+    
+    return( result )
+
+def convert_stack( match ):
+    chain_a = match[0].replace( "'", "" )
+    pos_a = int(match[1])
+
+    chain_b = match[2].replace( "'", "" )
+    pos_b = int(match[3])
+    
+    int_type = match[4]
+        
+    return( "STACK", chain_a, pos_a, "", chain_b, pos_b, "", int_type, "", "" )
     
 
 if __name__ == '__main__':
@@ -0,0 +1,272 @@
+#  mmcif.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  streaming reader for the atom_site loop of mmCIF files, for structures that
+#  do not fit the PDB format (multi-character chains, more than 99999 atoms).
+#  Only the columns of the loop are kept while reading, the atoms go straight
+#  into the AtomArrays columns used by PDBStruct.
+
+import array
+import re
+
+import numpy as np
+
+from . import interactions as inter
+from .arrays import AtomArrays
+from .fileio import *
+from .msgs import *
+
+CIF_SUFFIXES = (".cif", ".mmcif")
+
+# a quoted value only ends at a quote followed by a blank
+TOKEN = re.compile( r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""" )
+
+# (preferred, fallback) columns of each field
+COLUMNS = {
+    "group": ("group_PDB", None),
+    "model": ("pdbx_PDB_model_num", None),
+    "chain": ("auth_asym_id", "label_asym_id"),
+    "pos": ("auth_seq_id", "label_seq_id"),
+    "icode": ("pdbx_PDB_ins_code", None),
+    "res_name": ("auth_comp_id", "label_comp_id"),
+    "name": ("auth_atom_id", "label_atom_id"),
+    "element": ("type_symbol", None),
+    "x": ("Cartn_x", None),
+    "y": ("Cartn_y", None),
+    "z": ("Cartn_z", None),
+    "occupancy": ("occupancy", None),
+    "bfactor": ("B_iso_or_equiv", None),
+}
+
+REQUIRED = ("chain", "pos", "res_name", "name", "x", "y", "z")
+
+def is_cif( path ):
+    return( strip_compression( path ).lower().endswith( CIF_SUFFIXES ) )
+
+def tokenize( line ):
+    if( ("'" not in line) and ('"' not in line) ):
+        return( line.split() )
+
+    return( [m.group(1) if m.group(1) is not None else (m.group(2) if m.group(2) is not None else m.group(3)) for m in TOKEN.finditer( line )] )
+
+#
+# yields the column names and then the rows (lists of values) of the
+# atom_site loop; reading stops at the end of the loop
+#
+def iter_atom_site( lines ):
+    columns = None
+    rows = False
+    tokens = []
+    text = None
+
+    for line in lines:
+        # multi-line text values, between two lines starting with ';'
+        if( text is not None ):
+            if( line.startswith( ";" ) ):
+                tokens.append( "".join( text ).rstrip( "\n" ) )
+                text = None
+                line = line[1:]
+            else:
+                text.append( line )
+                continue
+        elif( rows and line.startswith( ";" ) ):
+            text = [line[1:]]
+            continue
+
+        stripped = line.strip()
+
+        if( (stripped == "") or stripped.startswith( "#" ) ):
+            continue
+
+        if( columns is None ):
+            if( stripped == "loop_" ):
+                columns = []
+            continue
+
+        if( not rows ):
+            if( stripped.startswith( "_atom_site." ) ):
+                columns.append( stripped[len("_atom_site."):] )
+                continue
+            elif( len(columns) == 0 ):
+                # not the atom_site loop, wait for the next one
+                columns = [] if stripped == "loop_" else None
+                continue
+
+            rows = True
+            yield( columns )
+
+        if( stripped.startswith( ("_", "loop_", "data_") ) ):
+            break
+
+        tokens.extend( tokenize( stripped ) )
+        while( len(tokens) >= len(columns) ):
+            yield( tokens[:len(columns)] )
+            tokens = tokens[len(columns):]
+
+#
+# reads the first model of the atom_site loop of 'cif_file'; names are checked
+# with the residues.list/atoms.list rules of 'normalizer' (a PDBNormalizer)
+# when given. Returns the AtomArrays (residues without ranks nor interactions)
+# or None
+#
+def read_atom_site( cif_file, normalizer=None ):
+    if( normalizer is not None ):
+        normalizer.reset( cif_file )
+
+    lines = iter_lines( cif_file )
+    try:
+        rows = iter_atom_site( lines )
+
+        columns = next( rows, None )
+        if( columns is None ):
+            show( "ERROR", "No atom_site loop found in '%s'" %cif_file )
+            return( None )
+
+        col = {}
+        for (field, (name, fallback)) in COLUMNS.items():
+            if( name in columns ):
+                col[field] = columns.index( name )
+            elif( fallback in columns ):
+                col[field] = columns.index( fallback )
+
+        missing = [COLUMNS[field][0] for field in REQUIRED if field not in col]
+        if( len(missing) > 0 ):
+            show( "ERROR", "Missing atom_site columns in '%s': %s" %(cif_file, ", ".join( missing )) )
+            return( None )
+
+        coords = array.array( "d" )
+        res_ndx = array.array( "i" )
+        names = []
+        elements = []
+        bfactors = array.array( "f" )
+        occupancies = array.array( "f" )
+
+        res_chain = []
+        res_pos = []
+        res_icode = []
+        res_name = []
+        res_hetero = []
+
+        # atom position of each name in the current residue, to keep one
+        # alternate location
+        seen = {}
+
+        model = None
+        res_id = None
+        # rows without a residue number ('.', '?'), as (count, first row)
+        unnumbered = [0, None]
+
+        for (row_count, row) in enumerate( rows ):
+            if( "model" in col ):
+                if( model is None ):
+                    model = row[col["model"]]
+                elif( row[col["model"]] != model ):
+                    show( "WARNING", "More than one model found. Only the first will be used!" )
+                    break
+
+            if( ("group" in col) and (row[col["group"]] not in ("ATOM", "HETATM")) ):
+                continue
+
+            try:
+                pos = int( row[col["pos"]] )
+            except ValueError:
+                unnumbered[0] += 1
+                if( unnumbered[1] is None ):
+                    unnumbered[1] = row_count + 1
+                continue
+
+            resName = row[col["res_name"]]
+            name = row[col["name"]]
+
+            if( normalizer is not None ):
+                normalizer._row_count = row_count + 1
+                norm = normalizer.normalize_names( resName, name )
+                if( norm is None ):
+                    continue
+                (resName, name) = norm
+
+            chain = row[col["chain"]]
+            icode = row[col["icode"]] if "icode" in col else "?"
+            icode = " " if icode in (".", "?") else icode
+
+            if( (chain, pos, icode) != res_id ):
+                res_id = (chain, pos, icode)
+                res_chain.append( chain )
+                res_pos.append( pos )
+                res_icode.append( icode )
+                res_name.append( resName )
+                res_hetero.append( ("group" in col) and (row[col["group"]] == "HETATM") )
+                seen = {}
+
+            occupancy = row[col["occupancy"]] if "occupancy" in col else "?"
+            occupancy = 1.0 if occupancy in (".", "?") else float( occupancy )
+
+            xyz = (float( row[col["x"]] ), float( row[col["y"]] ), float( row[col["z"]] ))
+
+            # alternate locations: the most occupied wins, as with Bio.PDB
+            ndx = seen.get( name, None )
+            if( ndx is not None ):
+                if( occupancy > occupancies[ndx] ):
+                    coords[3 * ndx:3 * ndx + 3] = array.array( "d", xyz )
+                    occupancies[ndx] = occupancy
+                continue
+            seen[name] = len(names)
+
+            element = row[col["element"]] if "element" in col else "?"
+            element = name[0] if element in (".", "?") else element
+
+            bfactor = row[col["bfactor"]] if "bfactor" in col else "?"
+            bfactor = 0.0 if bfactor in (".", "?") else float( bfactor )
+
+            coords.extend( xyz )
+            res_ndx.append( len(res_chain) - 1 )
+            names.append( name )
+            elements.append( element )
+            bfactors.append( bfactor )
+            occupancies.append( occupancy )
+    finally:
+        lines.close()
+
+    if( unnumbered[0] > 0 ):
+        show( "ERROR", "%d atom_site rows without a residue number skipped in '%s' (first: row %d)" %(unnumbered[0], cif_file, unnumbered[1]) )
+
+    if( normalizer is not None ):
+        normalizer._diag.emit()
+        if( not normalizer._ok ):
+            return( None )
+
+    if( len(names) == 0 ):
+        show( "ERROR", "No atoms found in '%s'" %cif_file )
+        return( None )
+
+    return( AtomArrays(
+        coords = np.frombuffer( coords, dtype=np.float64 ).reshape( (-1, 3) ),
+        res_ndx = np.frombuffer( res_ndx, dtype=np.int32 ),
+        names = np.array( names, dtype="U4" ),
+        elements = np.array( elements, dtype="U2" ),
+        bfactors = np.frombuffer( bfactors, dtype=np.float32 ),
+        occupancies = np.frombuffer( occupancies, dtype=np.float32 ),
+        res_chain = np.array( res_chain, dtype=str ),
+        res_pos = np.array( res_pos, dtype=np.int32 ),
+        res_icode = np.array( res_icode, dtype="U1" ),
+        res_name = np.array( res_name, dtype=str ),
+        res_hetero = np.array( res_hetero, dtype=bool ),
+        res_rank = np.full( len(res_chain), -1, dtype=np.int32 ),
+        interactions = inter.encode( [] ),
+    ) )
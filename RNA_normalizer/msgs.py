@@ -21,6 +21,27 @@
 
 import sys
 
+# verbosity levels for the diagnostics
+LEVEL_QUIET = 0     # nothing is written
+LEVEL_SUMMARY = 1   # one line per (code, prefix) when the structure is done
+LEVEL_VERBOSE = 2   # every event as it happens, plus the summary
+
+_level = LEVEL_SUMMARY
+
+class FatalError(Exception):
+    pass
+
+def set_level( level ):
+    global _level
+    
+    if( level not in (LEVEL_QUIET, LEVEL_SUMMARY, LEVEL_VERBOSE) ):
+        show( "FATAL", "Wrong diagnostics level '%s'" %level )
+    
+    _level = level
+
+def get_level():
+    return _level
+
 def show( prefix, message, new_line=True, back=False ):
     new_line_txt = new_line and "\n" or ""
     back_txt = back and "\b" * 50 or ""
@@ -31,5 +52,66 @@ def show( prefix, message, new_line=True, back=False ):
         sys.stderr.flush()
     
     if( prefix == "FATAL" ):
-        sys.stderr.write( "Abrupt termination!" )
-        quit()
+        sys.stderr.write( "Abrupt termination!\n" )
+        raise FatalError( message )
+
+#
+# collects the diagnostics of one structure, counting repeated events by
+# code instead of writing each of them to stderr
+#
+class Diagnostics:
+    def __init__(self, name=""):
+        self.name = name
+        self.counts = {}
+        self.first = {}
+        self.order = []
+    
+    def add( self, prefix, code, message=None ):
+        if( message is None ):
+            message = code
+        
+        key = (prefix, code)
+        
+        if( key in self.counts ):
+            self.counts[key] += 1
+        else:
+            self.counts[key] = 1
+            self.first[key] = message
+            self.order.append( key )
+        
+        if( _level >= LEVEL_VERBOSE ):
+            show( prefix, message )
+    
+    def count( self, prefix=None ):
+        return sum( [n for ((p, c), n) in self.counts.items() if (prefix is None) or (p == prefix)] )
+    
+    def summary( self ):
+        rows = []
+        for key in self.order:
+            rows.append( (key[0], key[1], self.counts[key], self.first[key]) )
+        
+        return( rows )
+    
+    def emit( self ):
+        if( (_level < LEVEL_SUMMARY) or (len(self.order) == 0) ):
+            return
+        
+        lines = []
+        for (prefix, code, count, first) in self.summary():
+            if( count == 1 ):
+                txt = first
+            else:
+                txt = "%s (x%d, first: %s)" %(code, count, first)
+            
+            if( self.name != "" ):
+                txt = "%s: %s" %(self.name, txt)
+            
+            lines.append( "%-10s >> %s\n" %(prefix[:10], txt) )
+        
+        # a single write per structure
+        sys.stderr.write( "".join( lines ) )
+    
+    def clear( self ):
+        self.counts = {}
+        self.first = {}
+        self.order = []
@@ -0,0 +1,289 @@
+#  pdbwriter.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  ATOM rows written a whole column at a time: every field is formatted for
+#  all the atoms at once into a fixed-width byte buffer (numbers through
+#  integer arithmetic on their digits), instead of formatting each atom in
+#  Python. Used for the fitted structures, the normalized PDBs and fit.py
+
+import numpy as np
+
+from .msgs import *
+
+# (column, width, format) of an ATOM row, in order: 'l'/'r' for text aligned
+# to the left/right, the number of decimals for numbers. Numeric columns
+# given as text (e.g. copied from another PDB) are right aligned as they are;
+# None columns are fixed blanks
+LAYOUT = (
+    ("record", 6, "l"),
+    ("serial", 5, 0),
+    (None, 1, None),
+    ("name", 4, "l"),
+    ("alt", 1, "l"),
+    ("res_name", 3, "r"),
+    (None, 1, None),
+    ("chain", 1, "l"),
+    ("res_pos", 4, 0),
+    ("icode", 1, "l"),
+    (None, 3, None),
+    ("x", 8, 3),
+    ("y", 8, 3),
+    ("z", 8, 3),
+    ("occupancy", 6, 2),
+    ("bfactor", 6, 2),
+    ("gap", None, "l"),
+    ("element", 2, "r"),
+    ("charge", 2, "r"),
+)
+
+# defaults of the optional columns
+DEFAULTS = {
+    "record": "ATOM  ",
+    "alt": " ",
+    "icode": " ",
+    "occupancy": 1.0,
+    "bfactor": 0.0,
+    "gap": " " * 10,
+    "element": "",
+    "charge": "",
+}
+
+SPACE = ord( " " )
+ZERO = ord( "0" )
+
+def pad_names( names ):
+    # atom names start on column 14 unless they take the 4 columns
+    names = np.asarray( names, dtype=str )
+    return( np.where( np.char.str_len( names ) < 4, np.char.add( " ", names ), names ) )
+
+# (n, width) characters of a text column, cut to the width
+def _text( values, width, align ):
+    values = np.asarray( values, dtype=str )
+    n = len(values)
+    k = values.dtype.itemsize // 4
+    
+    out = np.full( (n, width), SPACE, dtype=np.uint8 )
+    if( k == 0 ):
+        return( out )
+    
+    codes = np.ascontiguousarray( values ).view( np.uint32 ).reshape( (n, k) )
+    codes = np.where( codes > 127, ord( "?" ), codes ).astype( np.uint8 )
+    
+    if( align == "l" ):
+        m = min( k, width )
+        out[:, :m] = np.where( codes[:, :m] == 0, SPACE, codes[:, :m] )
+        return( out )
+    
+    # right alignment: the string ends on the last column
+    length = (codes != 0).sum( axis=1 )
+    src = np.arange( width )[None, :] - (width - length)[:, None]
+    valid = (src >= 0) & (src < k)
+    rows = np.broadcast_to( np.arange( n )[:, None], src.shape )
+    out[valid] = codes[rows[valid], src[valid]]
+    return( out )
+
+# (n, width) characters of a number column, as '%<width>.<decimals>f', and
+# the rows whose value (with its sign) does not fit in the width
+def _number( values, width, decimals ):
+    values = np.asarray( values, dtype=np.float64 )
+    n = len(values)
+    
+    out = np.full( (n, width), SPACE, dtype=np.uint8 )
+    rest = np.rint( np.abs( values ) * 10 ** decimals ).astype( np.int64 )
+    
+    col = width - 1
+    for i in range( decimals ):
+        out[:, col] = ZERO + rest % 10
+        rest //= 10
+        col -= 1
+    if( decimals > 0 ):
+        out[:, col] = ord( "." )
+        col -= 1
+    
+    # the units are always written, the other digits while there are any
+    out[:, col] = ZERO + rest % 10
+    rest //= 10
+    sign = np.full( n, col - 1 )
+    col -= 1
+    while( (col >= 0) and rest.any() ):
+        more = rest > 0
+        out[more, col] = ZERO + rest[more] % 10
+        sign[more] = col - 1
+        rest //= 10
+        col -= 1
+    
+    neg = np.signbit( values )
+    fits = np.flatnonzero( neg & (sign >= 0) )
+    out[fits, sign[fits]] = ord( "-" )
+    return( out, (rest > 0) | (neg & (sign < 0)) )
+
+#
+# formats the ATOM rows of the atoms in 'columns' (a dict of arrays or single
+# values by column name, see LAYOUT; 'x', 'y' and 'z' give the number of
+# rows). Returns the text of the rows, with a TER line after the atoms set
+# in the boolean array 'ter'. A number too wide for its column widens its
+# row, as '%f' would (and Bio.PDB.PDBIO did); a chain id of more than one
+# character is FATAL, as for Bio.PDB.PDBIO
+#
+def format_atoms( columns, ter=None ):
+    n = len(columns["x"])
+    
+    blocks = []
+    # (block, values, decimals, rows) of the numbers too wide for their column
+    wide = []
+    for (name, width, fmt) in LAYOUT:
+        if( name is None ):
+            blocks.append( np.full( (n, width), SPACE, dtype=np.uint8 ) )
+            continue
+        
+        values = columns[name] if name in columns else DEFAULTS[name]
+        if( name == "gap" ):
+            width = len(values)
+        
+        values = np.asarray( values )
+        if( values.ndim == 0 ):
+            values = np.full( n, values )
+        
+        # a longer chain id would be cut, and read back as another chain
+        if( (name == "chain") and (n > 0) and (np.char.str_len( values.astype( str ) ).max() > width) ):
+            long_ids = sorted( set( [chain for chain in values.astype( str ).tolist() if len(chain) > width] ) )
+            show( "FATAL", "Chain id '%s' exceeds the PDB format limit of %d character" %(long_ids[0], width) )
+        
+        if( fmt in ("l", "r") ):
+            blocks.append( _text( values, width, fmt ) )
+        elif( values.dtype.kind in "US" ):
+            blocks.append( _text( values, width, "r" ) )
+        else:
+            (block, overflow) = _number( values, width, fmt )
+            if( overflow.any() ):
+                wide.append( (len(blocks), values, fmt, overflow) )
+            blocks.append( block )
+    
+    blocks.append( np.full( (n, 1), ord( "\n" ), dtype=np.uint8 ) )
+    buffer = np.concatenate( blocks, axis=1 )
+    
+    text = buffer.tobytes().decode( "ascii" )
+    if( (ter is None) and (len(wide) == 0) ):
+        return( text )
+    
+    row_width = buffer.shape[1]
+    bounds = np.cumsum( [0] + [block.shape[1] for block in blocks] ).tolist()
+    
+    def wide_row( i ):
+        row = [text[i * row_width + bounds[k]:i * row_width + bounds[k + 1]] for k in range( len(blocks) )]
+        for (k, values, decimals, overflow) in wide:
+            if( overflow[i] ):
+                row[k] = "%*.*f" %(blocks[k].shape[1], decimals, values[i])
+        return( "".join( row ) )
+    
+    rows = set()
+    for (k, values, decimals, overflow) in wide:
+        rows.update( np.flatnonzero( overflow ).tolist() )
+    if( ter is not None ):
+        rows.update( np.flatnonzero( ter ).tolist() )
+    
+    # the rows have a fixed width: the text is cut around the wide rows and
+    # after each row followed by a TER
+    pieces = []
+    start = 0
+    for i in sorted( rows ):
+        pieces.append( text[start * row_width:i * row_width] )
+        pieces.append( wide_row( i ) )
+        if( (ter is not None) and ter[i] ):
+            pieces.append( "TER\n" )
+        start = i + 1
+    pieces.append( text[start * row_width:] )
+    return( "".join( pieces ) )
+
+# True for the last atom of each chain
+def chain_ends( chains ):
+    chains = np.asarray( chains )
+    ends = np.zeros( len(chains), dtype=bool )
+    if( len(chains) > 0 ):
+        ends[:-1] = chains[1:] != chains[:-1]
+        ends[-1] = True
+    return( ends )
+
+# columns of an AtomArrays, with 'coords' in place of its own (e.g. fitted)
+def arrays_columns( arrays, coords=None ):
+    if( coords is None ):
+        coords = arrays.coords
+
+    res_ndx = arrays.res_ndx
+    return( {
+        "record": np.where( arrays.res_hetero[res_ndx], "HETATM", "ATOM  " ),
+        "serial": np.arange( 1, len(coords) + 1 ),
+        "name": pad_names( arrays.names ),
+        "res_name": arrays.res_name[res_ndx],
+        "chain": arrays.res_chain[res_ndx],
+        "res_pos": arrays.res_pos[res_ndx],
+        "icode": arrays.res_icode[res_ndx],
+        "x": coords[:, 0],
+        "y": coords[:, 1],
+        "z": coords[:, 2],
+        "occupancy": arrays.occupancies,
+        "bfactor": arrays.bfactors,
+        "element": arrays.elements,
+    } )
+
+# columns of the atoms of a Bio.PDB entity (structure, model, chain...)
+def entity_columns( entity ):
+    atoms = list( entity.get_atoms() )
+    residues = [atom.get_parent() for atom in atoms]
+    coords = np.array( [atom.get_coord() for atom in atoms], dtype=np.float64 ).reshape( (-1, 3) )
+
+    return( {
+        "record": np.array( ["ATOM  " if res.id[0] == " " else "HETATM" for res in residues], dtype=str ),
+        # renumbered, as Bio.PDB.PDBIO does
+        "serial": np.arange( 1, len(atoms) + 1 ),
+        "name": np.array( [atom.get_fullname() for atom in atoms], dtype=str ),
+        "alt": np.array( [atom.get_altloc() for atom in atoms], dtype=str ),
+        "res_name": np.array( [res.get_resname() for res in residues], dtype=str ),
+        "chain": np.array( [res.get_parent().id for res in residues], dtype=str ),
+        "res_pos": np.array( [res.id[1] for res in residues] ),
+        "icode": np.array( [res.id[2] for res in residues], dtype=str ),
+        "x": coords[:, 0],
+        "y": coords[:, 1],
+        "z": coords[:, 2],
+        "occupancy": np.array( [atom.get_occupancy() or 0.0 for atom in atoms] ),
+        "bfactor": np.array( [atom.get_bfactor() for atom in atoms] ),
+        "element": np.array( [atom.element for atom in atoms], dtype=str ),
+    } )
+
+def write_arrays( arrays, fout, coords=None ):
+    columns = arrays_columns( arrays, coords )
+    
+    with open( fout, "w" ) as f:
+        f.write( format_atoms( columns, chain_ends( columns["chain"] ) ) + "END\n" )
+
+# writes every model of a Bio.PDB structure
+def write_struct( struct, fout ):
+    models = list( struct )
+    
+    with open( fout, "w" ) as f:
+        for model in models:
+            if( len(models) > 1 ):
+                f.write( "MODEL     %4d\n" %(model.serial_num) )
+            
+            columns = entity_columns( model )
+            f.write( format_atoms( columns, chain_ends( columns["chain"] ) ) )
+            
+            if( len(models) > 1 ):
+                f.write( "ENDMDL\n" )
+        f.write( "END\n" )
@@ -0,0 +1,337 @@
+#  pipeline.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  asyncio scheduler of a batch evaluation (rna-assess --pipeline): every
+#  model goes through the stages
+#      normalize -> index -> annotate -> score [-> external]
+#  normalize, index and score run in the process pool of the run, while
+#  annotate runs MC-Annotate and external the MCQ and GDT jars as asynchronous
+#  subprocesses, at most a few runs of each tool at a time (--tool-jobs).
+#  Bounded queues link the stages: when a stage falls behind, those before it
+#  wait, so only a few models are held in memory. As the workers score some
+#  models while the tools run on others, a run takes about as long as its
+#  slowest stage rather than the sum of the stages.
+#
+#    normalize: the archive members go through PDBNormalizer (the model files
+#        are taken as normalized, as by batch.run_job)
+#    index: the residues of the model are read (PDBStruct, without parsing)
+#        and checked against its index and the native sequence
+#    annotate: MC-Annotate, when the interaction metrics are wanted and the
+#        model has no annotations yet; the .mcout of a model file is written
+#        next to it, as MCAnnotate.load does
+#    score: batch.run_job or batch.evaluate_member, with those annotations
+#    external: the MCQ and GDT jars (PDBComparer.mcq/gdt) against the native
+#        of the best solution, with --mcq and --gdt
+
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+from . import batch
+from .batch import TOOLS
+from .fileio import ENCODING, compression, find_input, read_text
+from .msgs import *
+
+# models waiting before a stage, per concurrent run of the stage
+QUEUE_SIZE = 2
+
+# --- worker side ---
+#
+# checks the residues of a model (read without parsing it) against its index
+# and, for a single native, the native sequence; False when the model fails
+#
+def check_model( job, member=None, pdb_txt=None ):
+    from .assess import load_struct, load_text_struct
+
+    name = job.name if member is None else batch.member_name( job, member )
+    natives = batch._job_natives( job )
+    if( natives is None ):
+        return( False )
+
+    try:
+        if( member is None ):
+            model = load_struct( job.model, job.model_index )
+        else:
+            model = load_text_struct( member.name, pdb_txt, member.index_txt, member.mcout_txt )
+    except Exception as e:
+        show( "ERROR", "%s: %s" %(name, e) )
+        return( False )
+
+    if( model is None ):
+        return( False )
+
+    # the alternative natives may rank the model with other indexes: their
+    # sequences are checked when it is scored
+    if( (len(natives) == 1) and (natives[0].raw_sequence() != model.raw_sequence()) ):
+        show( "ERROR", "Result sequence != Solution sequence for '%s'" %name )
+        return( False )
+
+    return( True )
+# ---
+
+# a plain file with the structure of 'path' (uncompressed if needed) or 'text'
+@contextlib.contextmanager
+def _input_file( path=None, text=None ):
+    if( (path is not None) and (compression( path ) is None) ):
+        yield( path )
+        return
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join( tmp_dir, "model.pdb" )
+        with open( fname, "w" ) as fo:
+            fo.write( read_text( path ) if text is None else text )
+        yield( fname )
+    finally:
+        shutil.rmtree( tmp_dir )
+
+class Model:
+    # a batch task (batch.run_job or batch.run_member and its arguments) on
+    # its way through the stages, with its cached results (see batch.TaskCache)
+    def __init__(self, function, args, cached):
+        self.job = args[0]
+        # by name: batch may also run as __main__ (python -m)
+        self.member = args[1] if function.__name__ == "run_member" else None
+        (self.pvalue_param, self.fit_subset, self.metrics) = args[-3:]
+        self.name = self.job.name if self.member is None else batch.member_name( self.job, self.member )
+        self.cached = cached
+        # the normalized text of a member
+        self.pdb_txt = None
+        # set when the model is scored, or has failed
+        self.eval = None
+
+        # every result cached: only the external tools are left
+        if( (cached is not None) and (cached[2] is not None) and (len(cached[2]) == 0) ):
+            self.eval = cached[0]
+            self.eval.ok = True
+
+    def fail(self):
+        from .utils import Eval
+
+        self.eval = Eval( self.job.problem )
+        self.eval.original = self.name
+
+    def done(self):
+        return( (self.eval is not None) and (not self.eval.ok) )
+
+class Stage:
+    def __init__(self, name, run, runs):
+        self.name = name
+        self.run = run
+        self.runs = runs
+        self.queue = asyncio.Queue( QUEUE_SIZE * runs )
+        # models through the stage, and the time they spent there
+        self.count = 0
+        self.seconds = 0.0
+
+#
+# runs the 'models' through the 'stages', in order; 'finished' receives each
+# model once it has gone through all of them, or has failed
+#
+async def run_stages( stages, models, finished ):
+    async def work( k ):
+        stage = stages[k]
+        while( True ):
+            model = await stage.queue.get()
+            if( model is None ):
+                return
+
+            start = time.perf_counter()
+            try:
+                await stage.run( model )
+            except Exception as e:
+                # a broken input must not take the whole run down
+                show( "ERROR", "%s: %s" %(model.name, e) )
+                model.fail()
+            stage.seconds += time.perf_counter() - start
+            stage.count += 1
+
+            if( (k + 1 < len(stages)) and (not model.done()) ):
+                await stages[k + 1].queue.put( model )
+            else:
+                finished( model )
+
+    workers = [[asyncio.ensure_future( work( k ) ) for i in range( stage.runs )] for (k, stage) in enumerate( stages )]
+    try:
+        for model in models:
+            await stages[0].queue.put( model )
+
+        # each stage ends once those before it have, its queue drained
+        for (stage, runs) in zip( stages, workers ):
+            for task in runs:
+                await stage.queue.put( None )
+            await asyncio.gather( *runs )
+    finally:
+        for task in sum( workers, [] ):
+            task.cancel()
+
+class Pipeline:
+    # 'tool_jobs': {tool: concurrent runs} of the TOOLS; 'external': the
+    # batch.EXTERNAL tools run on every model
+    def __init__(self, tool_jobs=None, external=()):
+        self.tool_jobs = dict( tool_jobs or {} )
+        self.external = tuple( external )
+        self._pool = None
+        self._limits = {}
+
+    #
+    # runs the tasks of batch.run_batch, (function, arguments, cached results),
+    # on 'processes' workers with the 'natives' shared; 'completed' receives
+    # the eval of each task and its cached results
+    #
+    def run(self, tasks, natives, processes, lists, completed):
+        processes = max( processes, 1 )
+        models = (Model( function, args, cached ) for (function, args, cached) in tasks)
+        stages = asyncio.run( self._run( models, natives, processes, lists, lambda model: completed( model.eval, model.cached ) ) )
+
+        for stage in stages:
+            show( "INFO", "Stage %s: %d models, %.1f s" %(stage.name, stage.count, stage.seconds) )
+
+    async def _run(self, models, natives, processes, lists, finished):
+        from concurrent.futures import ProcessPoolExecutor
+        from .sharedmem import SharedNatives
+
+        self._limits = dict( [(tool, asyncio.Semaphore( self.tool_jobs.get( tool, processes ) )) for tool in TOOLS] )
+        stages = [Stage( "normalize", self.normalize, processes ),
+                  Stage( "index", self.index, processes ),
+                  # the models without annotations to make pass the tool runs
+                  Stage( "annotate", self.annotate, processes + self.tool_jobs.get( "mcannotate", processes ) ),
+                  Stage( "score", self.score, processes )]
+        if( len(self.external) > 0 ):
+            stages.append( Stage( "external", self.compare, max( [self.tool_jobs.get( tool, processes ) for tool in self.external] ) ) )
+
+        # the workers attach to the natives instead of loading them again
+        with SharedNatives() as shared:
+            for (key, arrays) in natives.items():
+                shared.publish( key, arrays )
+
+            with ProcessPoolExecutor( max_workers=processes, initializer=batch._init_worker, initargs=(shared.handles, lists) ) as pool:
+                self._pool = pool
+                try:
+                    await run_stages( stages, models, finished )
+                finally:
+                    self._pool = None
+
+        return( stages )
+
+    async def _call(self, function, *args):
+        return( await asyncio.get_running_loop().run_in_executor( self._pool, function, *args ) )
+
+    # the output of an external tool, None when it fails
+    async def _tool(self, tool, args):
+        async with self._limits[tool]:
+            try:
+                proc = await asyncio.create_subprocess_exec( *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL )
+            except OSError as e:
+                show( "ERROR", "Command '%s' could not be run: %s" %(args[0], e) )
+                return( None )
+
+            (out, err) = await proc.communicate()
+
+        if( proc.returncode != 0 ):
+            show( "ERROR", "Command '%s' ended with error code '%s'" %(" ".join( args ), proc.returncode) )
+            return( None )
+
+        return( out.decode( ENCODING, "replace" ) )
+
+    async def normalize(self, model):
+        # the model files are normalized already
+        if( model.member is None ):
+            return
+
+        model.pdb_txt = await self._call( batch.normalize_member, model.job, model.member )
+        if( model.pdb_txt is None ):
+            model.fail()
+
+    async def index(self, model):
+        if( model.eval is not None ):
+            return
+
+        if( not await self._call( check_model, model.job, model.member, model.pdb_txt ) ):
+            model.fail()
+
+    def _annotated(self, model):
+        from . import PDBComparer
+        from .mcannotate import annotator
+
+        # the interactions are read only for the INF metrics (and DI_ALL)
+        wanted = PDBComparer.wanted_metrics( model.metrics )
+        return( (model.eval is not None) or (annotator() != "mcannotate") or
+                (len(wanted.intersection( PDBComparer.INF_TYPES )) == 0) )
+
+    async def annotate(self, model):
+        from .mcannotate import mcannotate_bin, mcout_file
+        from .mmcif import is_cif
+
+        if( self._annotated( model ) ):
+            return
+
+        if( model.member is not None ):
+            if( model.member.mcout_txt is not None ):
+                return
+            with _input_file( text=model.pdb_txt ) as pdb_file:
+                mcout_txt = await self._tool( "mcannotate", [mcannotate_bin(), pdb_file] )
+            if( mcout_txt is None ):
+                model.fail()
+                return
+            model.member.mcout_txt = mcout_txt
+            return
+
+        # as MCAnnotate.load: 'x.pdb.gz' is annotated as 'x.pdb.mcout'
+        pdb_file = model.job.model
+        mc_file = mcout_file( pdb_file, os.path.dirname( pdb_file ) )
+        if( is_cif( pdb_file ) or (find_input( mc_file ) is not None) ):
+            return
+
+        with _input_file( pdb_file ) as fname:
+            mcout_txt = await self._tool( "mcannotate", [mcannotate_bin(), fname] )
+        if( mcout_txt is None ):
+            model.fail()
+            return
+
+        with open( mc_file, "w" ) as fo:
+            fo.write( mcout_txt )
+
+    async def score(self, model):
+        if( model.eval is not None ):
+            return
+
+        job = model.job
+        if( model.member is None ):
+            model.eval = await self._call( batch.run_job, job, model.pvalue_param, model.fit_subset, model.metrics )
+        else:
+            model.eval = await self._call( batch.evaluate_member, job, model.member, model.pdb_txt, model.pvalue_param, model.fit_subset, model.metrics )
+
+    async def compare(self, model):
+        from . import PDBComparer
+
+        comparer = PDBComparer()
+        native = model.job.natives[max( model.eval.best_sol_ndx, 0 )][0]
+        model_path = model.job.model if model.member is None else None
+
+        with _input_file( native ) as native_file, _input_file( model_path, model.pdb_txt ) as model_file:
+            # the model first, as for PDBComparer.mcq/gdt
+            commands = [getattr( comparer, "%s_command" %tool )( model_file, native_file ) for tool in self.external]
+            outputs = await asyncio.gather( *[self._tool( tool, args ) for (tool, args) in zip( self.external, commands )] )
+
+        for (tool, out) in zip( self.external, outputs ):
+            setattr( model.eval, tool, getattr( comparer, "%s_value" %tool )( out or "" ) )
@@ -0,0 +1,130 @@
+#  search.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  the k models closest (by RMSD) to a native among many: the models are
+#  visited by increasing lower bound on their RMSD and superimposed only while
+#  that bound does not exceed the k-th best RMSD found so far (kept in a heap).
+#
+#  The bounds use the residue atoms of descriptors.py (C1') present in both
+#  structures, m of them. Under the fit of the n matched atoms, these m atoms
+#  deviate at least as much as under their own best fit, so
+#      n * RMSD^2 >= m * (rg_native - rg_model)^2
+#  and, as |d_native(i,j) - d_model(i,j)| <= e_i + e_j for the deviations e
+#  of any rigid fit,
+#      n * RMSD^2 >= sum_{i<j} (d_native(i,j) - d_model(i,j))^2 / (2 (m - 1))
+#  with n at most the number of atoms of the smallest structure.
+
+import heapq
+
+import numpy as np
+
+from .descriptors import Descriptors, distance_matrix, radius_of_gyration
+
+class NearestModels:
+    def __init__(self, hits, scored, pruned, total):
+        # (rmsd, position) of the nearest models, closest first
+        self.hits = hits
+        # models superimposed, left out by their distance matrix bound, and given
+        self.scored = scored
+        self.pruned = pruned
+        self.total = total
+
+    def __str__(self):
+        return( " ".join( ["%d:%.3f" %(position, rmsd) for (rmsd, position) in self.hits] ) )
+
+def _descriptors( arrays ):
+    return( arrays if isinstance( arrays, Descriptors ) else Descriptors( arrays ) )
+
+def _common_points( src_desc, trg_desc ):
+    # the residue atoms present in both structures
+    (src, trg) = (src_desc.residue_coords(), trg_desc.residue_coords())
+    if( len(src) != len(trg) ):
+        return( None )
+
+    keep = ~(np.isnan( src ).any( axis=1 ) | np.isnan( trg ).any( axis=1 ))
+    return( (src[keep], trg[keep]) )
+
+def _max_atoms( src_arrays, trg_arrays ):
+    return( max( min( int((src_arrays.keys() >= 0).sum()), int((trg_arrays.keys() >= 0).sum()) ), 1 ) )
+
+# the Rg bound of the RMSD of two structures (see above), 0 when undefined
+def rg_bound( src_desc, trg_desc ):
+    points = _common_points( src_desc, trg_desc )
+    if( (points is None) or (len(points[0]) == 0) ):
+        return( 0.0 )
+
+    (src, trg) = points
+    n = _max_atoms( src_desc.arrays, trg_desc.arrays )
+    return( abs( radius_of_gyration( src ) - radius_of_gyration( trg ) ) * np.sqrt( len(src) / float(n) ) )
+
+# the distance matrix bound of the RMSD of two structures (see above), 0 when undefined
+def distance_bound( src_desc, trg_desc ):
+    points = _common_points( src_desc, trg_desc )
+    if( (points is None) or (len(points[0]) < 2) ):
+        return( 0.0 )
+
+    (src, trg) = points
+    m = len(src)
+    n = _max_atoms( src_desc.arrays, trg_desc.arrays )
+    diff = distance_matrix( src ) - distance_matrix( trg )
+    # each pair counted twice in the full matrix
+    return( np.sqrt( (diff * diff).sum() / 2.0 / (2.0 * (m - 1) * n) ) )
+
+#
+# the 'k' models of 'trg_arrays_list' (AtomArrays, or their Descriptors) with
+# the lowest RMSD against 'src_arrays', as PDBComparer.rmsd_arrays() would
+# rank them all (ties by position); 'rmsd' computes the exact RMSD of two
+# AtomArrays, or None. Returns a NearestModels
+#
+def nearest_models( src_arrays, trg_arrays_list, k, rmsd ):
+    src_desc = _descriptors( src_arrays )
+    trg_descs = [_descriptors( arrays ) for arrays in trg_arrays_list]
+    if( k <= 0 ):
+        return( NearestModels( [], 0, 0, len(trg_descs) ) )
+
+    # the cheapest bound first, for all the models
+    bounds = [rg_bound( src_desc, desc ) for desc in trg_descs]
+    order = sorted( range( len(trg_descs) ), key=lambda i: (bounds[i], i) )
+
+    # max-heap of the best (rmsd, position), as (-rmsd, -position)
+    heap = []
+    (scored, pruned) = (0, 0)
+    for i in order:
+        if( len(heap) == k ):
+            worst = -heap[0][0]
+            if( bounds[i] > worst ):
+                # every model left has a larger bound
+                break
+            if( distance_bound( src_desc, trg_descs[i] ) > worst ):
+                pruned += 1
+                continue
+
+        value = rmsd( src_desc.arrays, trg_descs[i].arrays )
+        scored += 1
+        if( value is None ):
+            continue
+
+        item = (-value, -i)
+        if( len(heap) < k ):
+            heapq.heappush( heap, item )
+        elif( item > heap[0] ):
+            heapq.heapreplace( heap, item )
+
+    hits = sorted( [(-value, -i) for (value, i) in heap] )
+    return( NearestModels( hits, scored, pruned, len(trg_descs) ) )
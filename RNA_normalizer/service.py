@@ -0,0 +1,275 @@
+#  service.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  rna-assess-service: local HTTP service scoring submissions against warm
+#  native structures
+#
+#  The natives file has one row per puzzle: <problem> <native> <native index>
+#  ('-' for no index). The natives are parsed and annotated once by the
+#  service and published in shared memory, where every worker attaches to
+#  them, so a request only pays for the model.
+#
+#  Requests (JSON bodies):
+#      POST /score    {"problem": 14, "model": "path.pdb", "model_index": "path.index"}
+#      GET  /natives  problems served
+#      GET  /health
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from .fileio import read_text
+from .msgs import *
+
+#
+# the natives of every puzzle, parsed and annotated once
+#
+class NativeCache:
+    def __init__(self, natives):
+        # natives: {problem: (native file, native index)}
+        self.natives = dict( natives )
+        self._arrays = {}
+    
+    def problems(self):
+        return( sorted( self.natives.keys() ) )
+    
+    def get(self, problem):
+        arrays = self._arrays.get( problem, None )
+        
+        if( (arrays is None) and (problem in self.natives) ):
+            from .assess import load_struct
+            
+            (native_file, native_index) = self.natives[problem]
+            struct = load_struct( native_file, native_index )
+            if( struct is not None ):
+                arrays = struct.arrays
+                self._arrays[problem] = arrays
+        
+        return( arrays )
+    
+    def preload(self):
+        for problem in self.problems():
+            self.get( problem )
+        
+        return( dict( self._arrays ) )
+
+def read_natives( fname ):
+    from .batch import _manifest_path
+    
+    base_dir = os.path.dirname( os.path.abspath( fname ) )
+    natives = {}
+    
+    for (i, row) in enumerate( read_text( fname ).split( "\n" ) ):
+        row = row.strip()
+        if( row.startswith( "#" ) or (row == "") ):
+            continue
+        
+        data = row.split()
+        if( (len(data) != 3) or (not data[0].isdigit()) ):
+            show( "ERROR", "Bad natives row %d in '%s': '%s'" %(i + 1, fname, row) )
+            return( None )
+        
+        natives[int(data[0])] = (_manifest_path( base_dir, data[1] ), _manifest_path( base_dir, data[2] ))
+    
+    return( natives )
+
+def eval_record( eval ):
+    record = {}
+    for attr in ("ok", "problem", "original", "lab", "result", "rmsd", "pvalue", "pvalue_plus", "pvalue_minus", "DI_ALL",
+                 "INF_ALL", "INF_WC", "INF_NWC", "INF_STACK", "clashscore", "mcq", "gdt", "rg", "best_sol_ndx"):
+        value = getattr( eval, attr )
+        # numpy scalars are not JSON serializable
+        record[attr] = value.item() if hasattr( value, "item" ) else value
+    
+    # residues without fitted atoms are nan, not valid JSON
+    if( eval.residue_rmsd is not None ):
+        record["residue_rmsd"] = [None if value != value else value for value in eval.residue_rmsd.tolist()]
+    
+    if( eval.subset_rmsd is not None ):
+        record["subset_rmsd"] = dict( [(name, None if value != value else value) for (name, value) in eval.subset_rmsd.items()] )
+    
+    if( eval.local_rmsd is not None ):
+        record["local_rmsd"] = dict( [(str(k), [None if value != value else value for value in profile.tolist()]) for (k, profile) in eval.local_rmsd.items()] )
+    
+    record["row"] = str(eval)
+    return( record )
+
+# --- worker side ---
+# native arrays by problem, attached from shared memory
+_natives = {}
+
+def _init_worker( handles ):
+    global _natives
+    from .sharedmem import attach_all
+    
+    _natives = attach_all( handles )
+
+def score( problem, model_file, model_index, pvalue_param="-" ):
+    from .assess import evaluate_model
+    
+    eval = evaluate_model( problem, _natives[problem], model_file, model_index, pvalue_param )
+    return( eval_record( eval ) )
+# ---
+
+class AssessmentService:
+    def __init__(self, natives, workers=None, max_pending=64, pvalue_param="-"):
+        from concurrent.futures import ProcessPoolExecutor
+        from .sharedmem import SharedNatives
+        
+        self.shared = SharedNatives()
+        for (problem, arrays) in NativeCache( natives ).preload().items():
+            self.shared.publish( problem, arrays )
+        
+        self.natives = dict( [(problem, natives[problem]) for problem in self.shared.handles] )
+        self.pvalue_param = pvalue_param
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor( max_workers=self.workers, initializer=_init_worker, initargs=(self.shared.handles,) )
+        # bounds the submissions waiting for a worker
+        self.pending = asyncio.Semaphore( max_pending )
+    
+    async def score(self, problem, model_file, model_index=None):
+        if( problem not in self.natives ):
+            return( 404, {"error": "unknown problem %s" %problem} )
+        
+        if( not os.path.isfile( model_file ) ):
+            return( 404, {"error": "model '%s' not found" %model_file} )
+        
+        async with self.pending:
+            loop = asyncio.get_running_loop()
+            record = await loop.run_in_executor( self.pool, score, problem, model_file, model_index, self.pvalue_param )
+        
+        return( 200, record )
+    
+    async def dispatch(self, method, path, body):
+        if( (method == "GET") and (path == "/health") ):
+            return( 200, {"status": "ok"} )
+        
+        if( (method == "GET") and (path == "/natives") ):
+            return( 200, {"problems": sorted( self.natives.keys() )} )
+        
+        if( (method == "POST") and (path == "/score") ):
+            try:
+                request = json.loads( body.decode() or "{}" )
+                problem = int(request["problem"])
+                model_file = request["model"]
+            except (ValueError, KeyError, TypeError) as e:
+                return( 400, {"error": "bad request: %s" %e} )
+            
+            return( await self.score( problem, model_file, request.get( "model_index", None ) ) )
+        
+        return( 404, {"error": "no route for %s %s" %(method, path)} )
+    
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            (method, path) = request_line.decode( "latin-1" ).split()[:2]
+            
+            headers = {}
+            while( True ):
+                line = await reader.readline()
+                if( line in (b"\r\n", b"\n", b"") ):
+                    break
+                (name, value) = line.decode( "latin-1" ).split( ":", 1 )
+                headers[name.strip().lower()] = value.strip()
+            
+            body = await reader.readexactly( int(headers.get( "content-length", 0 )) )
+            (status, payload) = await self.dispatch( method, path, body )
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            (status, payload) = (400, {"error": "malformed request: %s" %e})
+        except Exception as e:
+            (status, payload) = (500, {"error": str(e)})
+        
+        data = json.dumps( payload ).encode()
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+        writer.write( b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" %(status, reasons[status].encode(), len(data)) )
+        writer.write( data )
+        
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+    
+    async def warm_up(self):
+        # make every worker attach to the natives before the first submission
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather( *[loop.run_in_executor( self.pool, _ping ) for i in range( self.workers )] )
+        show( "INFO", "%d workers ready" %len(set( pids )) )
+    
+    async def serve(self, host="127.0.0.1", port=8642, unix_socket=None):
+        await self.warm_up()
+        
+        if( unix_socket is not None ):
+            server = await asyncio.start_unix_server( self.handle, path=unix_socket )
+            show( "INFO", "Serving %d natives on unix socket '%s'" %(len(self.natives), unix_socket) )
+        else:
+            server = await asyncio.start_server( self.handle, host, port )
+            show( "INFO", "Serving %d natives on http://%s:%d" %(len(self.natives), host, port) )
+        
+        async with server:
+            await server.serve_forever()
+    
+    def close(self):
+        self.pool.shutdown()
+        self.shared.close()
+
+def _ping():
+    import time
+    
+    # busy workers make the pool start the next one instead of reusing it
+    time.sleep( 0.2 )
+    return( os.getpid() )
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog="rna-assess-service", description="Scores submissions against warm native structures over HTTP." )
+    parser.add_argument( "natives", help="rows of: problem native native_index ('-' for no index)" )
+    parser.add_argument( "--host", default="127.0.0.1" )
+    parser.add_argument( "--port", type=int, default=8642 )
+    parser.add_argument( "--unix-socket", default=None, help="listen on this unix socket instead of TCP" )
+    parser.add_argument( "-j", "--workers", type=int, default=None, help="scoring processes (default: CPU count)" )
+    parser.add_argument( "--max-pending", type=int, default=64, help="submissions queued for the workers at once" )
+    parser.add_argument( "--pvalue", choices=["+", "-"], default="-" )
+    parser.add_argument( "--annotator", choices=["mcannotate", "geometric"], default=None, help="base-pair and stacking annotator (default: $RNA_ASSESSMENT_ANNOTATOR or mcannotate)" )
+    args = parser.parse_args( argv )
+    
+    # through the environment, so the worker processes use it too
+    if( args.annotator is not None ):
+        os.environ["RNA_ASSESSMENT_ANNOTATOR"] = args.annotator
+    
+    natives = read_natives( args.natives )
+    if( natives is None ):
+        return( 2 )
+    
+    async def run():
+        service = AssessmentService( natives, args.workers, args.max_pending, args.pvalue )
+        try:
+            await service.serve( args.host, args.port, args.unix_socket )
+        finally:
+            service.close()
+    
+    try:
+        asyncio.run( run() )
+    except KeyboardInterrupt:
+        pass
+    
+    return( 0 )
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,96 @@
+#  sharedmem.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  publishes the AtomArrays of native structures in shared memory so worker
+#  processes attach to them instead of parsing or unpickling the natives
+#
+#  The parent process keeps a SharedNatives (which owns and finally unlinks
+#  the segments) and passes its picklable handles to the workers; a worker
+#  calls attach() once and reads the arrays in place.
+
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .arrays import AtomArrays
+
+def _create( array ):
+    # zero-sized segments are not allowed
+    shm = shared_memory.SharedMemory( create=True, size=max( array.nbytes, 1 ) )
+    view = np.ndarray( array.shape, dtype=array.dtype, buffer=shm.buf )
+    view[...] = array
+    return( shm )
+
+def _open( name ):
+    if( sys.version_info >= (3, 13) ):
+        return( shared_memory.SharedMemory( name=name, track=False ) )
+    return( shared_memory.SharedMemory( name=name ) )
+
+class SharedNatives:
+    def __init__(self):
+        self._segments = []
+        self.handles = {}
+    
+    def publish( self, key, arrays ):
+        handle = {}
+        for field in AtomArrays.FIELDS:
+            array = np.ascontiguousarray( getattr( arrays, field ) )
+            shm = _create( array )
+            self._segments.append( shm )
+            handle[field] = (shm.name, array.shape, array.dtype.str)
+        
+        self.handles[key] = handle
+        return( handle )
+    
+    def close( self ):
+        for shm in self._segments:
+            shm.close()
+            shm.unlink()
+        
+        self._segments = []
+        self.handles = {}
+    
+    def __enter__( self ):
+        return( self )
+    
+    def __exit__( self, *exc ):
+        self.close()
+
+# --- worker side ---
+# the segments attached by the worker: they stay mapped while it lives (its
+# arrays are views on them) and are unmapped when it ends; the parent unlinks
+# them with SharedNatives.close()
+_attached = []
+
+def attach( handle ):
+    fields = {}
+    for field in AtomArrays.FIELDS:
+        (name, shape, dtype) = handle[field]
+        shm = _open( name )
+        _attached.append( shm )
+        
+        array = np.ndarray( shape, dtype=np.dtype( dtype ), buffer=shm.buf )
+        array.flags.writeable = False
+        fields[field] = array
+    
+    return( AtomArrays( **fields ) )
+
+def attach_all( handles ):
+    return( dict( [(key, attach( handle )) for (key, handle) in handles.items()] ) )
@@ -22,6 +22,7 @@ from operator import attrgetter
 import os
 
 from .msgs import *
+from .fileio import *
 
 def command( cmd ):
     ret_code = os.system( cmd )
@@ -39,29 +40,49 @@ class Result:
 def read_results_list( problem, fname ):
     results = {}
     
-    rows = filter( lambda row: len(row) == 3, map( lambda row: row.split(), open( fname ).read().strip().split( "\n" ) ) )
+    rows = filter( lambda row: len(row) == 3, map( lambda row: row.split(), read_text( fname ).strip().split( "\n" ) ) )
     
     for row in rows:
         results[row[0]] = Result( problem, row[0], row[1], int(row[2]) )
     
     return( results )
 
-def get_index_file( pdb_file, pdb_result_file="" ):
-    index_file = "%s.%s.index" %(pdb_file.replace( ".pdb", "" ), pdb_result_file.replace( ".pdb", "" ))
+#
+# the index files that may go with 'pdb_file', by priority: the one specific
+# to the result 'pdb_result_file' first, then the generic one
+#
+def index_file_names( pdb_file, pdb_result_file="" ):
+    # 'x.pdb.gz' uses the index of 'x.pdb'
+    pdb_name = strip_compression( pdb_file )
+    names = []
+    
+    if( pdb_result_file != "" ):
+        names.append( "%s.%s.index" %(pdb_name.replace( ".pdb", "" ), strip_compression( pdb_result_file ).replace( ".pdb", "" )) )
+    names.append( pdb_name.replace( ".pdb", ".index" ) )
+    
+    return( names )
 
-    if (pdb_result_file is "") or (not os.path.isfile( index_file )):
-        index_file = pdb_file.replace( ".pdb", ".index" )
+def get_index_file( pdb_file, pdb_result_file="" ):
+    names = index_file_names( pdb_file, pdb_result_file )
+    
+    # the index itself may be compressed too
+    index_file = names[-1]
+    for name in names:
+        if( find_input( name ) is not None ):
+            index_file = name
+            break
     
-    if( not os.path.isfile( index_file ) ):
+    if( find_input( index_file ) is None ):
         show( "INFO", "INDEX SKIPPED! '%s' skipped for '%s'." %(index_file, pdb_file) )
         index_file= None
     else:
+        index_file = find_input( index_file )
         show( "INFO", "INDEX FOUND! '%s' for '%s'." %(index_file, pdb_file) )
 
     return( index_file )
 
 def molprobity_parse(f, evals):
-	for line in file(f):
+	for line in iter_lines( f ):
 		line = line.strip()
 		
 		if( (line != "") and ("#" not in line) ):
@@ -92,6 +113,9 @@ class Eval:
         self.rmsd = 1e100
         #~ self.rmsb = 1e100
         self.pvalue = 1e100
+        # both parameter sets of the p-value, pvalue is one of them
+        self.pvalue_plus = 1e100
+        self.pvalue_minus = 1e100
         self.DI_ALL = 1e100
         self.INF_ALL = 0.0
         self.INF_WC = 0.0
@@ -101,6 +125,11 @@ class Eval:
         self.best_sol_ndx = -1
         self.mcq=1e100
         self.gdt=1e100
+        # not saved by __str__()
+        self.rg = 1e100
+        self.residue_rmsd = None
+        self.subset_rmsd = None
+        self.local_rmsd = None
     
     def parse(self, row):
         result = True
@@ -220,7 +249,7 @@ def find_eval( evals, problem, lab, result ):
 def load_evals_list( fname ):
     evals = []
     
-    rows = open( fname ).read().strip().split( "\n" )
+    rows = read_text( fname ).strip().split( "\n" )
     
     for row in rows:
         eval = Eval()
@@ -0,0 +1,164 @@
+#  mcannotate_parse.py
+#
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  compares the MC-Annotate output parser with the previous one (per-line
+#  uncompiled regexes, kept below) on large synthetic outputs; both must
+#  give the same annotations
+#
+#  Usage:
+#  $ python benchmarks/mcannotate_parse.py [residues] [repeats]
+
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+
+from RNA_normalizer.mcannotate import MCAnnotate, convert_pair, convert_stack
+
+NTS = "ACGU"
+EDGES = ("Ww", "Hh", "Ss", "Ws", "O2P", "Bh")
+
+def rule( title ):
+    return( "%s %s" %(title, "-" * (64 - len(title) - 1)) )
+
+# an MC-Annotate output with 'n' residues on chains of 1000
+def synthetic_output( n, seed=0 ):
+    rnd = random.Random( seed )
+    ids = ["%s%d" %(chr( ord( "A" ) + i // 1000 ), i % 1000 + 1) for i in range( n )]
+    nts = [rnd.choice( NTS ) for i in range( n )]
+
+    lines = [rule( "Residue conformations" )]
+    for (res, nt) in zip( ids, nts ):
+        lines.append( "%s : %s C3p_endo anti" %(res, nt) )
+
+    lines.append( rule( "Adjacent stackings" ) )
+    for i in range( n - 1 ):
+        lines.append( "%s-%s : adjacent_5p %s " %(ids[i], ids[i + 1], rnd.choice( ("upward", "downward", "inward", "outward") )) )
+    lines.append( rule( "Non-Adjacent stackings" ) )
+    for i in range( n // 10 ):
+        (a, b) = sorted( rnd.sample( range( n ), 2 ) )
+        lines.append( "%s-%s : %s pairing" %(ids[a], ids[b], rnd.choice( ("upward", "inward") )) )
+    lines.append( "Number of stackings = %d" %(n - 1 + n // 10) )
+
+    lines.append( rule( "Base-pairs" ) )
+    for i in range( n // 2 ):
+        (a, b) = rnd.sample( range( n ), 2 )
+        if( rnd.random() < 0.8 ):
+            tail = "pairing %s %s XIX " %(rnd.choice( ("parallel", "antiparallel") ), rnd.choice( ("cis", "trans") ))
+        else:
+            tail = "pairing "
+        lines.append( "%s-%s : %s-%s %s/%s %s" %(ids[a], ids[b], nts[a], nts[b], rnd.choice( EDGES ), rnd.choice( EDGES ), tail) )
+
+    return( [line + "\n" for line in lines] )
+
+# the previous parser, for reference
+def legacy_parse( lines ):
+    STATE_OUT = 0
+    STATE_RESIDUE = 1
+    STATE_PAIR = 2
+    STATE_STACK = 3
+
+    pattern_pair = r"^([A-Z]|\'[0-9]\'|)(\d+)-([A-Z]|\'[0-9]\'|)(\d+) : (\w+)-(\w+) ([\w\']+)/([\w\']+)(?:.*)pairing( (parallel|antiparallel) (cis|trans))"
+    pattern_stack = r"^([A-Z]|\'[0-9]\'|)(\d+)-([A-Z]|\'[0-9]\'|)(\d+) :.*(inward|upward|downward|outward).*"
+
+    residues = []
+    interactions = []
+
+    model_count = 0
+    state = STATE_OUT
+    for line in lines:
+        line = line.strip()
+
+        if( line.startswith( "Residue conformations" ) ):
+            if( model_count == 0 ):
+                state = STATE_RESIDUE
+                model_count += 1
+                continue
+            else:
+                break
+
+        if( line.startswith( "Base-pairs" ) ):
+            state = STATE_PAIR
+            continue
+
+        if( line.startswith( "Adjacent stackings" ) or line.startswith( "Non-Adjacent stackings" ) ):
+            state = STATE_STACK
+            continue
+
+        if( line.endswith( "----------" ) ):
+            state = STATE_OUT
+            continue
+
+        interaction = None
+
+        if( state == STATE_RESIDUE ):
+            data = line.split()
+
+            if( len(data) == 5 ):
+                residues.append( (data[0][0], data[0][1:], data[2]) )
+
+        if( state == STATE_PAIR ):
+            match = re.match( pattern_pair, line )
+
+            if( match != None ):
+                interaction = convert_pair( match.groups() )
+
+        if( state == STATE_STACK ):
+            match = re.match( pattern_stack, line )
+
+            if( match != None ):
+                interaction = convert_stack( match.groups() )
+
+        if( interaction != None ):
+            interactions.append( interaction )
+
+    return( residues, interactions )
+
+def current_parse( lines ):
+    mca = MCAnnotate()
+    mca.parse_lines( lines )
+    return( mca.residues, mca.interactions )
+
+def best_ms( parse, lines, repeats ):
+    times = []
+    for i in range( repeats ):
+        t = time.perf_counter()
+        parse( lines )
+        times.append( (time.perf_counter() - t) * 1000.0 )
+    return( min( times ) )
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    lines = synthetic_output( n )
+
+    if( legacy_parse( lines ) != current_parse( lines ) ):
+        print("the parsers disagree")
+        sys.exit( 1 )
+
+    legacy = best_ms( legacy_parse, lines, repeats )
+    current = best_ms( current_parse, lines, repeats )
+    print("%d residues, %d lines" %(n, len(lines)))
+    print("%-10s %8.1f ms" %("legacy", legacy))
+    print("%-10s %8.1f ms  (x%.1f)" %("current", current, legacy / current))
@@ -0,0 +1,71 @@
+#  startup.py
+#  
+#  Copyright 2017 Chichau Miau <zmiao@ebi.ac.uk>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  measures the cold-start time of the package in fresh interpreters
+#
+#  Usage:
+#  $ python benchmarks/startup.py [repeats]
+
+import compileall
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+# (name, python arguments, target in ms on top of the bare interpreter)
+CASES = [
+    ("import", ["-c", "import RNA_normalizer"], 30.0),
+    ("cli", ["-m", "RNA_normalizer.batch", "--help"], 50.0),
+]
+
+def run_once( args ):
+    env = dict( os.environ )
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get( "PYTHONPATH", "" )
+    
+    t = time.perf_counter()
+    subprocess.run( [sys.executable] + args, env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL )
+    return( (time.perf_counter() - t) * 1000.0 )
+
+def median_ms( args, repeats ):
+    # the first run only warms the file cache
+    run_once( args )
+    
+    times = sorted( [run_once( args ) for i in range( repeats )] )
+    return( times[len(times) // 2] )
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 11
+    
+    # the bytecode is written here, as the runs may not write it
+    # (PYTHONDONTWRITEBYTECODE) and would compile the sources every time
+    compileall.compile_dir( os.path.join( ROOT, "RNA_normalizer" ), quiet=1 )
+    
+    base = median_ms( ["-c", "pass"], repeats )
+    print("%-10s %8.1f ms" %("python", base))
+    
+    ok = True
+    for (name, args, target) in CASES:
+        cost = median_ms( args, repeats ) - base
+        status = "ok" if cost <= target else "SLOW"
+        ok = ok and (cost <= target)
+        print("%-10s %8.1f ms  (target %.0f ms)  %s" %(name, cost, target, status))
+    
+    sys.exit( 0 if ok else 1 )
@@ -59,13 +59,12 @@ def calc_RMSD(native_file, native_index, prediction_file, prediction_index, PVAL
 		sys.stderr.write("DATA Solution sequence --> '%s'\n" %sol_raw_seq )
 		sys.stderr.write("DATA Result sequence   --> '%s'\n" %res_raw_seq )
 		return(-1)
-	# computes the RMSD
+	# computes the RMSD and the p-value from a single superposition
 	comparer = RNA_normalizer.PDBComparer()
-	rmsd = comparer.rmsd( sol_struct, res_struct )
-	sys.stderr.write("INFO Partial RMSD --> %f\n" %rmsd )
-	pvalue = comparer.pvalue( rmsd, len(sol_raw_seq), PVALUE )
-	sys.stderr.write("INFO Partial P-Value --> %e\n" %pvalue )
-	return(rmsd, pvalue)
+	eval = comparer.score( sol_struct, res_struct, metrics=("rmsd", "pvalue"), pvalue_param=PVALUE )
+	sys.stderr.write("INFO Partial RMSD --> %f\n" %eval.rmsd )
+	sys.stderr.write("INFO Partial P-Value --> %e\n" %eval.pvalue )
+	return(eval.rmsd, eval.pvalue)
 
 def InteractionNetworkFidelity(native_file, native_index, prediction_file, prediction_index):
 	res_struct = RNA_normalizer.PDBStruct()
@@ -81,15 +80,10 @@ def InteractionNetworkFidelity(native_file, native_index, prediction_file, predi
 		sys.stderr.write("DATA Solution sequence --> '%s'\n" %sol_raw_seq )
 		sys.stderr.write("DATA Result sequence   --> '%s'\n" %res_raw_seq )
 		return(-1)
-	# computes the RMSD
+	# computes the RMSD, the INFs and the DI in one pass
 	comparer = RNA_normalizer.PDBComparer()
-	rmsd = comparer.rmsd( sol_struct, res_struct )
-	INF_ALL = comparer.INF( sol_struct, res_struct, type="ALL" )
-	DI_ALL = rmsd / INF_ALL
-	INF_WC = comparer.INF( sol_struct, res_struct, type="PAIR_2D" )
-	INF_NWC = comparer.INF( sol_struct, res_struct, type="PAIR_3D" )
-	INF_STACK = comparer.INF( sol_struct, res_struct, type="STACK" )
-	return (rmsd,DI_ALL, INF_ALL, INF_WC, INF_NWC,INF_STACK)
+	eval = comparer.score( sol_struct, res_struct, metrics=("DI_ALL", "INF_WC", "INF_NWC", "INF_STACK") )
+	return (eval.rmsd,eval.DI_ALL, eval.INF_ALL, eval.INF_WC, eval.INF_NWC,eval.INF_STACK)
 	
 
 if __name__ == '__main__':
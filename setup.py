@@ -16,7 +16,12 @@ setup(
         packages=find_packages(),
         install_requires=[
             'biopython'],
-        scripts=['example/example.py'],
+        entry_points={
+            'console_scripts': [
+                'rna-assess=RNA_normalizer.batch:main',
+                'rna-assess-service=RNA_normalizer.service:main',
+            ],
+        },
         author='Chichau Miau',
         author_email='zmiao@ebi.ac.uk',
         license='MIT'